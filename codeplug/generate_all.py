@@ -1,13 +1,54 @@
 #!/usr/bin/env python3
 
 # execute all generate.py files in subdirectories of this
-# scripts directory
+# scripts directory, in parallel: the processes share the
+# download cache and the repeaterbook rate limit
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import subprocess
 import sys
 
+DEFAULT_JOBS = 4
+
+parser = argparse.ArgumentParser(
+    description="Run all generate.py scripts below this directory"
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=DEFAULT_JOBS,
+    help="Number of generate.py scripts to run at once (default: %(default)s)",
+)
+args = parser.parse_args()
+
 cp_dir = Path(__file__).parent
+generate_pys = sorted(cp_dir.glob("**/generate.py"))
+
+
+def generate(genpy):
+    # capture the output so lines from concurrent scripts are not interleaved
+    proc = subprocess.run(
+        [sys.executable, genpy],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    prefix = genpy.parent.relative_to(cp_dir)
+    output = "".join(
+        "[{}] {}\n".format(prefix, line) for line in proc.stdout.splitlines()
+    )
+    # write each script's output in one call, after it finishes
+    sys.stdout.write(output)
+    sys.stdout.flush()
+    return proc.returncode
+
+
+with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+    returncodes = list(pool.map(generate, generate_pys))
 
-for genpy in cp_dir.glob("**/generate.py"):
-    subprocess.check_call([sys.executable, genpy])
+failed = [str(genpy) for genpy, rc in zip(generate_pys, returncodes) if rc]
+if failed:
+    sys.exit("Failed: {}".format(", ".join(failed)))
@@ -36,6 +36,9 @@ setuptools.setup(
         'importlib-resources',
         'requests~=2.31',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     classifiers=[
         'Intended Audience :: Developers',
         'Development Status :: 3 - Alpha',
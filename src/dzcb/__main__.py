@@ -30,6 +30,12 @@ if __name__ == "__main__":
         action="store_true",
         help="Fetch the latest seattledmr K7ABD input files",
     )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use previously downloaded pnwdigital, seattledmr, and "
+        "repeaterbook data, never contact the upstream sources",
+    )
     parser.add_argument(
         "--default-k7abd",
         action="store_true",
@@ -64,6 +70,20 @@ if __name__ == "__main__":
             )
         ),
     )
+    parser.add_argument(
+        "--repeaterbook-write-k7abd",
+        action="store_true",
+        help="Also write repeaterbook proximity zones as K7ABD CSV files "
+        "in the 'cache/repeaterbook' subdir",
+    )
+    parser.add_argument(
+        "--repeaterbook-db",
+        nargs="?",
+        const=True,
+        metavar="DB",
+        help="Store repeaterbook data in a SQLite database and query proximity "
+        "zones from it. Default: repeaterbook.sqlite in the user cache dir",
+    )
     parser.add_argument(
         "--scanlists-json",
         default=None,
@@ -100,6 +120,20 @@ if __name__ == "__main__":
         metavar="CSV",
         help="Specify one or more CSV files with object name replacements",
     )
+    parser.add_argument(
+        "--seattledmr-repeater-fixups",
+        nargs="*",
+        metavar="CSV",
+        help="Specify one or more Pattern,Repl CSV files with regular expression "
+        "rewrites of the downloaded seattledmr repeaters",
+    )
+    parser.add_argument(
+        "--seattledmr-talkgroup-fixups",
+        nargs="*",
+        metavar="CSV",
+        help="Specify one or more Pattern,Repl CSV files with regular expression "
+        "rewrites of the downloaded seattledmr talkgroups",
+    )
     parser.add_argument(
         "--anytone",
         nargs="*",
@@ -147,12 +181,17 @@ if __name__ == "__main__":
         source_repeaterbook_proximity=args.repeaterbook_proximity_csv,
         repeaterbook_states=args.repeaterbook_state,
         repeaterbook_name_format=args.repeaterbook_name_format,
+        repeaterbook_write_k7abd=args.repeaterbook_write_k7abd,
+        repeaterbook_db=args.repeaterbook_db,
+        offline=args.offline,
         scanlists_json=args.scanlists_json,
         include=args.include,
         exclude=args.exclude,
         order=args.order,
         reverse_order=args.reverse_order,
         replacements=args.replacements,
+        seattledmr_repeater_fixups=args.seattledmr_repeater_fixups,
+        seattledmr_talkgroup_fixups=args.seattledmr_talkgroup_fixups,
         output_anytone=is_specified(args.anytone),
         output_dmrconfig=is_specified(args.dmrconfig_template),
         output_farnsworth=is_specified(args.farnsworth_template_json),
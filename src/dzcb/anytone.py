@@ -14,7 +14,13 @@ import logging
 from pathlib import Path
 
 from dzcb import AMATEUR_220, COMMERCIAL_UHF, COMMERCIAL_VHF
-from dzcb.model import AnalogChannel, Bandwidth, DigitalChannel, uniquify_contacts
+from dzcb.model import (
+    AnalogChannel,
+    Bandwidth,
+    DigitalChannel,
+    union_frequency_ranges,
+    uniquify_contacts,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -463,6 +469,17 @@ def ScanList_to_dict(index, scanlist, expand_members):
     return d
 
 
+def frequency_ranges(models=None):
+    """
+    :return: tuple of (low, high) frequency ranges supported by any of the models
+    """
+    if models is None:
+        models = tuple(DEFAULT_SUPPORTED_RADIOS)
+    return union_frequency_ranges(
+        SUPPORTED_RADIOS[model_id]["frequency_range"] for model_id in models
+    )
+
+
 def Codeplug_to_anytone_csv(cp, output_dir, models=None):
     if models is None:
         models = tuple(DEFAULT_SUPPORTED_RADIOS)
@@ -6,3 +6,6 @@ dzcb.exceptions - errors that may be raised
 class InvalidDmrID(ValueError):
     pass
 
+
+class CacheMiss(LookupError):
+    """A url is not cached and may not be fetched (offline mode)."""
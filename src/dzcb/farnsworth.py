@@ -12,6 +12,7 @@ from dzcb.model import (
     uniquify_contacts,
 )
 import dzcb.munge
+import dzcb.tone
 
 logger = logging.getLogger(__name__)
 
@@ -150,16 +151,8 @@ def AnalogChannel_to_dict(c, codeplug):
         }
     )
     d["Name"] = c.short_name
-    if d["CtcssEncode"]:
-        if d["CtcssEncode"].startswith("D"):
-            d["CtcssEncode"] += "N"
-    else:
-        d["CtcssEncode"] = "None"
-    if d["CtcssDecode"]:
-        if d["CtcssDecode"].startswith("D"):
-            d["CtcssDecode"] += "N"
-    else:
-        d["CtcssDecode"] = "None"
+    d["CtcssEncode"] = dzcb.tone.dcs_normal(d["CtcssEncode"], off="None")
+    d["CtcssDecode"] = dzcb.tone.dcs_normal(d["CtcssDecode"], off="None")
     return d
 
 
@@ -226,14 +219,21 @@ def Zone_to_dict(z):
     }
 
 
-def Codeplug_to_json(cp, based_on=None):
-    cp_dict = {}
-    if based_on is not None:
-        if hasattr(based_on, "read"):
-            cp_dict = json.load(based_on)
-        else:
-            cp_dict = json.loads(based_on)
-    # determine supported frequency range from BasicInformation
+def _load_based_on(based_on):
+    if based_on is None:
+        return {}
+    if hasattr(based_on, "read"):
+        return json.load(based_on)
+    return json.loads(based_on)
+
+
+def frequency_ranges(cp_dict):
+    """
+    Determine supported frequency range from BasicInformation
+
+    :param cp_dict: editcp JSON codeplug as python objects
+    :return: list of (low, high) frequency, or None if the range is unknown
+    """
     ranges = []
     basic_info = cp_dict.get("BasicInformation", {})
     if "LowFrequency" in basic_info:
@@ -241,6 +241,13 @@ def Codeplug_to_json(cp, based_on=None):
     elif "LowFrequencyA" in basic_info:
         ranges.append((basic_info["LowFrequencyA"], basic_info["HighFrequencyA"]))
         ranges.append((basic_info["LowFrequencyB"], basic_info["HighFrequencyB"]))
+    return ranges or None
+
+
+def Codeplug_to_json(cp, based_on=None):
+    cp_dict = _load_based_on(based_on)
+    basic_info = cp_dict.get("BasicInformation", {})
+    ranges = frequency_ranges(cp_dict)
     if ranges:
         cp = cp.filter(ranges=ranges)
     contacts_by_id = {
@@ -0,0 +1,984 @@
+"""
+dzcb.fetch - shared helpers for fetching remote source data
+"""
+import atexit
+import codecs
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import http.cookiejar
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import threading
+import time
+
+import attr
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+from . import appdir
+from dzcb.exceptions import CacheMiss
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+# seconds to wait for the upstream before falling back to a stale copy
+DEFAULT_TIMEOUT = 60
+# downloaded source data, shared by all sources
+HTTP_CACHE_DIR = Path(appdir.user_cache_dir) / "http"
+# least recently used downloads are evicted beyond this many bytes
+HTTP_CACHE_MAX_SIZE = 512 * 1024 * 1024
+HTTP_CACHE_MANIFEST = "manifest.json"
+# repeaterbook downloads cached before the BlobStore: "repeaters_<md5 of url>.json"
+_LEGACY_CACHE_FILE = re.compile(r"^repeaters_[0-9a-f]{32}\.json$")
+HTTP_CACHE_MANIFEST_FORMAT = 1
+# seconds between access time updates of a cache entry
+HTTP_CACHE_ACCESS_RESOLUTION = 60
+# connection errors and these statuses are retried, with exponential backoff
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# connections kept open per host
+POOL_MAXSIZE = 2 * DEFAULT_MAX_WORKERS
+# once a mirror responds, seconds to wait for the preferred urls
+MIRROR_PATIENCE = 5
+# response bodies are streamed to disk in chunks of this many bytes
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+# seconds to wait at exit for background revalidation to finish
+REVALIDATE_EXIT_TIMEOUT = DEFAULT_TIMEOUT
+
+# status_retries -> requests.Session, see `shared_session`
+_shared_sessions = {}
+_shared_sessions_lock = threading.Lock()
+# background revalidation threads of all HTTPCache
+_revalidations = set()
+_revalidations_lock = threading.Lock()
+# manifest path -> (stat key, entries) of the last manifest read
+_manifests = {}
+# manifest path -> RLock serializing updates within this process (the file
+# lock serializes processes)
+_manifest_locks = {}
+_manifest_locks_lock = threading.Lock()
+
+
+def _lock_path(path):
+    return path.with_name(path.name + ".lock")
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on the file `path`, created if needed, waiting for
+    other processes (or threads) holding it. Not reentrant.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds, keep waiting
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@attr.s
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    One token is added every `interval` seconds, up to `capacity` tokens.
+    `acquire` takes a token, sleeping until one is available. Tokens are
+    reserved under the lock, so concurrent callers are spaced `interval`
+    seconds apart rather than all waking at once. Background work that may
+    be abandoned polls for a token instead (see `acquire`).
+
+    :param path: when set, the bucket is kept in this file, under a file
+        lock, and shared by every process using the same path; the clock
+        defaults to wall clock time, which is comparable between processes
+    """
+
+    interval = attr.ib(converter=float)
+    capacity = attr.ib(default=1, converter=float)
+    clock = attr.ib(default=None, repr=False)
+    sleep = attr.ib(default=time.sleep, repr=False)
+    path = attr.ib(default=None, converter=attr.converters.optional(Path))
+    _tokens = attr.ib(default=None, init=False, repr=False)
+    _updated = attr.ib(default=None, init=False, repr=False)
+    _lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        if self.clock is None:
+            self.clock = time.monotonic if self.path is None else time.time
+        self._tokens = self.capacity
+        self._updated = self.clock()
+
+    def _refill(self, tokens, updated, now):
+        """:return: tokens available at `now`"""
+        if self.interval > 0:
+            return min(
+                self.capacity,
+                tokens + max(now - updated, 0) / self.interval,
+            )
+        return self.capacity
+
+    def _read_state(self, now):
+        try:
+            state = json.loads(self.path.read_text())
+            return float(state["tokens"]), float(state["updated"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            logger.warning("Reset unreadable rate limit %s: %s", self.path, exc)
+        return self.capacity, now
+
+    def _modify(self, func):
+        """
+        Update the bucket, locked against other threads and processes.
+
+        :param func: called with the tokens available now, returns
+            (tokens left, result)
+        :return: result of func
+        """
+        with self._lock:
+            now = self.clock()
+            if self.path is None:
+                self._tokens, result = func(
+                    self._refill(self._tokens, self._updated, now)
+                )
+                self._updated = now
+                return result
+            with file_lock(_lock_path(self.path)):
+                tokens, result = func(self._refill(*self._read_state(now), now))
+                _write_atomic(
+                    self.path,
+                    json.dumps(dict(tokens=tokens, updated=now)).encode("utf-8"),
+                )
+            return result
+
+    def reserve(self):
+        """
+        Take a token without waiting.
+
+        The bucket goes into debt when no token is available, so the caller
+        must use its slot, or `refund` it.
+
+        :return: seconds until the token may be used
+        """
+
+        def take(tokens):
+            tokens -= 1
+            return tokens, (0 if tokens >= 0 else -tokens * self.interval)
+
+        return self._modify(take)
+
+    def poll(self):
+        """
+        Take a token only if one is available now.
+
+        :return: 0 if a token was taken, otherwise seconds until one is
+            available (nothing is reserved)
+        """
+
+        def take(tokens):
+            if tokens >= 1:
+                return tokens - 1, 0
+            return tokens, (1 - tokens) * self.interval
+
+        return self._modify(take)
+
+    def refund(self):
+        """Return a token taken by `reserve` that will not be used."""
+        self._modify(lambda tokens: (min(tokens + 1, self.capacity), None))
+
+    def acquire(self, reserve=True):
+        """
+        Take a token, sleeping until it is available.
+
+        :param reserve: reserve the token before sleeping, so concurrent
+            callers are served in order (the token is refunded if the sleep
+            is interrupted). Otherwise `poll` until a token is available, so a
+            caller abandoned while sleeping, like a daemon thread at exit,
+            leaves no debt in the bucket.
+        :return: seconds spent waiting
+        """
+        if not reserve:
+            waited = 0
+            while True:
+                wait = self.poll()
+                if wait <= 0:
+                    return waited
+                self.sleep(wait)
+                waited += wait
+        wait = self.reserve()
+        if wait > 0:
+            try:
+                self.sleep(wait)
+            except BaseException:
+                self.refund()
+                raise
+        return wait
+
+
+def map_concurrent(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Call `func` on each of `items` using a pool of `max_workers` threads.
+
+    Exceptions are propagated after all calls are finished.
+
+    :return: list of results in the order of `items`
+    """
+    items = list(items)
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(max_workers, len(items)),
+        thread_name_prefix="dzcb-fetch",
+    ) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        concurrent.futures.wait(futures)
+    return [f.result() for f in futures]
+
+
+def new_session(
+    retries=DEFAULT_RETRIES,
+    backoff_factor=DEFAULT_BACKOFF_FACTOR,
+    status_retries=True,
+):
+    """
+    :param status_retries: retry RETRY_STATUS responses (and failed reads);
+        disable for rate limited APIs, where each request must wait for the
+        rate limit, so only connections that failed before the request was
+        sent are retried
+    :return: requests.Session with a connection pool per host and bounded
+        retries of failed connections and RETRY_STATUS responses
+    """
+    session = requests.Session()
+    # no cookies are kept, so the session holds no per-request state and may
+    # be used by several threads (urllib3 connection pools are thread-safe)
+    session.cookies.set_policy(
+        http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+    )
+    if status_retries:
+        max_retries = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            # the final response is checked by the caller
+            raise_on_status=False,
+        )
+    else:
+        max_retries = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            read=0,
+            other=0,
+            # don't retry 429 and 503 responses with a Retry-After header
+            respect_retry_after_header=False,
+        )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_MAXSIZE,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=max_retries,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def shared_session(status_retries=True):
+    """
+    :return: requests.Session shared by all sources and threads, only used
+        for stateless GET requests (see `new_session`)
+    """
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(status_retries)
+        if session is None:
+            session = _shared_sessions[status_retries] = new_session(
+                status_retries=status_retries
+            )
+        return session
+
+
+def wait_revalidations(timeout=None):
+    """
+    Wait for the background revalidation of every HTTPCache to finish.
+
+    Called at exit (for up to REVALIDATE_EXIT_TIMEOUT seconds), so stale
+    copies served during a run are refreshed for the next one.
+
+    :return: True if all revalidations finished
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with _revalidations_lock:
+            threads = list(_revalidations)
+        if not threads:
+            return True
+        for thread in threads:
+            thread.join(
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+            if thread.is_alive():
+                return False
+
+
+atexit.register(wait_revalidations, REVALIDATE_EXIT_TIMEOUT)
+
+
+class _Cancelled(Exception):
+    """A download was abandoned, see `HTTPCache.get_fastest`."""
+
+
+def _until_cancelled(chunks, cancelled, url):
+    for chunk in chunks:
+        if cancelled.is_set():
+            raise _Cancelled("Abandoned download of {}".format(url))
+        yield chunk
+
+
+def _in_daemon_thread(func, *args, name=None):
+    """
+    Call `func` in a daemon thread, which doesn't hold up interpreter exit
+    (unlike ThreadPoolExecutor workers).
+
+    :return: concurrent.futures.Future of the result
+    """
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+@contextlib.contextmanager
+def atomic_writer(path):
+    """
+    Open a temporary file for writing that replaces `path` when the block
+    completes; readers never see a partial file.
+
+    :return: binary file object
+    """
+    path = Path(path)
+    tmp_path = path.with_name(
+        "{}.{}.{}.tmp".format(path.name, os.getpid(), threading.get_ident())
+    )
+    try:
+        with open(tmp_path, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+@contextlib.contextmanager
+def atomic_text_writer(path, encoding=None):
+    """
+    Like `atomic_writer`, but returns a text file object that doesn't
+    translate newlines.
+    """
+    with atomic_writer(path) as f:
+        with io.TextIOWrapper(f, encoding=encoding, newline="") as text:
+            yield text
+
+
+def _write_atomic(path, data):
+    """Write bytes to path via a temporary file; readers never see a partial file."""
+    with atomic_writer(path) as f:
+        f.write(data)
+
+
+class _EncodingDetector:
+    """Incrementally check whether bytes are valid utf-8."""
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.valid = True
+
+    def feed(self, chunk):
+        if self.valid:
+            try:
+                self.decoder.decode(chunk)
+            except UnicodeDecodeError:
+                self.valid = False
+
+    def encoding(self):
+        """:return: utf-8 if the bytes fed are valid utf-8, otherwise latin-1"""
+        self.feed(b"")
+        if self.valid:
+            try:
+                self.decoder.decode(b"", final=True)
+            except UnicodeDecodeError:
+                self.valid = False
+        return "utf-8" if self.valid else "latin-1"
+
+
+@attr.s(frozen=True)
+class CachedResponse:
+    """
+    Body of a url, stored in an HTTPCache.
+
+    `status` describes where the body came from:
+
+      * fresh: cached copy younger than max_age
+      * fetched: downloaded from the upstream
+      * revalidated: cached copy confirmed by the upstream (304 Not Modified)
+      * revalidating: cached copy served while it is revalidated in the
+        background (see `stale_while_revalidate`)
+      * stale: cached copy served while the upstream is slow or down
+      * offline: cached copy served without contacting the upstream
+    """
+
+    url = attr.ib()
+    path = attr.ib()
+    status = attr.ib()
+    # sha256 hex digest of the body
+    digest = attr.ib(default=None)
+    # text encoding of the body, detected when it was stored, see `encoding`
+    stored_encoding = attr.ib(default=None)
+
+    def derived_path(self, suffix):
+        """
+        :return: Path for a file derived from the body, evicted from the
+            BlobStore along with it
+        """
+        return self.path.with_name(self.path.name + suffix)
+
+    @property
+    def content(self):
+        return self.path.read_bytes()
+
+    @property
+    def text(self):
+        content = self.content
+        try:
+            return content.decode("utf-8")
+        except UnicodeDecodeError:
+            return content.decode("latin-1")
+
+    @property
+    def encoding(self):
+        """
+        utf-8, or latin-1 if the body is not valid utf-8 (see `text`)
+
+        Detected while the body was stored, the body is only read again for
+        entries stored by older versions.
+        """
+        if self.stored_encoding is not None:
+            return self.stored_encoding
+        detector = _EncodingDetector()
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                detector.feed(chunk)
+        return detector.encoding()
+
+    def open_text(self):
+        """
+        :return: text file object reading the body without translating
+            newlines, to process it line by line instead of reading `text`
+        """
+        return open(self.path, "r", encoding=self.encoding, newline="")
+
+
+@functools.lru_cache(maxsize=None)
+def purge_legacy_cache(directory):
+    """
+    Remove the repeaterbook downloads cached before the BlobStore from
+    `directory` (once per process), they are no longer read.
+    """
+    try:
+        paths = list(Path(directory).iterdir())
+    except FileNotFoundError:
+        return
+    for path in paths:
+        if _LEGACY_CACHE_FILE.match(path.name) and path.is_file():
+            logger.info("Remove obsolete cache file %s", path)
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _manifest_lock(manifest_path):
+    with _manifest_locks_lock:
+        return _manifest_locks.setdefault(manifest_path, threading.RLock())
+
+
+@attr.s
+class BlobStore:
+    """
+    Content-addressed store of downloaded bodies.
+
+    Each body is stored once under `blobs/`, named by its sha256 digest, and
+    the manifest maps each key (url) to its blob, size, validators, and
+    fetch and access times. Lookups only read the small manifest, never the
+    blobs. When the blobs exceed `max_size` bytes, the least recently used
+    entries are evicted.
+
+    Files derived from a blob, named by the blob name plus a suffix (see
+    `CachedResponse.derived_path`, like repeaterbook's compact tables), count
+    toward `max_size` and are evicted along with it.
+
+    Blobs and the manifest are replaced atomically, and manifest updates
+    are locked, so several processes may share the store.
+    """
+
+    root = attr.ib(converter=Path)
+    max_size = attr.ib(default=HTTP_CACHE_MAX_SIZE)
+
+    @property
+    def manifest_path(self):
+        return self.root / HTTP_CACHE_MANIFEST
+
+    def blob_path(self, name):
+        return self.root / "blobs" / name
+
+    def _derived_paths(self, name):
+        """:return: list of the files derived from blob `name`"""
+        return [
+            path
+            for path in self.blob_path("").glob(name + ".*")
+            # being written by another thread or process
+            if path.suffix != ".tmp"
+        ]
+
+    def _blob_size(self, entry):
+        """:return: size of the blob of entry and its derived files"""
+        size = entry["size"]
+        for path in self._derived_paths(entry["blob"]):
+            try:
+                size += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    def _read(self):
+        """:return: dict of key -> entry dict (do not modify)"""
+        path = self.manifest_path
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return {}
+        stat_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = _manifests.get(path)
+        if cached is not None and cached[0] == stat_key:
+            return cached[1]
+        try:
+            manifest = json.loads(path.read_text())
+            if manifest.get("format") != HTTP_CACHE_MANIFEST_FORMAT:
+                raise ValueError("format {!r}".format(manifest.get("format")))
+            entries = manifest["entries"]
+        except (OSError, ValueError, KeyError, AttributeError) as exc:
+            logger.warning("Ignore unreadable cache manifest %s: %s", path, exc)
+            entries = {}
+        _manifests[path] = (stat_key, entries)
+        return entries
+
+    def _write(self, entries):
+        self.root.mkdir(parents=True, exist_ok=True)
+        _write_atomic(
+            self.manifest_path,
+            json.dumps(
+                dict(format=HTTP_CACHE_MANIFEST_FORMAT, entries=entries),
+                indent=1,
+                sort_keys=True,
+            ).encode("utf-8"),
+        )
+
+    @contextlib.contextmanager
+    def _update(self):
+        """
+        Read, modify, and write back the manifest entries, locked against
+        other threads and processes sharing the store.
+        """
+        with _manifest_lock(self.manifest_path), file_lock(
+            _lock_path(self.manifest_path)
+        ):
+            entries = {k: dict(v) for k, v in self._read().items()}
+            yield entries
+            self._write(entries)
+
+    def entry(self, key):
+        """:return: entry dict for key, or None if it is not stored"""
+        entry = self._read().get(key)
+        if entry is None or not self.blob_path(entry["blob"]).exists():
+            return None
+        return entry
+
+    def touch(self, key):
+        """Mark key as recently used."""
+        entry = self._read().get(key)
+        now = time.time()
+        if entry is None or now - entry["accessed"] < HTTP_CACHE_ACCESS_RESOLUTION:
+            return
+        with self._update() as entries:
+            if key in entries:
+                entries[key]["accessed"] = now
+
+    def renew(self, key, **meta):
+        """Update the metadata of key, keeping its blob."""
+        with self._update() as entries:
+            entries[key].update(meta, accessed=time.time())
+
+    def store(self, key, chunks, suffix="", **meta):
+        """
+        Stream `chunks` of bytes into the store as the body of key.
+
+        :return: entry dict
+        """
+        blob_dir = self.blob_path("")
+        blob_dir.mkdir(parents=True, exist_ok=True)
+        h = hashlib.sha256()
+        detector = _EncodingDetector()
+        size = 0
+        tmp_path = blob_dir / "{}.{}.tmp".format(os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    detector.feed(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = h.hexdigest()
+            name = digest + suffix
+            # identical bodies are stored once
+            if self.blob_path(name).exists():
+                tmp_path.unlink()
+            else:
+                os.replace(tmp_path, self.blob_path(name))
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        now = time.time()
+        with self._update() as entries:
+            old = entries.get(key)
+            entry = entries[key] = dict(
+                meta,
+                blob=name,
+                digest=digest,
+                size=size,
+                encoding=detector.encoding(),
+                fetched=now,
+                accessed=now,
+            )
+            if old is not None:
+                self._release(entries, old["blob"])
+            self._evict(entries, keep=key)
+        return entry
+
+    def _release(self, entries, name):
+        """Delete blob `name` and its derived files if no entry refers to it."""
+        if any(e["blob"] == name for e in entries.values()):
+            return
+        for path in [self.blob_path(name)] + self._derived_paths(name):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, entries, keep=None):
+        sizes = {e["blob"]: self._blob_size(e) for e in entries.values()}
+        total = sum(sizes.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["accessed"]):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            del entries[key]
+            if not any(e["blob"] == entry["blob"] for e in entries.values()):
+                total -= sizes[entry["blob"]]
+            self._release(entries, entry["blob"])
+            logger.debug("Evict cached %s (%s bytes)", key, sizes[entry["blob"]])
+
+    def evict(self):
+        """Evict least recently used entries until the store fits max_size."""
+        with self._update() as entries:
+            self._evict(entries)
+
+
+@attr.s
+class HTTPCache:
+    """
+    Cache of HTTP GET responses with conditional revalidation, kept in a
+    BlobStore.
+
+    Each body is stored with its ETag and Last-Modified validators. When a
+    cached body is older than `max_age`, a conditional request is made and a
+    304 response simply renews the cached copy.
+
+    :param stale_while_revalidate: for this many seconds past `max_age` the
+        stale copy is returned immediately (status "revalidating") and
+        revalidated in the background, see `wait_revalidations`
+    :param offline: never contact the upstream; raise CacheMiss for urls
+        that are not cached
+    :param rate_limit: TokenBucket to acquire before each request
+    :param session: requests.Session, default `shared_session()`, without
+        status retries when `rate_limit` is set (a RETRY_STATUS response is
+        then an error, and a cached copy is served if there is one)
+    :param suffix: file name suffix of the stored bodies
+    :param max_size: bytes kept in the cache_dir, see BlobStore
+    """
+
+    cache_dir = attr.ib(converter=Path)
+    max_age = attr.ib(default=0)
+    stale_while_revalidate = attr.ib(default=0)
+    offline = attr.ib(default=False)
+    timeout = attr.ib(default=DEFAULT_TIMEOUT)
+    rate_limit = attr.ib(default=None)
+    headers = attr.ib(factory=dict)
+    suffix = attr.ib(default="")
+    session = attr.ib(default=None, repr=False)
+    max_size = attr.ib(default=HTTP_CACHE_MAX_SIZE)
+    _store = attr.ib(default=None, init=False, repr=False)
+    _refreshing = attr.ib(factory=dict, init=False, repr=False)
+    _lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self._store = BlobStore(self.cache_dir, max_size=self.max_size)
+
+    def _response(self, url, entry, status):
+        return CachedResponse(
+            url,
+            self._store.blob_path(entry["blob"]),
+            status,
+            digest=entry["digest"],
+            stored_encoding=entry.get("encoding"),
+        )
+
+    def _fetch(self, url, meta, cancelled=None, reserve=True):
+        headers = dict(self.headers)
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        if self.rate_limit is not None:
+            self.rate_limit.acquire(reserve=reserve)
+        session = self.session
+        if session is None:
+            # retries of a rate limited API must wait for the rate limit too
+            session = shared_session(status_retries=self.rate_limit is None)
+        with session.get(
+            url, headers=headers, timeout=self.timeout, stream=True
+        ) as resp:
+            if resp.status_code == 304 and meta is not None:
+                self._store.renew(url, fetched=time.time())
+                logger.debug("Revalidated cached %s", url)
+                return self._response(url, meta, "revalidated")
+            resp.raise_for_status()
+            chunks = resp.iter_content(DOWNLOAD_CHUNK_SIZE)
+            if cancelled is not None:
+                chunks = _until_cancelled(chunks, cancelled, url)
+            entry = self._store.store(
+                url,
+                chunks,
+                suffix=self.suffix,
+                url=url,
+                etag=resp.headers.get("ETag"),
+                last_modified=resp.headers.get("Last-Modified"),
+            )
+        logger.debug("Fetched %s (%s bytes)", url, entry["size"])
+        return self._response(url, entry, "fetched")
+
+    def _revalidate_background(self, url, meta):
+        def refresh():
+            try:
+                # the thread may be abandoned at exit, so the rate limit token
+                # is only taken once the request is about to be sent
+                self._fetch(url, meta, reserve=False)
+            except requests.RequestException as exc:
+                logger.warning("Background revalidation of %s failed: %s", url, exc)
+            finally:
+                with self._lock:
+                    self._refreshing.pop(url, None)
+                with _revalidations_lock:
+                    _revalidations.discard(thread)
+
+        with self._lock:
+            if url in self._refreshing:
+                return
+            thread = self._refreshing[url] = threading.Thread(
+                target=refresh, name="dzcb-revalidate", daemon=True
+            )
+        with _revalidations_lock:
+            _revalidations.add(thread)
+        thread.start()
+
+    def wait(self):
+        """Wait for background revalidation of this cache to finish."""
+        with self._lock:
+            threads = list(self._refreshing.values())
+        for thread in threads:
+            thread.join()
+
+    def get(self, url, cancelled=None):
+        """
+        :param cancelled: threading.Event, when set the download is abandoned
+            and _Cancelled is raised
+        :return: CachedResponse for url
+        :raise: CacheMiss if offline and url is not cached
+        :raise: requests.RequestException if url is not cached and cannot be
+            fetched
+        """
+        meta = self._store.entry(url)
+        if meta is None:
+            if self.offline:
+                raise CacheMiss("{} is not cached (offline)".format(url))
+            return self._fetch(url, meta, cancelled=cancelled)
+        self._store.touch(url)
+        if self.offline:
+            return self._response(url, meta, "offline")
+        age = time.time() - meta["fetched"]
+        if age < self.max_age:
+            return self._response(url, meta, "fresh")
+        if age < self.max_age + self.stale_while_revalidate:
+            self._revalidate_background(url, meta)
+            return self._response(url, meta, "revalidating")
+        try:
+            return self._fetch(url, meta, cancelled=cancelled)
+        except requests.RequestException as exc:
+            logger.warning(
+                "Cannot revalidate %s (%s), using cached copy from %s",
+                url,
+                exc,
+                time.ctime(meta["fetched"]),
+            )
+            return self._response(url, meta, "stale")
+
+    def get_first(self, urls):
+        """
+        Get the first of `urls` (typically an upstream and its mirrors) that
+        can be fetched or is cached. A stale copy kept because its url cannot
+        be reached is only used if none of the other urls can be fetched.
+
+        :return: CachedResponse
+        """
+        last_exc = stale = None
+        for url in urls:
+            try:
+                resp = self.get(url)
+            except (CacheMiss, requests.RequestException) as exc:
+                logger.debug("Cannot get %s: %s", url, exc)
+                last_exc = exc
+                continue
+            if resp.status != "stale":
+                return resp
+            if stale is None:
+                stale = resp
+        if stale is not None:
+            return stale
+        if last_exc is None:
+            raise ValueError("No urls given")
+        raise last_exc
+
+    def _usable_without_request(self, url):
+        """
+        :return: True if url is cached and `get` returns it without waiting
+            for a request (fresh, or stale while revalidating)
+        """
+        entry = self._store.entry(url)
+        return (
+            entry is not None
+            and time.time() - entry["fetched"]
+            < self.max_age + self.stale_while_revalidate
+        )
+
+    def get_fastest(self, urls, patience=MIRROR_PATIENCE):
+        """
+        Get `urls` (an upstream and its mirrors, in order of preference)
+        concurrently.
+
+        The most preferred url that can be fetched wins, but once any url
+        responds, the more preferred urls only get `patience` more seconds, so
+        a slow upstream doesn't hold up the build. Stale cached copies are
+        only used when no url can be fetched.
+
+        Requests are made in daemon threads; the downloads still running when
+        a url is chosen are abandoned and don't delay interpreter exit.
+
+        :return: CachedResponse
+        """
+        urls = list(urls)
+        if self.offline or len(urls) <= 1:
+            return self.get_first(urls)
+        if self._usable_without_request(urls[0]):
+            return self.get(urls[0])
+
+        cancelled = threading.Event()
+        futures = [
+            _in_daemon_thread(self.get, url, cancelled, name="dzcb-mirror")
+            for url in urls
+        ]
+        try:
+            return self._fastest(urls, futures, patience)
+        finally:
+            cancelled.set()
+
+    @staticmethod
+    def _fastest(urls, futures, patience):
+        def succeeded(future):
+            return (
+                future.done()
+                and future.exception() is None
+                and future.result().status != "stale"
+            )
+
+        deadline = None
+        while True:
+            expired = deadline is not None and time.monotonic() >= deadline
+            for future in futures:
+                if not future.done():
+                    if expired:
+                        continue
+                    break
+                if succeeded(future):
+                    return future.result()
+            else:
+                # every url failed
+                break
+            if deadline is None and any(succeeded(f) for f in futures):
+                deadline = time.monotonic() + patience
+                continue
+            concurrent.futures.wait(
+                [f for f in futures if not f.done()],
+                timeout=None if deadline is None else deadline - time.monotonic(),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+        for url, future in zip(urls, futures):
+            if future.exception() is None:
+                return future.result()
+            logger.debug("Cannot get %s: %s", url, future.exception())
+        raise futures[-1].exception()
@@ -0,0 +1,210 @@
+"""
+dzcb.gazetteer - offline place name lookup
+
+A small bundled list of cities (data/gazetteer.csv) is indexed in a trie of
+name words, so a place name at the start of a proximity zone name, like
+"Longview WA 35mi", resolves to coordinates without a geocoding service.
+"""
+import csv
+import functools
+import logging
+import re
+
+import attr
+from importlib_resources import files
+
+import dzcb.data
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_CSV = "gazetteer.csv"
+
+STATE_ABBREVIATIONS = {
+    "AL": "Alabama",
+    "AK": "Alaska",
+    "AZ": "Arizona",
+    "AR": "Arkansas",
+    "CA": "California",
+    "CO": "Colorado",
+    "CT": "Connecticut",
+    "DE": "Delaware",
+    "DC": "District of Columbia",
+    "FL": "Florida",
+    "GA": "Georgia",
+    "HI": "Hawaii",
+    "ID": "Idaho",
+    "IL": "Illinois",
+    "IN": "Indiana",
+    "IA": "Iowa",
+    "KS": "Kansas",
+    "KY": "Kentucky",
+    "LA": "Louisiana",
+    "ME": "Maine",
+    "MD": "Maryland",
+    "MA": "Massachusetts",
+    "MI": "Michigan",
+    "MN": "Minnesota",
+    "MS": "Mississippi",
+    "MO": "Missouri",
+    "MT": "Montana",
+    "NE": "Nebraska",
+    "NV": "Nevada",
+    "NH": "New Hampshire",
+    "NJ": "New Jersey",
+    "NM": "New Mexico",
+    "NY": "New York",
+    "NC": "North Carolina",
+    "ND": "North Dakota",
+    "OH": "Ohio",
+    "OK": "Oklahoma",
+    "OR": "Oregon",
+    "PA": "Pennsylvania",
+    "RI": "Rhode Island",
+    "SC": "South Carolina",
+    "SD": "South Dakota",
+    "TN": "Tennessee",
+    "TX": "Texas",
+    "UT": "Utah",
+    "VT": "Vermont",
+    "VA": "Virginia",
+    "WA": "Washington",
+    "WV": "West Virginia",
+    "WI": "Wisconsin",
+    "WY": "Wyoming",
+    "PR": "Puerto Rico",
+    "VI": "Virgin Islands",
+    "GU": "Guam",
+    "AB": "Alberta",
+    "BC": "British Columbia",
+    "MB": "Manitoba",
+    "NB": "New Brunswick",
+    "NL": "Newfoundland and Labrador",
+    "NT": "Northwest Territories",
+    "NS": "Nova Scotia",
+    "NU": "Nunavut",
+    "ON": "Ontario",
+    "PE": "Prince Edward Island",
+    "QC": "Quebec",
+    "SK": "Saskatchewan",
+    "YT": "Yukon",
+}
+
+# key of the places ending at a trie node (not a valid word)
+_PLACES = ""
+
+
+def words(text):
+    """
+    :return: list of lowercase words in text, ignoring punctuation
+        ("St. John's, NL" -> ["st", "johns", "nl"])
+    """
+    return re.sub(r"[.']", "", text.lower()).replace(",", " ").split()
+
+
+@attr.s(frozen=True)
+class Place:
+    name = attr.ib()
+    state = attr.ib()
+    lat = attr.ib(converter=float)
+    long = attr.ib(converter=float)
+
+    @property
+    def coords(self):
+        return self.lat, self.long
+
+
+@attr.s
+class Gazetteer:
+    """
+    Word trie of place names.
+
+    Each place is reachable by its name alone and by its name followed by
+    the state name or abbreviation. A name shared by several places resolves
+    to the first one added, with a warning, unless the state is given.
+    """
+
+    _root = attr.ib(factory=dict, init=False, repr=False)
+    # text -> (Place, number of words matched) or None
+    _resolved = attr.ib(factory=dict, init=False, repr=False)
+
+    @classmethod
+    def from_csv(cls, csv_lines):
+        """
+        :param csv_lines: iterable of CSV lines with Name, State, Lat, Long
+        """
+        gazetteer = cls()
+        for row in csv.DictReader(csv_lines):
+            gazetteer.add(
+                Place(
+                    name=row["Name"],
+                    state=row["State"],
+                    lat=row["Lat"],
+                    long=row["Long"],
+                )
+            )
+        return gazetteer
+
+    def _insert(self, key_words, place):
+        node = self._root
+        for word in key_words:
+            node = node.setdefault(word, {})
+        node.setdefault(_PLACES, []).append(place)
+
+    def add(self, place):
+        name = words(place.name)
+        self._insert(name, place)
+        self._insert(name + words(place.state), place)
+        for abbreviation, state in STATE_ABBREVIATIONS.items():
+            if state == place.state:
+                self._insert(name + [abbreviation.lower()], place)
+        self._resolved.clear()
+
+    def match(self, text):
+        """
+        Find the longest place name at the start of text.
+
+        A k7abd style ";CODE" suffix ("Seattle;SEA") is ignored.
+
+        :return: (Place, number of words matched), or None
+        """
+        if text in self._resolved:
+            return self._resolved[text]
+        node = self._root
+        found = candidates = None
+        for n_words, word in enumerate(words(text.partition(";")[0]), start=1):
+            node = node.get(word)
+            if node is None:
+                break
+            if _PLACES in node:
+                candidates = node[_PLACES]
+                found = candidates[0], n_words
+        if found and len(set(candidates)) > 1:
+            logger.warning(
+                "Ambiguous place name %r, using %s, %s (add the state to choose)",
+                text,
+                found[0].name,
+                found[0].state,
+            )
+        self._resolved[text] = found
+        return found
+
+    def resolve(self, text):
+        """
+        :return: Place named at the start of text, or None
+        """
+        found = self.match(text)
+        return found[0] if found else None
+
+    def resolve_many(self, texts):
+        """
+        :return: dict of text -> Place (or None) for each of texts
+        """
+        return {text: self.resolve(text) for text in texts}
+
+
+@functools.lru_cache(maxsize=None)
+def default_gazetteer():
+    """:return: Gazetteer of the bundled places"""
+    return Gazetteer.from_csv(
+        files(dzcb.data).joinpath(GAZETTEER_CSV).read_text().splitlines()
+    )
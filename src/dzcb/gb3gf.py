@@ -6,12 +6,14 @@ Ex: OpenGD77
 import csv
 import logging
 
+from dzcb import COMMERCIAL_UHF, COMMERCIAL_VHF
 from dzcb.model import AnalogChannel, Bandwidth
 
 logger = logging.getLogger(__name__)
 
 SUPPORTED_RADIOS = ("opengd77", )
 DEFAULT_SUPPORTED_RADIOS = ("opengd77", )
+FREQUENCY_RANGE = (COMMERCIAL_VHF, COMMERCIAL_UHF)
 
 # These talkgroups are removed until the TG list is 32 channels or less
 TALKGROUP_LIST_OVERFLOW = [
@@ -42,7 +44,7 @@ value_replacements = {
 
 def Codeplug_to_gb3gf_opengd77_csv(cp, output_dir):
     # filter down to supported frequency ranges
-    cp = cp.filter(ranges=((136.0, 174.0), (400.0, 480.0)))
+    cp = cp.filter(ranges=FREQUENCY_RANGE)
     # will keep track of contacts separately and write them at the end
     # using name_with_timeslot
     contacts = set()
@@ -28,6 +28,7 @@ import attr
 
 from dzcb.model import (
     AnalogChannel,
+    ChannelNameAllocator,
     Codeplug,
     Contact,
     ContactType,
@@ -36,9 +37,10 @@ from dzcb.model import (
     ScanList,
     Talkgroup,
     Zone,
+    frequency_in_ranges,
 )
 import dzcb.tone
-from dzcb.util import unique_name
+from dzcb.util import NameAllocator
 
 
 logger = logging.getLogger(__name__)
@@ -104,7 +106,11 @@ def Codeplug_from_zone_dicts(zone_dicts):
         grouplists.append(grouplist)
         return attr.evolve(ch, grouplist=grouplist)
 
-    all_channels = {}
+    name_allocator = ChannelNameAllocator()
+    # id of a channel instance listed by several zones (like the repeaterbook
+    # channels of overlapping proximity zones) -> the updated channel; it is
+    # processed once and keeps the scanlist of the first zone
+    shared_channels = {}
     for zname, zchannels in zone_dicts.items():
         updated_channels = []
         zscanlist = ScanList(
@@ -112,21 +118,23 @@ def Codeplug_from_zone_dicts(zone_dicts):
             channels=updated_channels,
         )
         for ch in zchannels:
-            if isinstance(ch, DigitalChannel):
-                if ch.static_talkgroups:
-                    ch = update_static_talkgroups(ch)
-                if ch.talkgroup:
-                    contacts.add(ch.talkgroup)
-            if ch.scanlist is None:
-                ch = attr.evolve(ch, scanlist=zscanlist)
-            # if the existing channel with this short name doesn't hash to
-            # the current channel, then append a number until it does.
-            # This will ensure all same short named channels get the same
-            # unique suffix
-            while all_channels.get(ch.short_name) not in (ch, None):
-                ch = attr.evolve(ch, dedup_key=ch._dedup_key + 1)
-            all_channels[ch.short_name] = ch
-            updated_channels.append(ch)
+            updated = shared_channels.get(id(ch))
+            if updated is None:
+                original = ch
+                if isinstance(ch, DigitalChannel):
+                    if ch.static_talkgroups:
+                        ch = update_static_talkgroups(ch)
+                    if ch.talkgroup:
+                        contacts.add(ch.talkgroup)
+                if ch.scanlist is None:
+                    ch = attr.evolve(ch, scanlist=zscanlist)
+                # if the existing channel with this short name doesn't hash to
+                # the current channel, then append a number to the name.
+                # This will ensure all same short named channels get the same
+                # unique suffix
+                updated = name_allocator.allocate(ch)
+                shared_channels[id(original)] = updated
+            updated_channels.append(updated)
         scanlists.append(attr.evolve(zscanlist, channels=updated_channels))
         zones.append(
             Zone(
@@ -135,7 +143,7 @@ def Codeplug_from_zone_dicts(zone_dicts):
                 channels_b=updated_channels,
             )
         )
-    channels.extend(all_channels.values())
+    channels.extend(name_allocator.channels)
     return Codeplug(
         contacts=sorted(list(contacts), key=lambda c: c.name),
         channels=channels,
@@ -145,55 +153,183 @@ def Codeplug_from_zone_dicts(zone_dicts):
     )
 
 
-def Analog_from_csv(analog_repeaters_csv):
+def Analog_from_csv(analog_repeaters_csv, ranges=None):
+    """
+    :param analog_repeaters_csv: iterable of CSV lines
+    :param ranges: sequence of tuple of (low, high) frequency to retain, default all
+    :return: dict of zone_name -> list of AnalogChannel
+    """
+    return Analog_from_rows(csv.DictReader(analog_repeaters_csv), ranges=ranges)
+
+
+def Analog_from_row(r, ranges=None):
+    """
+    :param r: dict with ANALOG_CSV_FIELDS keys and str values
+    :param ranges: sequence of tuple of (low, high) frequency to retain, default all
+    :return: AnalogChannel, or None if the frequency is not in ranges
+    :raise: ValueError if the row is not valid
+    """
+    zname, found, code = r[ZONE].partition(";")
+    frequency = float(r[RX_FREQ])
+    if not frequency_in_ranges(frequency, ranges):
+        return None
+    offset = round(float(r[TX_FREQ]) - frequency, 1)
+    tone_encode = (
+        r[CTCSS_ENCODE] if r[CTCSS_ENCODE].lower() not in dzcb.tone.OFF_TONES else None
+    )
+    tone_decode = (
+        r[CTCSS_DECODE] if r[CTCSS_DECODE].lower() not in dzcb.tone.OFF_TONES else None
+    )
+    return AnalogChannel(
+        name=r[CHANNEL_NAME],
+        code=code or None,
+        frequency=frequency,
+        offset=offset,
+        tone_encode=tone_encode,
+        tone_decode=tone_decode,
+        power=r[POWER],
+        bandwidth=r[BANDWIDTH].rstrip("K"),
+    )
+
+
+def Analog_from_rows(analog_rows, ranges=None):
+    """
+    :param analog_rows: iterable of dict with ANALOG_CSV_FIELDS keys and str values
+    :param ranges: sequence of tuple of (low, high) frequency to retain, default all
+    :return: dict of zone_name -> list of AnalogChannel
+    """
     zones = {}
-    csvr = csv.DictReader(analog_repeaters_csv)
-    for r in csvr:
+    for r in analog_rows:
+        zname = r[ZONE].partition(";")[0]
         try:
-            zname = r[ZONE]
-            zname, found, code = zname.partition(";")
-            name = r[CHANNEL_NAME]
-            frequency = float(r[RX_FREQ])
-            offset = round(float(r[TX_FREQ]) - frequency, 1)
-            power = r[POWER]
-            bandwidth = r[BANDWIDTH].rstrip("K")
-            tone_encode = (
-                r[CTCSS_ENCODE] if r[CTCSS_ENCODE].lower() not in ("off", "") else None
+            ch = Analog_from_row(r, ranges=ranges)
+        except ValueError as ve:
+            logger.info(
+                "Skipping channel {} / {}: {}".format(zname, r[CHANNEL_NAME], ve)
             )
-            tone_decode = (
-                r[CTCSS_DECODE] if r[CTCSS_DECODE].lower() not in ("off", "") else None
+            continue
+        if ch is not None:
+            zones.setdefault(zname, []).append(ch)
+    return zones
+
+
+DIGITAL_REPEATERS_FIELDS = (
+    "Zone Name",
+    "Comment",
+    "Power",
+    "RX Freq",
+    "TX Freq",
+    "Color Code",
+)
+
+
+@attr.s(frozen=True)
+class TalkgroupMatrix:
+    """
+    Sparse repeater x talkgroup matrix from a Digital-Repeaters CSV file.
+
+    Only the cells that carry a timeslot are retained, and each talkgroup column
+    is resolved against the talkgroup map once rather than once per cell.
+    """
+
+    # tuple of (column name, Contact or None if unknown), sorted by Contact name
+    columns = attr.ib(converter=tuple)
+    # tuple of (repeater fields dict, tuple of (column index, timeslot))
+    rows = attr.ib(converter=tuple)
+    # (column index, timeslot) -> Talkgroup or None if the timeslot is invalid
+    _talkgroups = attr.ib(factory=dict, init=False, eq=False, repr=False)
+    # tuple of Talkgroup -> the same tuple, shared between repeaters
+    _shared_static_talkgroups = attr.ib(
+        factory=dict, init=False, eq=False, repr=False
+    )
+
+    @classmethod
+    def from_csv(cls, digital_repeaters_csv, talkgroups_by_name):
+        csvr = csv.reader(digital_repeaters_csv)
+        header = next(csvr, None)
+        if header is None:
+            return cls(columns=(), rows=())
+        # like DictReader, the last column wins if a talkgroup name is repeated
+        tg_header_ix = {
+            tg_name: ix
+            for ix, tg_name in enumerate(header)
+            if tg_name not in DIGITAL_REPEATERS_FIELDS
+        }
+        # order columns by talkgroup name, so each row's cells come out pre-sorted
+        columns = sorted(
+            ((tg_name, talkgroups_by_name.get(tg_name)) for tg_name in tg_header_ix),
+            key=lambda c: (c[1] is None, c[1].name if c[1] is not None else c[0]),
+        )
+        header_ix = tuple(tg_header_ix[tg_name] for tg_name, _ in columns)
+        rows = []
+        for row in csvr:
+            if not row:
+                continue
+            fields = dict(zip(header, row))
+            cells = tuple(
+                (col_ix, row[ix].strip())
+                for col_ix, ix in enumerate(header_ix)
+                if ix < len(row) and row[ix].strip() != "-"
             )
-            zones.setdefault(zname, []).append(
-                AnalogChannel(
-                    name=name,
-                    code=code or None,
-                    frequency=frequency,
-                    offset=offset,
-                    tone_encode=tone_encode,
-                    tone_decode=tone_decode,
-                    power=power,
-                    bandwidth=bandwidth,
+            rows.append((fields, cells))
+        return cls(columns=columns, rows=rows)
+
+    def static_talkgroups(self, cells, zname, log_source=None):
+        """
+        Return the tuple of Talkgroup referenced by a row's cells.
+
+        Talkgroup objects are created once per (column, timeslot) and rows with
+        identical talkgroups share the same tuple.
+        """
+        row_talkgroups = []
+        for col_ix, timeslot in cells:
+            tg_name, contact = self.columns[col_ix]
+            if contact is None:
+                logger.warning(
+                    "'%s' references unknown talkgroup '%s'. Ignored.",
+                    zname,
+                    tg_name,
                 )
-            )
-        except ValueError as ve:
-            logger.info("Skipping channel {} / {}: {}".format(zname, name, ve))
-    return zones
+                continue
+            try:
+                tg = self._talkgroups[col_ix, timeslot]
+            except KeyError:
+                try:
+                    tg = Talkgroup.from_contact(contact, timeslot)
+                except ValueError:
+                    tg = None
+                self._talkgroups[col_ix, timeslot] = tg
+            if tg is None:
+                logger.info(
+                    "%s: Ignoring ValueError from %s:%s",
+                    log_source,
+                    tg_name,
+                    timeslot,
+                )
+                continue
+            row_talkgroups.append(tg)
+        row_talkgroups = tuple(row_talkgroups)
+        return self._shared_static_talkgroups.setdefault(
+            row_talkgroups, row_talkgroups
+        )
 
 
-def DigitalRepeaters_from_k7abd_csv(digital_repeaters_csv, talkgroups_by_name):
+def DigitalRepeaters_from_k7abd_csv(
+    digital_repeaters_csv, talkgroups_by_name, ranges=None
+):
     """
     read a talkgroup matrix and yield DigitalChannel
 
     :param digital_repeaters_csv: iterable of CSV lines: ... see code ;]
     :param talkgroups_by_name: map of tg_name -> Talkgroup
+    :param ranges: sequence of tuple of (low, high) frequency to retain, default all
     :return: iterable of DigitalChannel with static_talkgroups ready to be expanded
         and converted into group/scan lists.
     """
-    csvr = csv.DictReader(digital_repeaters_csv)
-    for r in csvr:
-        _ = r.pop("Comment", None)
-        zname, found, code = r.pop("Zone Name").partition(";")
-        frequency = float(r.pop("RX Freq"))
+    matrix = TalkgroupMatrix.from_csv(digital_repeaters_csv, talkgroups_by_name)
+    for r, cells in matrix.rows:
+        zname, found, code = r["Zone Name"].partition(";")
+        frequency = float(r["RX Freq"])
         if not frequency:
             logger.info(
                 "%s: Excluding repeater, %s with no frequency",
@@ -201,51 +337,32 @@ def DigitalRepeaters_from_k7abd_csv(digital_repeaters_csv, talkgroups_by_name):
                 zname,
             )
             continue
-        offset = round(float(r.pop("TX Freq")) - frequency, 1)
-        color_code = r.pop("Color Code")
-        power = r.pop("Power")
-        talkgroups = []
-        for tg_name, timeslot in r.items():
-            if timeslot.strip() == "-":
-                continue
-            try:
-                talkgroups.append(
-                    Talkgroup.from_contact(
-                        talkgroups_by_name[tg_name],
-                        timeslot,
-                    )
-                )
-            except KeyError:
-                logger.warning(
-                    "'%s' references unknown talkgroup '%s'. Ignored.",
-                    zname,
-                    tg_name,
-                )
-            except ValueError:
-                logger.info(
-                    "%s: Ignoring ValueError from %s:%s",
-                    digital_repeaters_csv,
-                    tg_name,
-                    timeslot,
-                )
+        if not frequency_in_ranges(frequency, ranges):
+            continue
+        offset = round(float(r["TX Freq"]) - frequency, 1)
         repeater = DigitalChannel(
             name=zname,
             code=code or None,
             frequency=frequency,
             offset=offset,
-            color_code=color_code,
-            power=power,
-            static_talkgroups=sorted(talkgroups, key=lambda tg: tg.name),
+            color_code=r["Color Code"],
+            power=r["Power"],
+            static_talkgroups=matrix.static_talkgroups(
+                cells, zname, log_source=digital_repeaters_csv
+            ),
         )
         yield repeater
 
 
-def DigitalChannels_from_k7abd_csv(digital_others_csv, talkgroups_by_name):
+def DigitalChannels_from_k7abd_csv(
+    digital_others_csv, talkgroups_by_name, ranges=None
+):
     """
     read a Digital-Others files and yield DigitalChannel
 
     :param digital_others_csv: iterable of CSV lines: ... see code ;]
     :param talkgroups_by_name: map of tg_name -> Talkgroup
+    :param ranges: sequence of tuple of (low, high) frequency to retain, default all
     :return: dict of zone_name -> tuple of DigitalChannel (with talkgroup set)
     """
     zones = {}
@@ -255,6 +372,8 @@ def DigitalChannels_from_k7abd_csv(digital_others_csv, talkgroups_by_name):
         zname, found, code = r.pop("Zone Name", r.pop("Zone")).partition(";")
         name = r.pop("Channel Name")
         frequency = float(r.pop("RX Freq"))
+        if not frequency_in_ranges(frequency, ranges):
+            continue
         offset = round(float(r.pop("TX Freq")) - frequency, 1)
         color_code = r.pop("Color Code")
         power = r.pop("Power")
@@ -300,24 +419,42 @@ def _log_zones_channels(in_zones, log_filename=None, level=logging.DEBUG):
     )
 
 
-def update_zones_channels(zones_dict, in_zones, log_filename=None):
+def update_zones_channels(
+    zones_dict, in_zones, log_filename=None, name_allocator=None
+):
     """
     Update `zones_dict` with the contents of `in_zones`
 
     :param log_filename: used for logging only
+    :param name_allocator: NameAllocator tracking the names in `zones_dict`,
+        reuse the same allocator across calls to avoid re-probing names (the
+        caller then logs the deduplicated names with `log_deduped`)
     """
     _log_zones_channels(in_zones, log_filename)
+    if name_allocator is None:
+        zone_names = NameAllocator(zones_dict)
+    else:
+        zone_names = name_allocator
     for zname, zchannels in in_zones.items():
-        zones_dict[unique_name(zname, zones_dict)] = zchannels
+        zones_dict[zone_names.allocate(zname)] = zchannels
+    if name_allocator is None:
+        zone_names.log_deduped()
 
 
-def Codeplug_from_k7abd(input_dir):
+def Codeplug_from_k7abd(input_dir, ranges=None, analog_zones=None):
     """
     :param input_dir: directory on the filesystem containing K7ABD ACB files
+    :param ranges: sequence of tuple of (low, high) frequency to retain, default all.
+        Channels outside of these ranges are never created.
+    :param analog_zones: dict of Analog__ file name -> dict of zone_name -> list
+        of AnalogChannel, generated in memory (see `Analog_from_rows`). These
+        are merged in order with the Analog__*.csv files in input_dir; a file
+        of the same name takes precedence.
     :return: Codeplug
     """
     d = Path(input_dir)
     zones = {}
+    zone_names = NameAllocator()
     talkgroups = {}
     all_talkgroups_by_name = {}
     total_files = 0
@@ -325,9 +462,22 @@ def Codeplug_from_k7abd(input_dir):
         logger.warning(
             "REQUIRE_VALID_TONE=0: resulting codeplug files may contain invalid entries"
         )
-    for p in sorted(d.glob("Analog__*.csv")):
+    analog_sources = {p.name: p for p in d.glob("Analog__*.csv")}
+    for filename, in_zones in (analog_zones or {}).items():
+        if filename in analog_sources:
+            logger.debug("%s exists in %s, ignoring generated zones", filename, d)
+            continue
+        analog_sources[filename] = in_zones
+    for filename, source in sorted(analog_sources.items()):
+        if isinstance(source, Path):
+            in_zones = Analog_from_csv(source.read_text().splitlines(), ranges=ranges)
+        else:
+            in_zones = source
         update_zones_channels(
-            zones, Analog_from_csv(p.read_text().splitlines()), log_filename=p
+            zones,
+            in_zones,
+            log_filename=source if isinstance(source, Path) else filename,
+            name_allocator=zone_names,
         )
         total_files += 1
     for p in sorted(d.glob("Talkgroups__*.csv")):
@@ -340,9 +490,10 @@ def Codeplug_from_k7abd(input_dir):
         update_zones_channels(
             zones,
             DigitalChannels_from_k7abd_csv(
-                p.read_text().splitlines(), all_talkgroups_by_name
+                p.read_text().splitlines(), all_talkgroups_by_name, ranges=ranges
             ),
             log_filename=p,
+            name_allocator=zone_names,
         )
         total_files += 1
     for p in sorted(d.glob("Digital-Repeaters__*.csv")):
@@ -357,12 +508,16 @@ def Codeplug_from_k7abd(input_dir):
             zones,
             {
                 zname: tuple(
-                    DigitalRepeaters_from_k7abd_csv(p.read_text().splitlines(), tg_csv)
+                    DigitalRepeaters_from_k7abd_csv(
+                        p.read_text().splitlines(), tg_csv, ranges=ranges
+                    )
                 )
             },
             log_filename=p,
+            name_allocator=zone_names,
         )
         total_files += 1
+    zone_names.log_deduped()
     _log_zones_channels(
         in_zones=zones,
         log_filename="{} total files".format(total_files),
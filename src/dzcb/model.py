@@ -15,7 +15,7 @@ import dzcb.data
 import dzcb.exceptions
 import dzcb.munge
 import dzcb.tone
-from dzcb.util import unique_name
+from dzcb.util import NameAllocator
 
 # XXX: i hate this
 NAME_MAX = 16
@@ -241,8 +241,58 @@ class Channel:
         return round_frequency(self.frequency + offset)
 
 
+@attr.s
+class ChannelNameAllocator:
+    """
+    Assign each Channel a unique short_name by setting its dedup_key.
+
+    Identical channels always receive the same suffix, while distinct channels
+    sharing a truncated short_name receive the next free suffix for that name
+    without re-probing every suffix already handed out.
+    """
+
+    # short_name -> Channel occupying that name
+    channels_by_short_name = attr.ib(factory=dict)
+    # (short_name, Channel) as passed to allocate -> dedup_key previously
+    # assigned; Channel equality ignores the name, so the short_name is part
+    # of the key
+    _dedup_keys = attr.ib(factory=dict, repr=False)
+    # short_name with no suffix -> next dedup_key to try for that name
+    _next_dedup_key = attr.ib(factory=dict, repr=False)
+
+    def _is_free(self, ch):
+        return self.channels_by_short_name.get(ch.short_name) in (ch, None)
+
+    def allocate(self, ch):
+        """
+        :param ch: Channel to place in the namespace
+        :return: Channel (possibly with a new dedup_key) with a unique short_name
+        """
+        key = (ch.short_name, ch)
+        dedup_key = self._dedup_keys.get(key)
+        if dedup_key is None:
+            ch_unique = ch
+        else:
+            ch_unique = attr.evolve(ch, dedup_key=dedup_key)
+        if not self._is_free(ch_unique):
+            base_name = ch.short_name
+            dedup_key = self._next_dedup_key.get(base_name, ch._dedup_key + 1)
+            ch_unique = attr.evolve(ch, dedup_key=dedup_key)
+            # a different base name may already occupy this suffixed name
+            while not self._is_free(ch_unique):
+                ch_unique = attr.evolve(ch_unique, dedup_key=ch_unique._dedup_key + 1)
+            self._next_dedup_key[base_name] = ch_unique._dedup_key + 1
+            self._dedup_keys[key] = ch_unique._dedup_key
+        self.channels_by_short_name[ch_unique.short_name] = ch_unique
+        return ch_unique
+
+    @property
+    def channels(self):
+        return tuple(self.channels_by_short_name.values())
+
+
 def _tone_validator(instance, attribute, value):
-    if value is not None and value not in dzcb.tone.VALID_TONES:
+    if value is not None and not dzcb.tone.is_valid(value):
         message = "field {!r} for {} has unknown tone {!r}".format(
             attribute.name, instance.name, value
         )
@@ -253,12 +303,7 @@ def _tone_validator(instance, attribute, value):
 
 
 def _tone_converter(value):
-    if not isinstance(value, str):
-        value = str(value)
-    elif re.match("[0-9.]+", value):
-        # normalize float values
-        value = str(float(value))
-    return value.upper()
+    return dzcb.tone.normalize(value)
 
 
 @attr.s(frozen=True)
@@ -575,6 +620,48 @@ def uniquify_contacts(contacts, ignore_timeslot=False):
     return tuple(contacts_by_id.values())
 
 
+def frequency_in_ranges(freq, ranges):
+    """
+    :param freq: frequency in MHz
+    :param ranges: sequence of tuple of (low, high) frequency, or None for any frequency
+    :return: True if the frequency is within any of the ranges (exclusive)
+    """
+    if ranges is None:
+        return True
+    for low, high in ranges:
+        if float(low) < freq < float(high):
+            return True
+    return False
+
+
+def union_frequency_ranges(range_seqs):
+    """
+    Combine the frequency ranges of multiple outputs.
+
+    :param range_seqs: sequence of (sequence of tuple of (low, high) frequency or None)
+        None means the output accepts any frequency
+    :return: tuple of non-overlapping (low, high) float ranges covering every
+        range in `range_seqs`, or None if any output (or no output at all)
+        accepts any frequency
+    """
+    ranges = []
+    range_seqs = tuple(range_seqs)
+    if not range_seqs:
+        return None
+    for range_seq in range_seqs:
+        if range_seq is None:
+            return None
+        ranges.extend((float(low), float(high)) for low, high in range_seq)
+    merged = []
+    for low, high in sorted(ranges):
+        # ranges are exclusive, so only strictly overlapping ranges can be merged
+        if merged and low < merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return tuple(merged)
+
+
 def filter_channel_frequency(channels, ranges):
     """
     :param channels: sequence of Channel to filter
@@ -584,17 +671,11 @@ def filter_channel_frequency(channels, ranges):
     if ranges is None:
         return channels
 
-    def freq_in_range(freq):
-        for low, high in ranges:
-            if float(low) < freq < float(high):
-                return True
-        return False
-
     keep_channels = []
     channels_pruned = []
 
     for ch in channels:
-        if freq_in_range(ch.frequency):
+        if frequency_in_ranges(ch.frequency, ranges):
             keep_channels.append(ch)
             continue
         # none of the ranges matched, so prune this channel
@@ -846,14 +927,14 @@ class Codeplug:
         if static_talkgroup_order is None:
             static_talkgroup_order = []
         zones = list(self.zones)
-        zone_names = set(z.name for z in zones)
+        zone_names = NameAllocator(z.name for z in zones)
         channels = []
         exp_scanlists = []
         for ch in self.channels:
             if not isinstance(ch, DigitalChannel) or not ch.static_talkgroups:
                 channels.append(ch)
                 continue
-            exp_zone_name = unique_name(ch.short_name, zone_names)
+            exp_zone_name = zone_names.allocate(ch.short_name)
             zscanlist = ScanList(
                 name=exp_zone_name,
                 channels=[],
@@ -871,6 +952,7 @@ class Codeplug:
                 )
             )
             channels.extend(zone_channels)
+        zone_names.log_deduped()
 
         return attr.evolve(
             self,
@@ -1,9 +1,12 @@
 """
 dzcb.munge - replacements, filters, and modifications of the data
 """
+import csv
 import re
 import warnings
 
+import attr
+
 
 def channel_name(ch_name, max_length):
     # Truncate the channel name (try to preserve the tail  characters
@@ -102,3 +105,67 @@ def ordered_re(seq, order_regexs, key=None, reverse=False):
         head.reverse()
         return tail + head
     return head + tail
+
+
+@attr.s
+class RewriteRules:
+    """
+    Sequence of (pattern, repl) regular expression substitutions applied to
+    text in a single pass.
+
+    The patterns are compiled into one alternation: at each position the
+    first rule that matches is applied, and replaced text is not rewritten
+    again. Replacements may refer to the groups of their own pattern, but
+    patterns must not use numbered backreferences.
+    """
+
+    rules = attr.ib(factory=tuple, converter=lambda rules: tuple(map(tuple, rules)))
+    _regex = attr.ib(default=None, init=False, repr=False, eq=False)
+    _compiled = attr.ib(factory=dict, init=False, repr=False, eq=False)
+
+    def __attrs_post_init__(self):
+        if not self.rules:
+            return
+        self._regex = re.compile(
+            "|".join(
+                "(?P<_{}>{})".format(ix, pattern)
+                for ix, (pattern, _) in enumerate(self.rules)
+            )
+        )
+        self._compiled = {
+            "_{}".format(ix): (re.compile(pattern), repl)
+            for ix, (pattern, repl) in enumerate(self.rules)
+        }
+
+    @classmethod
+    def from_csv(cls, rules_csv):
+        """
+        :param rules_csv: iterable of CSV lines with Pattern and Repl columns
+        """
+        return cls((r["Pattern"], r["Repl"]) for r in csv.DictReader(rules_csv))
+
+    def __add__(self, other):
+        if not isinstance(other, type(self)):
+            return NotImplemented
+        return type(self)(self.rules + other.rules)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def _replace(self, match):
+        pattern, repl = self._compiled[match.lastgroup]
+        # match the rule alone at the same position to expand its groups
+        return pattern.match(match.string, match.start()).expand(repl)
+
+    def sub(self, text):
+        if self._regex is None:
+            return text
+        return self._regex.sub(self._replace, text)
+
+    def sub_lines(self, lines):
+        """
+        :param lines: iterable of str
+        :return: iterator of rewritten str
+        """
+        for line in lines:
+            yield self.sub(line)
@@ -25,6 +25,7 @@ import attr
 
 from dzcb import __version__
 import dzcb.munge
+import dzcb.tone
 from dzcb.model import (
     Bandwidth,
     Codeplug,
@@ -505,13 +506,6 @@ class AnalogChannelTable(ChannelTable):
     fmt = "{Analog:^6} {Name:16} {Receive:8} {Transmit:8} {Power:6} {Scan:4} {TOT:3} {RO:2} {Admit:5} {Squelch:7} {RxTone:6} {TxTone:6} {Width}"
 
     def item_to_dict(self, index, ch):
-        def normal_dcs(tone):
-            if not tone:
-                return "-"
-            if tone.startswith("D"):
-                return tone + "N"
-            return tone
-
         return dict(
             Analog=index,
             Name=self.name_munge(ch.short_name),
@@ -523,8 +517,8 @@ class AnalogChannelTable(ChannelTable):
             RO=plus_minus[ch.rx_only],
             Admit="Free",
             Squelch="Normal",
-            RxTone=normal_dcs(ch.tone_decode),
-            TxTone=normal_dcs(ch.tone_encode),
+            RxTone=dzcb.tone.dcs_normal(ch.tone_decode, off="-"),
+            TxTone=dzcb.tone.dcs_normal(ch.tone_encode, off="-"),
             Width=ch.bandwidth.flattened(self.radio.value.bandwidth).value,
         )
 
@@ -5,10 +5,10 @@ import argparse
 import logging
 from pathlib import Path
 import os
-import tempfile
+import shutil
 from zipfile import ZipFile
 
-import requests
+from dzcb import fetch
 
 logger = logging.getLogger(__name__)
 
@@ -18,47 +18,56 @@ PNWDIGITAL_REPEATERS = [
 ]
 REPEATER_FILENAME = "Digital-Repeaters__PNWDigital.csv"
 TALKGROUPS_FILENAME = "Talkgroups__PNWDigital.csv"
+# always revalidate, unchanged files are not downloaded again
+PNWDIGITAL_CACHE_MAX_AGE = 0
 
 
-def cache_repeaters(output_dir):
-    for dr_url in PNWDIGITAL_REPEATERS:
-        resp = requests.get(dr_url)
-        if resp.status_code < 300:
-            break
-    resp.raise_for_status()
+def _find_member(names, prefix):
+    """
+    :return: the only member of `names` starting with `prefix`
+    """
+    members = [n for n in names if n.startswith(prefix)]
+    if len(members) > 1:
+        raise RuntimeError(
+            "Multiple {} found in the zip: {}".format(
+                prefix.partition("__")[0], members
+            )
+        )
+    if not members:
+        raise RuntimeError("No {} found in the zip".format(prefix))
+    return members[0]
+
+
+def _extract_member(zf, name, output_file):
+    with zf.open(name) as src, fetch.atomic_writer(output_file) as dst:
+        shutil.copyfileobj(src, dst, fetch.DOWNLOAD_CHUNK_SIZE)
+
+
+def cache_repeaters(output_dir, offline=False):
+    resp = fetch.HTTPCache(
+        cache_dir=fetch.HTTP_CACHE_DIR,
+        max_age=PNWDIGITAL_CACHE_MAX_AGE,
+        offline=offline,
+        suffix=".zip",
+    ).get_fastest(PNWDIGITAL_REPEATERS)
     logger.info(
         "Retrieved PNWDigital repeaters from %s (%s)",
-        dr_url,
-        resp.status_code,
+        resp.url,
+        resp.status,
     )
-    with tempfile.TemporaryFile() as tf:
-        tf.write(resp.content)
-        zf = ZipFile(tf, "r")
+    # members are found from the central directory and streamed to the cache
+    # files, nothing is held in memory
+    with ZipFile(resp.path, "r") as zf:
         names = zf.namelist()
-        zip_repeater_filename = [
-            n for n in names if n.startswith("Digital-Repeaters__PNW-all")
-        ]
-        if len(zip_repeater_filename) > 1:
-            raise RuntimeError(
-                "Multiple Digital-Repeaters found in the zip: {}".format(
-                    zip_repeater_filename
-                )
-            )
         output_repeaters = Path(output_dir) / REPEATER_FILENAME
-        output_repeaters.write_bytes(zf.read(zip_repeater_filename[0]))
+        _extract_member(
+            zf, _find_member(names, "Digital-Repeaters__PNW-all"), output_repeaters
+        )
         logger.info("Cache PNWDigital k7abd zones to '%s'", output_repeaters)
-
-        zip_talkgroups_filename = [
-            n for n in names if n.startswith("Talkgroups__PNW-all")
-        ]
-        if len(zip_talkgroups_filename) > 1:
-            raise RuntimeError(
-                "Multiple Talkgroups found in the zip: {}".format(
-                    zip_talkgroups_filename
-                )
-            )
         output_talkgroups = Path(output_dir) / TALKGROUPS_FILENAME
-        output_talkgroups.write_bytes(zf.read(zip_talkgroups_filename[0]))
+        _extract_member(
+            zf, _find_member(names, "Talkgroups__PNW-all"), output_talkgroups
+        )
         logger.info("Cache PNWDigital k7abd talkgroups to '%s'", output_talkgroups)
 
 
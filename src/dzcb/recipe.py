@@ -14,11 +14,14 @@ from dzcb import __version__
 import dzcb.anytone
 import dzcb.data
 import dzcb.farnsworth
+import dzcb.fetch
 import dzcb.gb3gf
 import dzcb.log
 import dzcb.model
+import dzcb.munge
 import dzcb.output.dmrconfig
 import dzcb.repeaterbook
+import dzcb.repeaterdb
 import dzcb.pnwdigital
 import dzcb.seattledmr
 
@@ -128,6 +131,24 @@ sequence_of_Replacements_or_Path = attr.validators.optional(
 )
 
 
+def RewriteRules_or_Path(obj):
+    return from_csv_or_Path(obj, from_csv_cls=dzcb.munge.RewriteRules)
+
+
+def to_sequence_of_RewriteRules_or_Path(obj):
+    obj = maybe_path(obj)
+    if isinstance(obj, (dzcb.munge.RewriteRules, Path)):
+        return (obj,)
+    return foreach_factory(RewriteRules_or_Path, optional=True)(obj)
+
+
+sequence_of_RewriteRules_or_Path = attr.validators.optional(
+    attr.validators.deep_iterable(
+        member_validator=attr.validators.instance_of((dzcb.munge.RewriteRules, Path))
+    )
+)
+
+
 def bool_or_sequence_of_maybe_path(obj):
     if isinstance(obj, bool):
         return obj
@@ -239,6 +260,9 @@ class CodeplugRecipe:
     :param order: sequence of Ordering object or Path to ordering CSV file for ordering objects
     :param reverse_order: sequence of Ordering object or Path to ordering CSV file for reverse ordering objects
     :param replacements: sequence of Replacements object or Path to replacements CSV file
+    :param seattledmr_repeater_fixups: sequence of dzcb.munge.RewriteRules object or Path to
+        Pattern,Repl CSV file, rewriting the lines of the downloaded seattledmr repeaters
+    :param seattledmr_talkgroup_fixups: same for the seattledmr talkgroups
 
     Finally, the resulting codeplug is prepared for output to multiple formats. Additional
     filtering or expansion may occur at this point as well.
@@ -292,6 +316,15 @@ class CodeplugRecipe:
         validator=sequence_of_Replacements_or_Path,
         converter=to_sequence_of_Replacements_or_Path,
     )
+    # rewrite rules for the lines of the seattledmr files, applied along with
+    # (and with lower priority than) the built-in fixups
+    rewrite_rules_field = dict(
+        default=None,
+        validator=sequence_of_RewriteRules_or_Path,
+        converter=to_sequence_of_RewriteRules_or_Path,
+    )
+    seattledmr_repeater_fixups = attr.ib(**rewrite_rules_field)
+    seattledmr_talkgroup_fixups = attr.ib(**rewrite_rules_field)
 
     # output control
     output_anytone = attr.ib(default=None)
@@ -312,6 +345,13 @@ class CodeplugRecipe:
     repeaterbook_name_format = attr.ib(
         default=dzcb.repeaterbook.REPEATERBOOK_DEFAULT_NAME_FORMAT
     )
+    # also write repeaterbook proximity zones as k7abd files in cache/repeaterbook
+    repeaterbook_write_k7abd = attr.ib(default=False)
+    # query proximity zones from a SQLite repeater database: path, or True
+    # for the default location
+    repeaterbook_db = attr.ib(default=None)
+    # only use previously downloaded source data
+    offline = attr.ib(default=False)
 
     # these are used during generation and cannot be initialized
     _output_dir = attr.ib(default=None, init=False)
@@ -319,9 +359,12 @@ class CodeplugRecipe:
     _input_dir = attr.ib(default=None, init=False)
     _ordering = attr.ib(default=None, init=False)
     _replacements = attr.ib(default=None, init=False)
+    _seattledmr_fixups = attr.ib(factory=dict, init=False)
     _scanlists = attr.ib(default=None, init=False)
     _codeplug = attr.ib(default=None, init=False)
     _codeplug_expanded = attr.ib(default=None, init=False)
+    _frequency_ranges = attr.ib(default=None, init=False)
+    _analog_zones = attr.ib(factory=dict, init=False)
 
     @output_anytone.validator
     def _output_anytone_validator(self, attribute, value):
@@ -353,7 +396,9 @@ class CodeplugRecipe:
         logger.info("dzcb %s output_dir='%s'", __version__, self.output_dir)
         self.init_ordering()
         self.init_replacements()
+        self.init_seattledmr_fixups()
         self.init_scanlists()
+        self.init_frequency_ranges()
 
     @property
     def output_dir(self):
@@ -410,6 +455,26 @@ class CodeplugRecipe:
             replacements += rep_obj
         self._replacements = replacements
 
+    def init_seattledmr_fixups(self):
+        fixups = {}
+        for fixups_arg_name in [
+            "seattledmr_repeater_fixups",
+            "seattledmr_talkgroup_fixups",
+        ]:
+            fixups[fixups_arg_name] = dzcb.munge.RewriteRules()
+            for rules_obj in getattr(self, fixups_arg_name) or tuple():
+                if not isinstance(rules_obj, dzcb.munge.RewriteRules):
+                    rules_obj = dzcb.munge.RewriteRules.from_csv(
+                        cache_user_or_default_text(
+                            object_name=fixups_arg_name,
+                            user_path=rules_obj,
+                            default_path=None,
+                            cache_dir=self.input_dir,
+                        ).splitlines()
+                    )
+                fixups[fixups_arg_name] += rules_obj
+        self._seattledmr_fixups = fixups
+
     def init_scanlists(self):
         try:
             # handle the case where it's a json string
@@ -429,9 +494,59 @@ class CodeplugRecipe:
             cache_dir=self.input_dir,
         )
 
+    def _output_frequency_ranges(self):
+        """
+        Yield the frequency ranges supported by each enabled output target.
+
+        None is yielded for outputs that accept any frequency.
+        """
+        if self.output_anytone:
+            yield dzcb.anytone.frequency_ranges(
+                models=None if self.output_anytone is True else self.output_anytone
+            )
+        if self.output_dmrconfig:
+            for dt in self._templates_from_default(
+                self.output_dmrconfig, "dmrconfig", ".conf"
+            ):
+                try:
+                    yield dzcb.output.dmrconfig.DmrConfigTemplate.read_template(
+                        dt.read_text()
+                    ).ranges
+                except dzcb.output.dmrconfig.TemplateError:
+                    # raised again when the output is generated
+                    yield None
+        if self.output_farnsworth:
+            for ftj in self._templates_from_default(
+                self.output_farnsworth, "farnsworth", ".json"
+            ):
+                yield dzcb.farnsworth.frequency_ranges(json.loads(ftj.read_text()))
+        if self.output_gb3gf:
+            yield dzcb.gb3gf.FREQUENCY_RANGE
+
+    def init_frequency_ranges(self):
+        # channels outside of every output's frequency ranges would be discarded
+        # anyway, so exclude them while reading the sources instead
+        self._frequency_ranges = dzcb.model.union_frequency_ranges(
+            self._output_frequency_ranges()
+        )
+        if self._frequency_ranges is not None:
+            logger.info(
+                "Retain channels in output frequency ranges: %s",
+                self._frequency_ranges,
+            )
+
     def repeaterbook_proximity(self):
         if not self.source_repeaterbook_proximity:
             return
+        store = None
+        if self.repeaterbook_db:
+            if self.repeaterbook_db is True:
+                store = dzcb.repeaterdb.RepeaterDB()
+            else:
+                store = dzcb.repeaterdb.RepeaterDB(self.repeaterbook_db)
+            logger.info("Query repeaters from database: '%s'", store.path)
+        # overlapping zones (in any of the csv files) share channels
+        channel_pool = {}
         for src in self.source_repeaterbook_proximity:
             zone_csv = cache_user_or_default_text(
                 "repeaterbook proximity csv",
@@ -439,22 +554,38 @@ class CodeplugRecipe:
                 default_path=None,
                 cache_dir=self.input_dir,
             )
-            dzcb.repeaterbook.zones_to_k7abd(
-                input_csv=zone_csv.splitlines(),
-                output_dir=self.cache_dir,
-                states=self.repeaterbook_states,
-                name_format=self.repeaterbook_name_format,
+            k7abd_dir = None
+            if self.repeaterbook_write_k7abd:
+                k7abd_dir = append_dir_and_create(self.cache_dir, "repeaterbook")
+            self._analog_zones.update(
+                dzcb.repeaterbook.zones_to_analog(
+                    input_csv=zone_csv.splitlines(),
+                    states=self.repeaterbook_states,
+                    name_format=self.repeaterbook_name_format,
+                    ranges=self._frequency_ranges,
+                    offline=self.offline,
+                    k7abd_dir=k7abd_dir,
+                    store=store,
+                    channel_pool=channel_pool,
+                )
             )
+        if store is not None:
+            store.close()
 
     def pnwdigital(self):
         if not self.source_pnwdigital:
             return
-        dzcb.pnwdigital.cache_repeaters(self.cache_dir)
+        dzcb.pnwdigital.cache_repeaters(self.cache_dir, offline=self.offline)
 
     def seattledmr(self):
         if not self.source_seattledmr:
             return
-        dzcb.seattledmr.cache_repeaters(self.cache_dir)
+        dzcb.seattledmr.cache_repeaters(
+            self.cache_dir,
+            offline=self.offline,
+            repeater_fixups=self._seattledmr_fixups["seattledmr_repeater_fixups"],
+            talkgroup_fixups=self._seattledmr_fixups["seattledmr_talkgroup_fixups"],
+        )
 
     def default_k7abd(self):
         if not self.source_default_k7abd:
@@ -470,16 +601,38 @@ class CodeplugRecipe:
             logger.info("Cache k7abd zones from: '%s'", abd_dir)
             shutil.copytree(abd_dir, self.cache_dir, dirs_exist_ok=True)
 
+    def _ensure_dirs(self):
+        """
+        Create the cache and input directories.
+
+        The sources run in separate threads, so the lazily created directories
+        must exist before they start.
+
+        :return: tuple of (cache_dir, input_dir)
+        """
+        return self.cache_dir, self.input_dir
+
     def source(self):
-        self.repeaterbook_proximity()
-        self.pnwdigital()
-        self.seattledmr()
+        self._ensure_dirs()
+        # remote sources are mostly waiting on the network and write disjoint
+        # files, so fetch them concurrently
+        dzcb.fetch.map_concurrent(
+            lambda source: source(),
+            [self.repeaterbook_proximity, self.pnwdigital, self.seattledmr],
+            max_workers=3,
+        )
+        # local files are copied afterwards and in order, so user k7abd files
+        # still replace the default and downloaded files of the same name
         self.default_k7abd()
         self.k7abd()
 
     def build_codeplug(self):
         self._codeplug = (
-            dzcb.k7abd.Codeplug_from_k7abd(self.cache_dir)
+            dzcb.k7abd.Codeplug_from_k7abd(
+                self.cache_dir,
+                ranges=self._frequency_ranges,
+                analog_zones=self._analog_zones,
+            )
             .filter(replacements=self._replacements, **self._ordering)
             .replace_scanlists(self._scanlists)
         )
@@ -2,89 +2,595 @@
 dzcb.repeaterbook - export JSON from Repeaterbook, convert to K7ABD CSV format
 """
 import argparse
+import array
 import csv
+import functools
+import gzip
 import hashlib
+import io
 import json
 import logging
+import math
 from pathlib import Path
 import os
-import time
+import re
+import string
+import sys
 
+import attr
 import geopy.distance
-import requests
+from importlib_resources import files
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    # distance computations fall back to pure python
+    numpy = None
 
 from . import appdir, AmateurBands
-from dzcb import k7abd
+from dzcb import fetch, gazetteer, k7abd
+import dzcb.data
+from dzcb.model import frequency_in_ranges
 
 logger = logging.getLogger(__name__)
 
 # ?country=United%20States&state=Washington&state=Oregon&state=Idaho&state=California"
 REPEATERBOOK_API = "https://www.repeaterbook.com/api/export.php"
 REPEATERBOOK_API_DELAY = 30
-REPEATERBOOK_LAST_FETCH = 0
+# the API policy allows one export request per REPEATERBOOK_API_DELAY seconds,
+# shared by all dzcb processes through a file in the cache directory
+REPEATERBOOK_RATE_LIMIT = fetch.TokenBucket(
+    interval=REPEATERBOOK_API_DELAY,
+    path=Path(appdir.user_cache_dir) / "repeaterbook_rate_limit.json",
+)
+# concurrent cache reads and fetches (network requests are still rate limited)
+REPEATERBOOK_FETCH_WORKERS = fetch.DEFAULT_MAX_WORKERS
 
 # Limit default state to avoid unnecessary API hits
 # Users will want to pass the state on the command line
-# TODO: Geocode Lat/Long from the CSV file
 REPEATERBOOK_DEFAULT_STATES = ("Washington", "Oregon")
 REPEATERBOOK_CACHE_MAX_AGE = 3600 * 12.1  # 12 hours (and some change)
+# older data, up to 3 days past max age, is used while revalidating it
+REPEATERBOOK_CACHE_STALE_WHILE_REVALIDATE = 3600 * 24 * 3
 REPEATERBOOK_DEFAULT_NAME_FORMAT = "{Callsign} {Nearest City} {Landmark}"
 REPEATERBOOK_USER_AGENT = "(dzcb, https://github.com/mycodeplug/dzcb, kf7hvm@0x26.net)"
+# bump when the layout of RepeaterTable changes to invalidate compact caches
+REPEATERBOOK_COMPACT_FORMAT = 4
+REPEATERBOOK_COMPACT_SUFFIX = ".table.gz"
+REPEATERBOOK_JSON_CHUNK_SIZE = 1 << 16
+# fields of the API response used to generate channels
+REPEATERBOOK_FIELDS = (
+    "State ID",
+    "Rptr ID",
+    "Frequency",
+    "Input Freq",
+    "PL",
+    "TSQ",
+    "Lat",
+    "Long",
+)
+REPEATERBOOK_COMPACT_COMPRESSLEVEL = 1
 CSV_ZONE_NAME = "Zone Name"
 CSV_LAT = "Lat"
 CSV_LONG = "Long"
 CSV_DISTANCE = "Distance"
 CSV_UNIT = "Unit"
 CSV_BAND = "Band(2m;1.25m;70cm)"
+# optional: "lat,long;lat,long;..." vertices of a route, Distance is the
+# buffer around the route (Lat and Long are ignored)
+CSV_ROUTE = "Route"
+# zone fields that are not repeater criteria
+CSV_ZONE_FIELDS = (CSV_LAT, CSV_LONG, CSV_DISTANCE, CSV_UNIT, CSV_BAND, CSV_ROUTE)
+# size of each RepeaterIndex grid cell in degrees of latitude and longitude
+REPEATERBOOK_GRID_DEGREES = 0.5
+# shortest length of a degree of latitude (at the equator), and of longitude
+# along the equator, in km
+_KM_PER_DEGREE_LAT = 110.574
+_KM_PER_DEGREE_LONG = 111.320
+# mean earth radius for haversine distance, in km
+_EARTH_RADIUS_KM = 6371.0088
+# haversine differs from the geodesic distance by less than 0.6%
+_HAVERSINE_SLACK = 1.01
+# approximate state and province bounds (see `states_for_zones`)
+REPEATERBOOK_STATE_BOUNDS_CSV = "repeaterbook_state_bounds.csv"
+REPEATERBOOK_STATE_BOUNDS_MARGIN = 0.25
+# route segments are split into pieces no longer than this for projection
+REPEATERBOOK_ROUTE_STEP_KM = 25
+# mean length of a degree of latitude in km, for local planar projections
+_KM_PER_DEGREE = 111.2
+# proximity zone results from previous runs, one file per dataset digest,
+# see ProximityMemo
+REPEATERBOOK_PROXIMITY_MEMO_DIR = Path(appdir.user_cache_dir) / "repeaterbook_proximity"
+REPEATERBOOK_PROXIMITY_MEMO_FORMAT = 2
+# memo files of this many datasets (the most recently saved) are kept
+REPEATERBOOK_PROXIMITY_MEMO_KEEP = 16
 
 
-def cached_json(url, max_age=REPEATERBOOK_CACHE_MAX_AGE):
-    md5urlhash = hashlib.md5(url.encode("utf-8")).hexdigest()
-    cachedir = Path(appdir.user_cache_dir)
-    filepath = cachedir / "repeaters_{}.json".format(md5urlhash)
-    if not filepath.exists() or filepath.stat().st_mtime < time.time() - max_age:
-        # cache is expired, need to refetch
-        cachedir.mkdir(parents=True, exist_ok=True)
+def http_cache(max_age=REPEATERBOOK_CACHE_MAX_AGE, cache_dir=None, offline=False):
+    if cache_dir is None:
+        cache_dir = fetch.HTTP_CACHE_DIR
+        # repeaterbook downloads used to be cached in its parent directory
+        fetch.purge_legacy_cache(cache_dir.parent)
+    return fetch.HTTPCache(
+        cache_dir=cache_dir,
+        max_age=max_age,
+        stale_while_revalidate=REPEATERBOOK_CACHE_STALE_WHILE_REVALIDATE,
+        offline=offline,
         # don't make requests too often
-        global REPEATERBOOK_LAST_FETCH
-        global_last_fetched = time.time() - REPEATERBOOK_LAST_FETCH
-        if global_last_fetched < REPEATERBOOK_API_DELAY:
-            time.sleep(REPEATERBOOK_API_DELAY - global_last_fetched)
-        resp = requests.get(url, headers={'User-Agent': REPEATERBOOK_USER_AGENT})
-        REPEATERBOOK_LAST_FETCH = time.time()
-        filepath.write_bytes(resp.content)
-    return filepath
+        rate_limit=REPEATERBOOK_RATE_LIMIT,
+        headers={"User-Agent": REPEATERBOOK_USER_AGENT},
+        suffix=".json",
+    )
 
 
-def iter_cached_repeaters(states=None, max_age=REPEATERBOOK_CACHE_MAX_AGE):
+def cached_response(
+    url, max_age=REPEATERBOOK_CACHE_MAX_AGE, cache_dir=None, offline=False
+):
+    """
+    :return: fetch.CachedResponse of the API response for url, revalidated
+        with the API if older than max_age
+    """
+    return http_cache(max_age=max_age, cache_dir=cache_dir, offline=offline).get(url)
+
+
+def cached_json(url, max_age=REPEATERBOOK_CACHE_MAX_AGE, cache_dir=None, offline=False):
+    """
+    :return: Path to the cached API response for url, revalidated with the API
+        if older than max_age
+    """
+    return cached_response(
+        url, max_age=max_age, cache_dir=cache_dir, offline=offline
+    ).path
+
+
+class _Missing:
+    """Marks a field absent from a repeaterbook record."""
+
+    def __repr__(self):
+        return "_MISSING"
+
+
+_MISSING = _Missing()
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _band(frequency):
+    """:return: AmateurBands of a float frequency, or None if not amateur"""
+    if not math.isfinite(frequency):
+        return None
+    try:
+        return AmateurBands.get_normalized(frequency)
+    except ValueError:
+        return None
+
+
+class _JSONStream:
+    """Incrementally decode JSON values from a text file object."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """:return: next non-whitespace character, or "" at the end"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(
+                "Expecting {!r} in repeaterbook JSON, got {!r}".format(
+                    char, self.buf[self.pos : self.pos + 20]
+                )
+            )
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # value may be incomplete, decode again with more input
+                if self.eof or not self._fill():
+                    raise
+                continue
+            if (
+                end == len(self.buf) or self.buf[end] not in ",:]} \t\r\n"
+            ) and self._fill():
+                # a number may continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_results(f, key="results", chunk_size=REPEATERBOOK_JSON_CHUNK_SIZE):
+    """
+    Yield each record of the `key` array of a repeaterbook API response as it
+    is decoded, without loading the whole response.
+
+    :param f: text file object
+    :raise: ValueError if the response is not a JSON object with a `key` array
+    """
+    stream = _JSONStream(f, chunk_size)
+    stream.expect("{")
+    found = False
+    while stream.peek() != "}":
+        name = stream.value()
+        stream.expect(":")
+        if name == key:
+            found = True
+            stream.expect("[")
+            while stream.peek() != "]":
+                yield stream.value()
+                if stream.peek() == ",":
+                    stream.pos += 1
+            stream.pos += 1
+        else:
+            # other keys, like "count", are small
+            stream.value()
+        if stream.peek() == ",":
+            stream.pos += 1
+        elif stream.peek() != "}":
+            stream.expect("}")
+    if not found:
+        raise ValueError("No {!r} in repeaterbook API response".format(key))
+
+
+@attr.s
+class RepeaterTable:
+    """
+    Repeaterbook API results in compact, column-oriented form.
+
+    The fields named in `retained` (or every field, if None) are kept, with
+    strings interned, while the coordinates and frequency are stored
+    pre-parsed and the amateur band pre-classified.
+    """
+
+    fields = attr.ib(converter=tuple)
+    # one list per field, _MISSING when a record doesn't have the field
+    columns = attr.ib(converter=tuple, repr=False)
+    # float columns, NaN when the value doesn't parse
+    lat = attr.ib(repr=False)
+    long = attr.ib(repr=False)
+    frequency = attr.ib(repr=False)
+    # AmateurBands member name, or None if not an amateur frequency
+    band = attr.ib(repr=False)
+    # frozenset of field names kept from the results, or None for all fields
+    retained = attr.ib(default=None)
+    # content hash of the source data, or None if unknown
+    digest = attr.ib(default=None)
+
+    @classmethod
+    def from_results(cls, results, retain=None):
+        """
+        :param results: iterable of repeaterbook API dicts, consumed once
+        :param retain: names of the fields to keep, default all
+        """
+        retained = None if retain is None else frozenset(retain)
+        columns = {}
+        lat, long, frequency = (array.array("d") for _ in range(3))
+        n_records = 0
+        for r in results:
+            lat.append(_parse_float(r.get("Lat")))
+            long.append(_parse_float(r.get("Long")))
+            frequency.append(_parse_float(r.get("Frequency")))
+            for field, value in r.items():
+                if retained is not None and field not in retained:
+                    continue
+                column = columns.get(field)
+                if column is None:
+                    column = columns[field] = [_MISSING] * n_records
+                column.append(_intern(value))
+            n_records += 1
+            for column in columns.values():
+                if len(column) < n_records:
+                    column.append(_MISSING)
+        return cls(
+            fields=columns.keys(),
+            columns=columns.values(),
+            lat=lat,
+            long=long,
+            frequency=frequency,
+            band=[getattr(_band(f), "name", None) for f in frequency],
+            retained=retained,
+        )
+
+    @classmethod
+    def concat(cls, tables):
+        tables = tuple(tables)
+        fields = {}
+        for t in tables:
+            fields.update(dict.fromkeys(t.fields))
+        fields = tuple(fields)
+        columns = tuple([] for _ in fields)
+        for t in tables:
+            t_columns = dict(zip(t.fields, t.columns))
+            for f, column in zip(fields, columns):
+                column.extend(t_columns.get(f, [_MISSING] * len(t)))
+        # a field is retained if every table retained it
+        retained = [t.retained for t in tables if t.retained is not None]
+        digests = [t.digest for t in tables]
+        return cls(
+            fields=fields,
+            columns=columns,
+            lat=array.array("d", (v for t in tables for v in t.lat)),
+            long=array.array("d", (v for t in tables for v in t.long)),
+            frequency=array.array("d", (v for t in tables for v in t.frequency)),
+            band=[b for t in tables for b in t.band],
+            retained=frozenset.intersection(*retained) if retained else None,
+            digest=(
+                hashlib.sha256(" ".join(digests).encode("ascii")).hexdigest()
+                if tables and None not in digests
+                else None
+            ),
+        )
+
+    def retains(self, fields):
+        """:return: True if all of `fields` were kept (None means all fields)"""
+        if self.retained is None:
+            return True
+        return fields is not None and self.retained.issuperset(fields)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __iter__(self):
+        """Yield repeaterbook API dicts."""
+        fields = self.fields
+        for values in zip(*self.columns):
+            yield {f: v for f, v in zip(fields, values) if v is not _MISSING}
+
+    def __getitem__(self, ix):
+        """:return: repeaterbook API dict of repeater `ix`, built on each call"""
+        return {
+            f: column[ix]
+            for f, column in zip(self.fields, self.columns)
+            if column[ix] is not _MISSING
+        }
+
+    def column(self, field):
+        """:return: list of the values of `field`, _MISSING where absent"""
+        try:
+            return self.columns[self.fields.index(field)]
+        except ValueError:
+            return [_MISSING] * len(self)
+
+    @property
+    def coords(self):
+        """(lat, long) or None if the coordinates are bogus, per repeater"""
+        return [
+            (lat, long)
+            if math.isfinite(lat) and math.isfinite(long) and -90 <= lat <= 90
+            else None
+            for lat, long in zip(self.lat, self.long)
+        ]
+
+    def dump(self, path):
+        """
+        Write the table as gzipped JSON; absent values are written as null
+        and listed by index in "missing".
+        """
+        missing = {}
+        columns = []
+        for field, column in zip(self.fields, self.columns):
+            absent = [ix for ix, v in enumerate(column) if v is _MISSING]
+            if absent:
+                missing[field] = absent
+                column = [None if v is _MISSING else v for v in column]
+            columns.append(column)
+        with fetch.atomic_writer(path) as raw, gzip.GzipFile(
+            fileobj=raw, mode="wb", compresslevel=REPEATERBOOK_COMPACT_COMPRESSLEVEL
+        ) as f, io.TextIOWrapper(f, encoding="utf-8") as text:
+            json.dump(
+                dict(
+                    format=REPEATERBOOK_COMPACT_FORMAT,
+                    fields=self.fields,
+                    columns=columns,
+                    missing=missing,
+                    lat=self.lat.tolist(),
+                    long=self.long.tolist(),
+                    frequency=self.frequency.tolist(),
+                    band=self.band,
+                    retained=None if self.retained is None else sorted(self.retained),
+                    digest=self.digest,
+                ),
+                text,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: RepeaterTable or None if the file was written by an
+            incompatible version
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            table = json.load(f)
+        if table.get("format") != REPEATERBOOK_COMPACT_FORMAT:
+            return None
+        columns = table["columns"]
+        for field, absent in table["missing"].items():
+            column = columns[table["fields"].index(field)]
+            for ix in absent:
+                column[ix] = _MISSING
+        return cls(
+            fields=table["fields"],
+            columns=[[_intern(v) for v in column] for column in columns],
+            lat=array.array("d", table["lat"]),
+            long=array.array("d", table["long"]),
+            frequency=array.array("d", table["frequency"]),
+            band=table["band"],
+            retained=(
+                None if table["retained"] is None else frozenset(table["retained"])
+            ),
+            digest=table["digest"],
+        )
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(REPEATERBOOK_JSON_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _table_from_json(cached_json_file, retain=None, digest=None):
+    with open(cached_json_file, "r") as f:
+        try:
+            table = RepeaterTable.from_results(iter_json_results(f), retain=retain)
+        except Exception as exc:
+            logger.error("Cannot parse repeaterbook JSON %s: %s", cached_json_file, exc)
+            raise
+    table.digest = digest or _file_digest(cached_json_file)
+    return table
+
+
+def cached_table(
+    url, max_age=REPEATERBOOK_CACHE_MAX_AGE, cache_dir=None, offline=False, fields=None
+):
+    """
+    Fetch the repeaterbook API `url` (see `cached_json`) and return the results
+    as a RepeaterTable.
+
+    The compact table is cached next to the raw JSON, named by its digest,
+    so it is rebuilt only when the JSON content changes, or when it doesn't
+    retain all of `fields`. It is evicted from the cache along with the JSON.
+
+    :param fields: names of the fields to retain, default all
+    """
+    resp = cached_response(url, max_age=max_age, cache_dir=cache_dir, offline=offline)
+    compact_file = resp.derived_path(REPEATERBOOK_COMPACT_SUFFIX)
+    if compact_file.exists():
+        table = RepeaterTable.load(compact_file)
+        if table is not None:
+            if table.retains(fields):
+                return table, compact_file
+            if fields is not None:
+                # keep the fields needed by other runs, too
+                fields = table.retained.union(fields)
+    table = _table_from_json(resp.path, retain=fields, digest=resp.digest)
+    table.dump(compact_file)
+    return table, compact_file
+
+
+def _state_url(state, api=REPEATERBOOK_API):
+    return "".join(
+        (
+            api,
+            "?state={}".format(state),
+        )
+    )
+
+
+def load_cached_repeaters(
+    states=None,
+    max_age=REPEATERBOOK_CACHE_MAX_AGE,
+    api=REPEATERBOOK_API,
+    cache_dir=None,
+    max_workers=None,
+    offline=False,
+    fields=None,
+):
+    """
+    Load repeaters for each state, fetching expired states from the API.
+
+    States are checked and loaded concurrently; API requests are spaced
+    according to REPEATERBOOK_RATE_LIMIT.
+
+    :param max_workers: number of states to load at once
+        (default: REPEATERBOOK_FETCH_WORKERS)
+    :param offline: only use cached data, never contact the API
+    :param fields: names of the fields to retain, default all
+    :return: RepeaterTable of all repeaters in the given states
+    """
     if states is None:
         states = REPEATERBOOK_DEFAULT_STATES
-    for state in states:
-        url = "".join(
-            (
-                REPEATERBOOK_API,
-                "?state={}".format(state),
-            )
+    if max_workers is None:
+        max_workers = REPEATERBOOK_FETCH_WORKERS
+
+    def load_state(state):
+        table, cached_file = cached_table(
+            _state_url(state, api=api),
+            max_age=max_age,
+            cache_dir=cache_dir,
+            offline=offline,
+            fields=fields,
         )
-        cached_json_file = cached_json(url, max_age=max_age)
-        with open(cached_json_file, "r") as f:
-            try:
-                rb_api_resp = json.load(f)
-            except Exception:
-                f.seek(0)
-                print(f.read())
-                raise
-            logger.info(
-                "Load cached Repeaterbook data for %s: %s records (%s)",
-                state,
-                len(rb_api_resp["results"]),
-                cached_json_file,
+        logger.info(
+            "Load cached Repeaterbook data for %s: %s records (%s)",
+            state,
+            len(table),
+            cached_file,
+        )
+        return table
+
+    tables = fetch.map_concurrent(load_state, states, max_workers=max_workers)
+    if len(tables) == 1:
+        return tables[0]
+    return RepeaterTable.concat(tables)
+
+
+def iter_cached_repeaters(states=None, max_age=REPEATERBOOK_CACHE_MAX_AGE):
+    yield from load_cached_repeaters(states=states, max_age=max_age)
+
+
+def geocode_zone(name, zone, places=None):
+    """
+    Fill in missing Lat and Long of a proximity zone from the place name at
+    the start of the zone name (see `dzcb.gazetteer`).
+
+    :param places: Gazetteer, default the bundled places
+    :raise: ValueError if the zone name doesn't start with a known place
+    """
+    if places is None:
+        places = gazetteer.default_gazetteer()
+    place = places.resolve(name)
+    if place is None:
+        raise ValueError(
+            "Cannot geocode proximity zone {!r}, specify {} and {}".format(
+                name, CSV_LAT, CSV_LONG
             )
-        for repeater in rb_api_resp["results"]:
-            yield repeater
+        )
+    logger.debug("Geocode proximity zone %r: %s, %s", name, place.name, place.state)
+    zone[CSV_LAT] = str(place.lat)
+    zone[CSV_LONG] = str(place.long)
 
 
-def proximity_zones(proximity_zones_csv):
+def proximity_zones(proximity_zones_csv, places=None):
+    """
+    :param places: Gazetteer for zones with a distance but no Lat and Long,
+        default the bundled places
+    :return: iterator of (zone name, slug, zone dict)
+    """
     csvr = csv.DictReader(
         proximity_zones_csv,
     )
@@ -93,9 +599,521 @@ def proximity_zones(proximity_zones_csv):
         slug = (
             name.replace(" ", "-").replace(",", "").replace("/", "-").replace("\\", "-")
         )
+        if (
+            zone.get(CSV_DISTANCE)
+            and not zone.get(CSV_ROUTE)
+            and not zone.get(CSV_LAT)
+            and not zone.get(CSV_LONG)
+        ):
+            geocode_zone(name, zone, places=places)
         yield (name, slug, zone)
 
 
+def parse_route(route):
+    """
+    :param route: "lat,long;lat,long;..." (lat and long may also be separated
+        by whitespace)
+    :return: tuple of (lat, long) vertices
+    :raise: ValueError if the route has fewer than 2 vertices or bad coordinates
+    """
+    vertices = []
+    for vertex in route.split(";"):
+        if not vertex.strip():
+            continue
+        lat, long = (float(c) for c in re.split(r"[,\s]+", vertex.strip()))
+        if not -90 <= lat <= 90:
+            raise ValueError("Bogus route latitude: {!r}".format(vertex))
+        vertices.append((lat, long))
+    if len(vertices) < 2:
+        raise ValueError("Route needs at least 2 vertices: {!r}".format(route))
+    return tuple(vertices)
+
+
+def _route_steps(route):
+    """
+    Split the route into short straight steps.
+
+    :return: iterator of (start (lat, long), end (lat, long), start position
+        along the route in km, step length in km)
+    """
+    position = 0
+    for start, end in zip(route, route[1:]):
+        length = geopy.distance.distance(start, end).km
+        n_steps = max(1, math.ceil(length / REPEATERBOOK_ROUTE_STEP_KM))
+        d_lat = (end[0] - start[0]) / n_steps
+        # take the short way around the antimeridian
+        d_long = ((end[1] - start[1] + 180) % 360 - 180) / n_steps
+        for step in range(n_steps):
+            a = (start[0] + d_lat * step, start[1] + d_long * step)
+            b = (a[0] + d_lat, a[1] + d_long)
+            yield a, b, position + length * step / n_steps, length / n_steps
+        position += length
+
+
+def bounding_box(poi_coords, radius_km):
+    """
+    :return: (lat_low, lat_high, long_low, long_high) in degrees, containing
+        the circle of `radius_km` around `poi_coords`. The longitudes are not
+        wrapped to -180..180, and span 360 degrees if the circle reaches a pole.
+    """
+    lat, long = poi_coords
+    # pad the box slightly, the ellipsoid is not quite a sphere
+    d_lat = radius_km / _KM_PER_DEGREE_LAT * 1.01
+    lat_low, lat_high = max(lat - d_lat, -90), min(lat + d_lat, 90)
+    max_abs_lat = max(abs(lat_low), abs(lat_high))
+    cos_lat = math.cos(math.radians(max_abs_lat))
+    if cos_lat > 0:
+        d_long = radius_km / (_KM_PER_DEGREE_LONG * cos_lat) * 1.01
+    else:
+        d_long = 180
+    if d_long >= 180:
+        return lat_low, lat_high, -180, 180
+    return lat_low, lat_high, long - d_long, long + d_long
+
+
+def _boxes_intersect(box, other, margin=0):
+    """
+    :param box: (lat_low, lat_high, long_low, long_high)
+    :param other: (lat_low, lat_high, long_low, long_high)
+    :param margin: degrees to grow `box` by on each side
+    """
+    if box[0] - margin > other[1] or other[0] > box[1] + margin:
+        return False
+    return any(
+        box[2] - margin <= other[3] + shift and other[2] + shift <= box[3] + margin
+        for shift in (-360, 0, 360)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def state_bounds():
+    """
+    :return: dict of lowercase state or province name ->
+        (lat_low, lat_high, long_low, long_high), from the bundled
+        repeaterbook_state_bounds.csv
+    """
+    bounds = {}
+    csv_text = files(dzcb.data).joinpath(REPEATERBOOK_STATE_BOUNDS_CSV).read_text()
+    for row in csv.DictReader(csv_text.splitlines()):
+        bounds[row["State"].lower()] = tuple(
+            float(row[k]) for k in ("South", "North", "West", "East")
+        )
+    return bounds
+
+
+def zone_bounding_boxes(zone):
+    """
+    :param zone: proximity zone dict from `proximity_zones`
+    :return: list of bounding boxes (see `bounding_box`) covering the zone,
+        or None if the zone is not limited by distance
+    """
+    radius = zone.get(CSV_DISTANCE)
+    if not radius:
+        return None
+    try:
+        radius_km = _radius_km(float(radius), zone[CSV_UNIT])
+        if zone.get(CSV_ROUTE):
+            return [
+                bounding_box(
+                    ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2), length / 2 + radius_km
+                )
+                for a, b, _, length in _route_steps(parse_route(zone[CSV_ROUTE]))
+            ]
+        return [
+            bounding_box((float(zone[CSV_LAT]), float(zone[CSV_LONG])), radius_km)
+        ]
+    except (AttributeError, KeyError, ValueError):
+        # reported when the zone is filtered
+        return None
+
+
+def states_for_zones(states, zones, margin=REPEATERBOOK_STATE_BOUNDS_MARGIN):
+    """
+    Select the states that may have repeaters in any of the zones.
+
+    :param states: sequence of state or province names
+    :param zones: proximity zone dicts from `proximity_zones`
+    :param margin: degrees to grow each state's bounding box by
+    :return: tuple of the states (in order) with a bounding box that
+        intersects a zone. States without bundled bounds are always included.
+    """
+    boxes = []
+    for zone in zones:
+        zone_boxes = zone_bounding_boxes(zone)
+        if zone_boxes is None:
+            return tuple(states)
+        boxes.extend(zone_boxes)
+    bounds = state_bounds()
+    selected = []
+    for state in states:
+        state_box = bounds.get(state.lower())
+        if state_box is None:
+            logger.debug("No bounds for %r, it will always be loaded", state)
+        if state_box is None or any(
+            _boxes_intersect(state_box, box, margin) for box in boxes
+        ):
+            selected.append(state)
+    return tuple(selected)
+
+
+def _repeater_id(repeater):
+    return (
+        repeater.get("State ID", "Unknown state"),
+        repeater.get("Rptr ID", "Unknown repeater"),
+    )
+
+
+def haversine_km(poi_coords, lats, longs):
+    """
+    Great circle distance from one point to many points.
+
+    :param poi_coords: (lat, long) in degrees
+    :param lats: sequence (or numpy array) of latitude in radians
+    :param longs: sequence (or numpy array) of longitude in radians
+    :return: sequence (or numpy array) of distance in km
+    """
+    lat0, long0 = (math.radians(c) for c in poi_coords)
+    if numpy is not None and isinstance(lats, numpy.ndarray):
+        a = (
+            numpy.sin((lats - lat0) / 2) ** 2
+            + math.cos(lat0) * numpy.cos(lats) * numpy.sin((longs - long0) / 2) ** 2
+        )
+        return 2 * _EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1)))
+    cos_lat0 = math.cos(lat0)
+    distances = []
+    for lat, long in zip(lats, longs):
+        a = (
+            math.sin((lat - lat0) / 2) ** 2
+            + cos_lat0 * math.cos(lat) * math.sin((long - long0) / 2) ** 2
+        )
+        distances.append(2 * _EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1))))
+    return distances
+
+
+def _radius_km(radius, dunit):
+    # geopy Distance(1) is 1 km, expressed in `dunit`
+    return radius / getattr(geopy.distance.Distance(1), dunit)
+
+
+def _parse_coords(repeater):
+    """
+    :return: (lat, long) as float, or None if the coordinates are bogus
+    """
+    try:
+        lat, long = float(repeater["Lat"]), float(repeater["Long"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(long)) or not -90 <= lat <= 90:
+        return None
+    return lat, long
+
+
+def _repeater_sequence(repeaters):
+    return repeaters if isinstance(repeaters, RepeaterTable) else tuple(repeaters)
+
+
+@attr.s
+class RepeaterIndex:
+    """
+    Spatial grid index over repeater coordinates.
+
+    Repeaters are bucketed into cells of `cell_degrees` latitude and longitude
+    once, so each proximity query only considers the repeaters in the cells
+    overlapping the bounding box of its radius.
+
+    Candidate distances are computed in a batch with the haversine formula
+    (vectorized with numpy, if available) and the exact geodesic distance is
+    only computed for candidates that may be within the radius. Results are
+    remembered per point of interest, so overlapping zones around the same
+    point are answered from the same sweep.
+
+    Repeaters are also bucketed by amateur band, and inverted indexes of the
+    lowercase value of each criteria field are built on first use, so zone
+    criteria are matched by intersecting sets of repeater index.
+    """
+
+    # RepeaterTable (records are built on access) or sequence of dicts
+    repeaters = attr.ib(converter=_repeater_sequence)
+    cell_degrees = attr.ib(default=REPEATERBOOK_GRID_DEGREES)
+    # (lat, long) or None for each repeater, parsed from repeaters if not given
+    _coords = attr.ib(default=None, repr=False)
+    # AmateurBands or None for each repeater, parsed from repeaters if not given
+    _bands = attr.ib(default=None, repr=False)
+    # frequency (NaN if bogus) for each repeater, parsed from repeaters if not given
+    _frequencies = attr.ib(default=None, repr=False)
+    # (lat cell, long cell) -> list of repeater index
+    _cells = attr.ib(factory=dict, init=False, repr=False)
+    # poi_coords -> (radius_km, list of (geopy Distance, repeater index))
+    _nearby = attr.ib(factory=dict, init=False, repr=False)
+    # AmateurBands -> set of repeater index
+    _band_buckets = attr.ib(factory=dict, init=False, repr=False)
+    # criteria field -> lowercase value -> set of repeater index
+    _criteria = attr.ib(factory=dict, init=False, repr=False)
+    # frequency ranges -> set of repeater index within the ranges
+    _in_ranges = attr.ib(factory=dict, init=False, repr=False)
+
+    @classmethod
+    def from_table(cls, table, **kwargs):
+        """
+        Build an index from a RepeaterTable, using its pre-parsed coordinates,
+        frequencies and bands.
+        """
+        return cls(
+            repeaters=table,
+            coords=table.coords,
+            bands=[None if b is None else AmateurBands[b] for b in table.band],
+            frequencies=table.frequency,
+            **kwargs
+        )
+
+    def __attrs_post_init__(self):
+        self._n_long_cells = math.ceil(360 / self.cell_degrees)
+        if self._coords is None:
+            self._coords = [_parse_coords(r) if r else None for r in self.repeaters]
+        if self._frequencies is None:
+            self._frequencies = [
+                _parse_float(r.get("Frequency")) for r in self.repeaters
+            ]
+        if self._bands is None:
+            self._bands = [_band(f) for f in self._frequencies]
+        for ix, band in enumerate(self._bands):
+            if band is not None:
+                self._band_buckets.setdefault(band, set()).add(ix)
+        for ix, coords in enumerate(self._coords):
+            if coords is None:
+                r = self.repeaters[ix]
+                if r:
+                    logger.warning(
+                        "Ignore repeater {!r} with bogus coordinates: {!r}".format(
+                            _repeater_id(r),
+                            (r.get("Lat"), r.get("Long")),
+                        )
+                    )
+                continue
+            self._cells.setdefault(self._cell(*coords), []).append(ix)
+        self._lats = [math.radians(c[0]) if c else 0 for c in self._coords]
+        self._longs = [math.radians(c[1]) if c else 0 for c in self._coords]
+        self._vectorized = numpy is not None
+        if self._vectorized:
+            self._lats = numpy.array(self._lats, dtype=float)
+            self._longs = numpy.array(self._longs, dtype=float)
+
+    def _lat_cell(self, lat):
+        return math.floor(lat / self.cell_degrees)
+
+    def _long_cell(self, long):
+        return math.floor((long + 180) / self.cell_degrees) % self._n_long_cells
+
+    def _cell(self, lat, long):
+        return self._lat_cell(lat), self._long_cell(long)
+
+    def candidates(self, poi_coords, radius_km):
+        """
+        :return: sorted list of repeater index inside the bounding box of
+            `radius_km` around `poi_coords`
+        """
+        lat_low, lat_high, long_low, long_high = bounding_box(poi_coords, radius_km)
+        if long_high - long_low >= 360:
+            long_cells = range(self._n_long_cells)
+        else:
+            long_cells = (
+                ix % self._n_long_cells
+                for ix in range(
+                    math.floor((long_low + 180) / self.cell_degrees),
+                    math.floor((long_high + 180) / self.cell_degrees) + 1,
+                )
+            )
+        long_cells = set(long_cells)
+        candidates = []
+        for lat_cell in range(self._lat_cell(lat_low), self._lat_cell(lat_high) + 1):
+            for long_cell in long_cells:
+                candidates.extend(self._cells.get((lat_cell, long_cell), ()))
+        return sorted(candidates)
+
+    def _nearby_km(self, poi_coords, radius_km):
+        """
+        :return: list of (geopy Distance, repeater index) for repeaters within
+            `radius_km` of `poi_coords`, in repeater order
+        """
+        cached_radius_km, nearby = self._nearby.get(poi_coords, (-1, None))
+        # allow for rounding in unit conversion, callers compare in their unit
+        radius_km *= 1 + 1e-9
+        if cached_radius_km >= radius_km:
+            return [(d, ix) for d, ix in nearby if d.km <= radius_km]
+        candidates = self.candidates(poi_coords, radius_km)
+        if self._vectorized:
+            candidates = numpy.array(candidates, dtype=int)
+            approx_km = haversine_km(
+                poi_coords, self._lats[candidates], self._longs[candidates]
+            )
+            survivors = candidates[approx_km <= radius_km * _HAVERSINE_SLACK].tolist()
+        else:
+            approx_km = haversine_km(
+                poi_coords,
+                [self._lats[ix] for ix in candidates],
+                [self._longs[ix] for ix in candidates],
+            )
+            survivors = [
+                ix
+                for ix, km in zip(candidates, approx_km)
+                if km <= radius_km * _HAVERSINE_SLACK
+            ]
+        nearby = []
+        for ix in survivors:
+            distance = geopy.distance.distance(poi_coords, self._coords[ix])
+            if distance.km <= radius_km:
+                nearby.append((distance, ix))
+        self._nearby[poi_coords] = (radius_km, nearby)
+        return nearby
+
+    def within_many(self, queries):
+        """
+        Answer many proximity queries in one sweep.
+
+        Each distinct point of interest is only measured once, out to the largest
+        radius requested for it.
+
+        :param queries: sequence of (poi_coords, radius, dunit)
+        :return: list of results, as returned by `within`, for each query
+        """
+        queries = [
+            (poi_coords, radius, dunit, _radius_km(radius, dunit))
+            for poi_coords, radius, dunit in queries
+        ]
+        max_radius_km = {}
+        for poi_coords, _, _, radius_km in queries:
+            max_radius_km[poi_coords] = max(
+                radius_km, max_radius_km.get(poi_coords, radius_km)
+            )
+        for poi_coords, radius_km in max_radius_km.items():
+            self._nearby_km(poi_coords, radius_km)
+        return [
+            [
+                (distance, ix)
+                for distance, ix in self._nearby_km(poi_coords, radius_km)
+                if getattr(distance, dunit) <= radius
+            ]
+            for poi_coords, radius, dunit, radius_km in queries
+        ]
+
+    def within(self, poi_coords, radius, dunit):
+        """
+        :param poi_coords: (lat, long) of the point of interest
+        :param radius: maximum distance from the point of interest
+        :param dunit: unit of `radius`: "miles", "km", etc
+        :return: list of (geopy Distance, repeater index) for repeaters within
+            radius, in repeater order
+        """
+        return self.within_many([(poi_coords, radius, dunit)])[0]
+
+    def along_route(self, route, radius, dunit):
+        """
+        :param route: sequence of (lat, long) vertices
+        :param radius: maximum distance from the route
+        :param dunit: unit of `radius`: "miles", "km", etc
+        :return: list of (position along the route in km, geopy Distance from
+            the route, repeater index) for repeaters within radius of the
+            route, ordered along the route
+        """
+        radius_km = _radius_km(radius, dunit) * (1 + 1e-9)
+        # repeater index -> (distance km, position, geopy Distance)
+        nearest = {}
+        for a, b, position, length in _route_steps(route):
+            mid = ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+            # local planar projection (km) centered on the step
+            kx = _KM_PER_DEGREE * math.cos(math.radians(mid[0]))
+            ky = _KM_PER_DEGREE
+            ax, ay = (a[1] - mid[1]) * kx, (a[0] - mid[0]) * ky
+            bx, by = (b[1] - mid[1]) * kx, (b[0] - mid[0]) * ky
+            dx, dy = bx - ax, by - ay
+            len2 = dx * dx + dy * dy
+            for ix in self.candidates(mid, length / 2 + radius_km):
+                lat, long = self._coords[ix]
+                px = ((long - mid[1] + 180) % 360 - 180) * kx
+                py = (lat - mid[0]) * ky
+                t = ((px - ax) * dx + (py - ay) * dy) / len2 if len2 else 0
+                t = min(1, max(0, t))
+                cx, cy = ax + t * dx, ay + t * dy
+                approx_km = math.hypot(px - cx, py - cy)
+                if approx_km > radius_km * 1.05 + 0.1:
+                    continue
+                best = nearest.get(ix)
+                if best is not None and best[0] <= approx_km * 0.95 - 0.1:
+                    continue
+                distance = geopy.distance.distance(
+                    (lat, long), (mid[0] + cy / ky, mid[1] + cx / kx)
+                )
+                if distance.km > radius_km:
+                    continue
+                if best is None or distance.km < best[0]:
+                    nearest[ix] = (distance.km, position + t * length, distance)
+        return sorted(
+            (position, distance, ix)
+            for ix, (_, position, distance) in nearest.items()
+        )
+
+    def band(self, ix):
+        """:return: AmateurBands of repeater `ix`, or None if not amateur"""
+        return self._bands[ix]
+
+    def criteria_index(self, field):
+        """:return: dict of lowercase value of `field` -> set of repeater index"""
+        index = self._criteria.get(field)
+        if index is None:
+            index = self._criteria[field] = {}
+            if isinstance(self.repeaters, RepeaterTable):
+                values = (
+                    "" if v is _MISSING else v for v in self.repeaters.column(field)
+                )
+            else:
+                values = (r.get(field, "") for r in self.repeaters)
+            for ix, value in enumerate(values):
+                index.setdefault(str(value).lower(), set()).add(ix)
+        return index
+
+    def indices(self):
+        """:return: iterable of the index of every (non-empty) repeater"""
+        if isinstance(self.repeaters, RepeaterTable):
+            return range(len(self.repeaters))
+        return (ix for ix, r in enumerate(self.repeaters) if r)
+
+    def in_ranges(self, ranges):
+        """
+        :return: set of repeater index with a frequency in `ranges`, including
+            repeaters with a bogus frequency
+        """
+        key = tuple(tuple(r) for r in ranges)
+        matching = self._in_ranges.get(key)
+        if matching is None:
+            matching = self._in_ranges[key] = {
+                ix
+                for ix, f in enumerate(self._frequencies)
+                if not math.isfinite(f) or frequency_in_ranges(f, ranges)
+            }
+        return matching
+
+    def matching(self, bands=None, criteria=None, ranges=None):
+        """
+        :param bands: sequence of AmateurBands, any of which match
+        :param criteria: dict of field -> value, all of which must match
+            (case-insensitive)
+        :param ranges: sequence of tuple of (low, high) frequency
+        :return: set of repeater index matching all conditions, or None if
+            there are no conditions
+        """
+        sets = []
+        if bands:
+            sets.append(set().union(*(self._band_buckets.get(b, ()) for b in bands)))
+        for field, value in (criteria or {}).items():
+            sets.append(self.criteria_index(field).get(str(value).lower(), set()))
+        if ranges is not None:
+            sets.append(self.in_ranges(ranges))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+
 def matches_criteria(repeater, criteria):
     for field, value in criteria.items():
         # XXX: maybe need a regex match here...
@@ -104,65 +1122,194 @@ def matches_criteria(repeater, criteria):
     return True
 
 
-def filter_repeaters(repeaters, zone):
+def _zone_query(zone):
+    """
+    :return: (poi_coords, radius, dunit) for a proximity zone dict, or None
+        if the zone has no radius or is a route
+    """
+    radius = zone[CSV_DISTANCE]
+    if not radius or zone.get(CSV_ROUTE):
+        return None
+    poi_coords = (float(zone[CSV_LAT]), float(zone[CSV_LONG]))
+    return poi_coords, float(radius), zone[CSV_UNIT]
+
+
+def filter_repeaters(repeaters, zone, ranges=None):
+    """
+    :param repeaters: RepeaterIndex or sequence of repeaterbook API dicts
+    :param zone: proximity zone dict from `proximity_zones`
+    :param ranges: sequence of tuple of (low, high) frequency to retain, default all
+    :return: list of repeaters matching the zone, nearest first (or in order
+        along the route)
+    """
+    if not isinstance(repeaters, RepeaterIndex):
+        repeaters = RepeaterIndex(repeaters)
+    return [
+        repeaters.repeaters[ix]
+        for ix in _filter_indices(repeaters, zone, ranges=ranges)
+    ]
+
+
+def _filter_indices(repeaters, zone, ranges=None):
+    """
+    :param repeaters: RepeaterIndex
+    :return: list of index of the repeaters matching the zone, see
+        `filter_repeaters`
+    """
     zone = zone.copy()
     radius = zone.pop(CSV_DISTANCE)
     dunit = zone.pop(CSV_UNIT)
-    if radius:
+    route = zone.pop(CSV_ROUTE, None)
+    if route:
+        zone.pop(CSV_LAT, None)
+        zone.pop(CSV_LONG, None)
+    elif radius:
         radius = float(radius)
         poi_coords = (float(zone.pop(CSV_LAT)), float(zone.pop(CSV_LONG)))
-    else:
-        distance = 0
     bands = [
         AmateurBands.get_normalized(b)
         for b in zone.pop(CSV_BAND).strip().split(";")
         if b
     ]
-    matching = []
-    # Find matching repeaters
-    for r in repeaters:
-        if not r:
-            continue
-        if radius:
-            # repeater must be within radius of poi
-            repeater_coords = (r["Lat"], r["Long"])
-            try:
-                distance = geopy.distance.distance(poi_coords, repeater_coords)
-            except ValueError:
-                repeater_id = (
-                    r.get("State ID", "Unknown state"),
-                    r.get("Rptr ID", "Unknown repeater"),
-                )
-                logger.warning(
-                    "Ignore repeater {!r} with bogus coordinates: {!r}".format(
-                        repeater_id,
-                        repeater_coords,
-                    )
-                )
-                continue
-            if getattr(distance, dunit) > radius:
-                continue
-        if bands:
-            # repeater frequency must be in the given bands
-            try:
-                if AmateurBands.get_normalized(r["Frequency"]) not in bands:
-                    continue
-            except ValueError as ve:
-                repeater_id = (
-                    r.get("State ID", "Unknown state"),
-                    r.get("Rptr ID", "Unknown repeater"),
-                )
+    if route:
+        if not radius:
+            raise ValueError("Route zones require a {}".format(CSV_DISTANCE))
+        # repeater must be within radius of the route
+        nearby = [
+            ((position, distance), ix)
+            for position, distance, ix in repeaters.along_route(
+                parse_route(route), float(radius), dunit
+            )
+        ]
+    elif radius:
+        # repeater must be within radius of poi
+        nearby = repeaters.within(poi_coords, radius, dunit)
+    else:
+        nearby = [(0, ix) for ix in repeaters.indices()]
+    # repeater frequency must be in the given bands and ranges, and the
+    # remaining fields in the zone list are criteria to satisfy
+    matching = repeaters.matching(bands=bands, criteria=zone, ranges=ranges)
+    if bands:
+        for _, ix in nearby:
+            if repeaters.band(ix) is None and (
+                ranges is None or ix in repeaters.in_ranges(ranges)
+            ):
                 logger.warning(
                     "Ignore repeater {!r} with non-amateur frequency: {!r}".format(
-                        repeater_id,
-                        r["Frequency"],
+                        _repeater_id(repeaters.repeaters[ix]),
+                        repeaters.repeaters[ix]["Frequency"],
                     )
                 )
-                continue
-        # remaining fields in the zone list are criteria to satisfy
-        if matches_criteria(r, zone):
-            matching.append((distance, r))
-    return [r for _, r in sorted(matching, key=lambda x: x[0])]
+    if matching is not None:
+        nearby = [(distance, ix) for distance, ix in nearby if ix in matching]
+    return [ix for _, ix in sorted(nearby)]
+
+
+@attr.s
+class ProximityMemo:
+    """
+    Proximity zone results from previous runs.
+
+    Results are stored as positions in the repeater dataset, so they are only
+    valid for the exact data they were computed from: each dataset `digest`
+    (see `RepeaterTable.digest`) has its own memo file in the memo directory,
+    so runs with different states don't discard each other's results. Only
+    the REPEATERBOOK_PROXIMITY_MEMO_KEEP most recently saved files are kept.
+    """
+
+    path = attr.ib(converter=Path)
+    digest = attr.ib()
+    # (zone key, ranges key) -> list of repeater index
+    results = attr.ib(factory=dict, repr=False)
+    _changed = attr.ib(default=False, init=False, repr=False)
+
+    @classmethod
+    def load(cls, memo_dir, digest):
+        """
+        :return: ProximityMemo with the results saved in `memo_dir` for `digest`
+        """
+        path = Path(memo_dir) / "{}.json.gz".format(digest)
+        return cls(path, digest, results=cls._load_results(path))
+
+    @staticmethod
+    def _load_results(path):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                memo = json.load(f)
+            if memo.get("format") != REPEATERBOOK_PROXIMITY_MEMO_FORMAT:
+                return {}
+            return {
+                (
+                    tuple(tuple(item) for item in zone_key),
+                    None if ranges is None else tuple(tuple(r) for r in ranges),
+                ): indices
+                for zone_key, ranges, indices in memo["results"]
+            }
+        except FileNotFoundError:
+            return {}
+        except Exception as exc:
+            logger.warning("Ignore unreadable proximity memo %s: %s", path, exc)
+            return {}
+
+    @staticmethod
+    def key(zone, ranges=None):
+        """
+        :return: hashable key of the zone criteria, location, radius, unit,
+            bands, and frequency ranges
+        """
+        return (
+            tuple(sorted((k, str(v)) for k, v in zone.items())),
+            None if ranges is None else tuple(tuple(r) for r in ranges),
+        )
+
+    def get(self, zone, ranges=None):
+        """:return: list of repeater index, or None if not memoized"""
+        return self.results.get(self.key(zone, ranges))
+
+    def set(self, zone, ranges, indices):
+        key = self.key(zone, ranges)
+        if self.results.get(key) != indices:
+            self.results[key] = list(indices)
+            self._changed = True
+
+    def save(self):
+        """
+        Write the results, merged with those saved meanwhile by other
+        processes for the same digest, and remove the memo files of the
+        least recently saved datasets.
+        """
+        if not self._changed:
+            return
+        memo_dir = self.path.parent
+        memo_dir.mkdir(parents=True, exist_ok=True)
+        with fetch.file_lock(memo_dir / "memo.lock"):
+            results = self._load_results(self.path)
+            results.update(self.results)
+            self.results = results
+            fetch._write_atomic(
+                self.path,
+                gzip.compress(
+                    json.dumps(
+                        dict(
+                            format=REPEATERBOOK_PROXIMITY_MEMO_FORMAT,
+                            digest=self.digest,
+                            results=[
+                                [zone_key, ranges, indices]
+                                for (zone_key, ranges), indices in results.items()
+                            ],
+                        )
+                    ).encode("utf-8"),
+                    compresslevel=REPEATERBOOK_COMPACT_COMPRESSLEVEL,
+                ),
+            )
+            memo_files = sorted(
+                memo_dir.glob("*.json.gz"),
+                key=lambda p: p.stat().st_mtime,
+                reverse=True,
+            )
+            for old in memo_files[REPEATERBOOK_PROXIMITY_MEMO_KEEP:]:
+                old.unlink()
+        self._changed = False
 
 
 def normalize_tone(tone):
@@ -185,32 +1332,241 @@ def repeater_to_k7abd_row(repeater, zone_name, name_format=None):
     }
 
 
-def zones_to_k7abd(input_csv, output_dir, states=None, name_format=None):
-    repeaters = list(iter_cached_repeaters(states=states))
-    for name, slug, zone in proximity_zones(input_csv):
-        out_file = Path(output_dir) / "Analog__{}.csv".format(slug)
-        total_channels = 0
-        with open(out_file, "w", newline="") as out:
-            csvw = csv.DictWriter(
-                out,
-                fieldnames=k7abd.ANALOG_CSV_FIELDS,
+def used_fields(name_format=None, zones=()):
+    """
+    :param name_format: channel name format string
+    :param zones: proximity zone dicts from `proximity_zones`
+    :return: set of API field names referenced by the name format, the zone
+        criteria, and `repeater_to_k7abd_row`
+    """
+    if name_format is None:
+        name_format = REPEATERBOOK_DEFAULT_NAME_FORMAT
+    fields = set(REPEATERBOOK_FIELDS)
+    for _, field_name, _, _ in string.Formatter().parse(name_format):
+        if field_name:
+            fields.add(re.split(r"[.\[]", field_name, maxsplit=1)[0])
+    for zone in zones:
+        fields.update(k for k in zone if k not in CSV_ZONE_FIELDS)
+    return fields
+
+
+def iter_zone_repeaters(
+    input_csv,
+    states=None,
+    name_format=None,
+    ranges=None,
+    offline=False,
+    store=None,
+    memo_dir=REPEATERBOOK_PROXIMITY_MEMO_DIR,
+):
+    """
+    Filter repeaters for each proximity zone in `input_csv`.
+
+    :param name_format: channel name format string, its fields are retained
+        when loading the repeaters
+    :param store: `dzcb.repeaterdb.RepeaterDB` to load the states into and
+        query, instead of filtering the repeaters in memory
+    :param memo_dir: reuse the results of zones that were filtered from the
+        same repeater data by a previous run (see `ProximityMemo`), None to
+        always filter
+    :return: iterator of (zone name, slug, list of repeaterbook API dicts)
+    """
+    zones = list(proximity_zones(input_csv))
+    if states is None:
+        states = REPEATERBOOK_DEFAULT_STATES
+    # only load the states that the zones reach
+    needed_states = states_for_zones(states, (zone for _, _, zone in zones))
+    skipped_states = [s for s in states if s not in needed_states]
+    if skipped_states:
+        logger.info(
+            "Skip Repeaterbook states outside of all proximity zones: %s",
+            ", ".join(skipped_states),
+        )
+    if store is not None:
+        store.load_states(needed_states, offline=offline)
+        for name, slug, zone in zones:
+            yield name, slug, store.filter_repeaters(
+                zone, needed_states, ranges=ranges
             )
-            csvw.writeheader()
-            for repeater in filter_repeaters(repeaters, zone):
-                csvw.writerow(
-                    repeater_to_k7abd_row(
-                        repeater, zone_name=name, name_format=name_format
-                    )
-                )
-                total_channels += 1
+        return
+    table = load_cached_repeaters(
+        states=needed_states,
+        offline=offline,
+        fields=used_fields(name_format, (zone for _, _, zone in zones)),
+    )
+    repeaters = RepeaterIndex.from_table(table)
+    memo = None
+    if memo_dir is not None and table.digest is not None:
+        memo = ProximityMemo.load(memo_dir, table.digest)
+    memoized = [memo.get(zone, ranges) if memo else None for _, _, zone in zones]
+    if memo:
+        logger.info(
+            "Reuse results of %s of %s proximity zones",
+            sum(1 for indices in memoized if indices is not None),
+            len(zones),
+        )
+    # measure distances for all remaining zones in one sweep
+    repeaters.within_many(
+        query
+        for query in (
+            _zone_query(zone)
+            for (_, _, zone), indices in zip(zones, memoized)
+            if indices is None
+        )
+        if query
+    )
+    for (name, slug, zone), indices in zip(zones, memoized):
+        if indices is None:
+            indices = _filter_indices(repeaters, zone, ranges=ranges)
+            if memo:
+                memo.set(zone, ranges, indices)
+        yield name, slug, [repeaters.repeaters[ix] for ix in indices]
+    if memo:
+        memo.save()
+
+
+def iter_zone_rows(input_csv, states=None, name_format=None, **kwargs):
+    """
+    Filter repeaters for each proximity zone in `input_csv`, see
+    `iter_zone_repeaters` for parameters.
+
+    :return: iterator of (zone name, slug, list of k7abd analog row dicts)
+    """
+    for name, slug, repeaters in iter_zone_repeaters(
+        input_csv, states=states, name_format=name_format, **kwargs
+    ):
+        yield name, slug, [
+            repeater_to_k7abd_row(repeater, zone_name=name, name_format=name_format)
+            for repeater in repeaters
+        ]
+
+
+def _k7abd_filename(slug):
+    return "Analog__{}.csv".format(slug)
+
+
+def write_k7abd_rows(out_file, rows):
+    with open(out_file, "w", newline="") as out:
+        csvw = csv.DictWriter(
+            out,
+            fieldnames=k7abd.ANALOG_CSV_FIELDS,
+        )
+        csvw.writeheader()
+        csvw.writerows(rows)
+
+
+def zones_to_k7abd(
+    input_csv,
+    output_dir,
+    states=None,
+    name_format=None,
+    ranges=None,
+    offline=False,
+    store=None,
+):
+    for name, slug, rows in iter_zone_rows(
+        input_csv,
+        states=states,
+        name_format=name_format,
+        ranges=ranges,
+        offline=offline,
+        store=store,
+    ):
+        out_file = Path(output_dir) / _k7abd_filename(slug)
+        write_k7abd_rows(out_file, rows)
         logger.debug(
             "Generate '%s' k7abd zones (%s channels) to '%s'",
             name,
-            total_channels,
+            len(rows),
             out_file,
         )
 
 
+def _analog_channel(row, ranges=None):
+    """
+    :return: AnalogChannel for a k7abd analog row dict, or None if it is
+        outside of ranges or invalid
+    """
+    # same values that would be read back from the CSV file
+    row = {k: "" if v is None else str(v) for k, v in row.items()}
+    try:
+        return k7abd.Analog_from_row(row, ranges=ranges)
+    except ValueError as ve:
+        logger.info(
+            "Skipping channel {} / {}: {}".format(
+                row[k7abd.ZONE], row[k7abd.CHANNEL_NAME], ve
+            )
+        )
+
+
+def zones_to_analog(
+    input_csv,
+    states=None,
+    name_format=None,
+    ranges=None,
+    offline=False,
+    k7abd_dir=None,
+    store=None,
+    channel_pool=None,
+):
+    """
+    Generate analog zones in memory, without writing k7abd files.
+
+    Each repeater's channel is built once and the same AnalogChannel instance
+    is referenced by every zone that includes the repeater.
+
+    :param k7abd_dir: if given, also write the zones as k7abd Analog__ CSV
+        files into this directory for reference
+    :param store: `dzcb.repeaterdb.RepeaterDB` to query (see `iter_zone_rows`)
+    :param channel_pool: dict to share channels across calls, keyed by repeater
+        identity, name format, code, and ranges
+    :return: dict of Analog__ file name -> dict of zone name -> list of
+        AnalogChannel (see `k7abd.Codeplug_from_k7abd` analog_zones)
+    """
+    if name_format is None:
+        name_format = REPEATERBOOK_DEFAULT_NAME_FORMAT
+    if channel_pool is None:
+        channel_pool = {}
+    ranges_key = None if ranges is None else tuple(tuple(r) for r in ranges)
+    analog_zones = {}
+    for name, slug, repeaters in iter_zone_repeaters(
+        input_csv,
+        states=states,
+        name_format=name_format,
+        ranges=ranges,
+        offline=offline,
+        store=store,
+    ):
+        filename = _k7abd_filename(slug)
+        if k7abd_dir is not None:
+            write_k7abd_rows(
+                Path(k7abd_dir) / filename,
+                (
+                    repeater_to_k7abd_row(r, zone_name=name, name_format=name_format)
+                    for r in repeaters
+                ),
+            )
+        zname, _, code = name.partition(";")
+        channels = []
+        for r in repeaters:
+            key = None
+            if r.get("State ID") and r.get("Rptr ID"):
+                key = (_repeater_id(r), name_format, code, ranges_key)
+            ch = channel_pool.get(key)
+            if key is None or key not in channel_pool:
+                ch = _analog_channel(
+                    repeater_to_k7abd_row(r, zone_name=name, name_format=name_format),
+                    ranges=ranges,
+                )
+                if key is not None:
+                    channel_pool[key] = ch
+            if ch is not None:
+                channels.append(ch)
+        analog_zones[filename] = {zname: channels} if channels else {}
+        logger.debug("Generate '%s' zones (%s channels)", name, len(repeaters))
+    return analog_zones
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     parser = argparse.ArgumentParser()
@@ -0,0 +1,381 @@
+"""
+dzcb.repeaterdb - persistent SQLite store of repeaterbook data
+
+Repeaterbook state exports are upserted into a local database keyed by
+shard (state), State ID and Rptr ID, with an R*Tree index on coordinates and
+indexed band, use and operational status columns. Proximity zones are answered
+by indexed queries, and the remaining candidates are filtered exactly by
+`dzcb.repeaterbook.filter_repeaters`.
+
+The database may be shared by several dzcb processes.
+"""
+import contextlib
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+import attr
+
+from . import appdir, AmateurBands
+from dzcb import fetch, repeaterbook
+
+logger = logging.getLogger(__name__)
+
+REPEATERDB_DEFAULT_PATH = Path(appdir.user_cache_dir) / "repeaterbook.sqlite"
+# bump when the schema changes, the database is rebuilt
+REPEATERDB_SCHEMA_VERSION = 3
+# seconds to wait for another process writing to the database
+REPEATERDB_TIMEOUT = 60
+# repeater criteria fields with an indexed column, holding the lowercase
+# value compared by `repeaterbook.matches_criteria` ("" if the field is absent)
+INDEXED_CRITERIA = {
+    "Use": "use",
+    "Operational Status": "status",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard TEXT PRIMARY KEY,
+    source_key TEXT NOT NULL,
+    updated REAL NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS repeaters (
+    id INTEGER PRIMARY KEY,
+    state_id TEXT NOT NULL,
+    rptr_id TEXT NOT NULL,
+    shard TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    frequency REAL,
+    band TEXT,
+    use TEXT,
+    status TEXT,
+    lat REAL,
+    long REAL,
+    record TEXT NOT NULL,
+    UNIQUE (shard, state_id, rptr_id)
+);
+CREATE INDEX IF NOT EXISTS repeaters_shard ON repeaters (shard, position);
+CREATE INDEX IF NOT EXISTS repeaters_band ON repeaters (band);
+CREATE INDEX IF NOT EXISTS repeaters_use ON repeaters (use);
+CREATE INDEX IF NOT EXISTS repeaters_status ON repeaters (status);
+CREATE VIRTUAL TABLE IF NOT EXISTS repeaters_rtree USING rtree (
+    id, min_lat, max_lat, min_long, max_long
+);
+"""
+_TABLES = ("shards", "repeaters", "repeaters_rtree")
+
+
+def _shard_key(shard):
+    """:return: shard name as stored, state names are not case sensitive"""
+    return shard.casefold()
+
+
+def _criteria_value(r, field):
+    return str(r.get(field, "")).lower()
+
+
+def _long_ranges(long_low, long_high):
+    """
+    :return: list of (long_low, long_high) within -180..180 covering the
+        unwrapped range
+    """
+    if long_high - long_low >= 360:
+        return [(-180, 180)]
+    if long_low < -180:
+        return [(long_low + 360, 180), (-180, long_high)]
+    if long_high > 180:
+        return [(long_low, 180), (-180, long_high - 360)]
+    return [(long_low, long_high)]
+
+
+@attr.s
+class RepeaterDB:
+    """
+    SQLite repeater store.
+
+    Repeaters are grouped into shards, the name of the state or province
+    that was exported from repeaterbook (ignoring case). A repeater listed
+    by several shards is stored once per shard.
+    """
+
+    path = attr.ib(default=REPEATERDB_DEFAULT_PATH, converter=Path)
+    _conn = attr.ib(default=None, init=False, repr=False)
+    _lock = attr.ib(factory=threading.RLock, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(self.path),
+            timeout=REPEATERDB_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        # readers don't block the writer (or each other) across processes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._transaction():
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != REPEATERDB_SCHEMA_VERSION:
+                if version:
+                    logger.info(
+                        "Rebuild repeater database %s (schema %s -> %s)",
+                        self.path,
+                        version,
+                        REPEATERDB_SCHEMA_VERSION,
+                    )
+                for table in _TABLES:
+                    self._conn.execute("DROP TABLE IF EXISTS {}".format(table))
+                self._conn.execute(
+                    "PRAGMA user_version = {:d}".format(REPEATERDB_SCHEMA_VERSION)
+                )
+            for statement in _SCHEMA.split(";"):
+                if statement.strip():
+                    self._conn.execute(statement)
+
+    def close(self):
+        self._conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            # take the write lock up front, other processes wait
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def shard_source_key(self, shard):
+        """:return: source_key of the last update of `shard`, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_key FROM shards WHERE shard = ?", (_shard_key(shard),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def update_shard(self, shard, source_key, records):
+        """
+        Upsert the repeaters of `shard` and remove those no longer listed.
+
+        :param shard: state or province name
+        :param source_key: identifies the source data, the update is skipped
+            if the shard was last updated from the same source
+        :param records: callable returning an iterable of repeaterbook API dicts
+        :return: number of repeaters in the shard, or None if unchanged
+        """
+        if self.shard_source_key(shard) == source_key:
+            return None
+        shard = _shard_key(shard)
+        with self._transaction() as conn:
+            # another process may have updated the shard meanwhile
+            row = conn.execute(
+                "SELECT source_key FROM shards WHERE shard = ?", (shard,)
+            ).fetchone()
+            if row and row[0] == source_key:
+                return None
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS seen (id INTEGER PRIMARY KEY)"
+            )
+            conn.execute("DELETE FROM seen")
+            count = 0
+            for position, r in enumerate(records()):
+                self._upsert(conn, shard, position, r)
+                count += 1
+            removed = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM repeaters WHERE shard = ? "
+                    "AND id NOT IN (SELECT id FROM seen)",
+                    (shard,),
+                )
+            ]
+            conn.executemany(
+                "DELETE FROM repeaters WHERE id = ?", ((id,) for id in removed)
+            )
+            conn.executemany(
+                "DELETE FROM repeaters_rtree WHERE id = ?", ((id,) for id in removed)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO shards (shard, source_key, updated, count) "
+                "VALUES (?, ?, ?, ?)",
+                (shard, source_key, time.time(), count),
+            )
+        logger.info(
+            "Update repeater database %s: %s repeaters (%s removed)",
+            shard,
+            count,
+            len(removed),
+        )
+        return count
+
+    @staticmethod
+    def _upsert(conn, shard, position, r):
+        state_id, rptr_id = r.get("State ID"), r.get("Rptr ID")
+        if state_id is None or rptr_id is None:
+            # records without an ID are kept apart, by position in the export
+            state_id, rptr_id = "", "#{}".format(position)
+        frequency = repeaterbook._parse_float(r.get("Frequency"))
+        band = repeaterbook._band(frequency)
+        coords = repeaterbook._parse_coords(r)
+        lat, long = coords if coords else (None, None)
+        if coords is None:
+            # as in RepeaterIndex, only zones without a location match it
+            logger.warning(
+                "Ignore repeater {!r} with bogus coordinates: {!r}".format(
+                    repeaterbook._repeater_id(r), (r.get("Lat"), r.get("Long"))
+                )
+            )
+        conn.execute(
+            "INSERT INTO repeaters (state_id, rptr_id, shard, position, frequency, "
+            "band, use, status, lat, long, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (shard, state_id, rptr_id) DO UPDATE SET "
+            "position = excluded.position, "
+            "frequency = excluded.frequency, band = excluded.band, "
+            "use = excluded.use, status = excluded.status, lat = excluded.lat, "
+            "long = excluded.long, record = excluded.record",
+            (
+                str(state_id),
+                str(rptr_id),
+                shard,
+                position,
+                frequency if frequency == frequency else None,
+                band.name if band else None,
+                _criteria_value(r, "Use"),
+                _criteria_value(r, "Operational Status"),
+                lat,
+                long,
+                json.dumps(r),
+            ),
+        )
+        (id,) = conn.execute(
+            "SELECT id FROM repeaters "
+            "WHERE shard = ? AND state_id = ? AND rptr_id = ?",
+            (shard, str(state_id), str(rptr_id)),
+        ).fetchone()
+        conn.execute("INSERT OR IGNORE INTO seen (id) VALUES (?)", (id,))
+        conn.execute("DELETE FROM repeaters_rtree WHERE id = ?", (id,))
+        if coords:
+            conn.execute(
+                "INSERT INTO repeaters_rtree "
+                "(id, min_lat, max_lat, min_long, max_long) VALUES (?, ?, ?, ?, ?)",
+                (id, lat, lat, long, long),
+            )
+
+    def load_states(
+        self,
+        states,
+        max_age=repeaterbook.REPEATERBOOK_CACHE_MAX_AGE,
+        api=repeaterbook.REPEATERBOOK_API,
+        cache_dir=None,
+        offline=False,
+        max_workers=None,
+    ):
+        """
+        Fetch (see `repeaterbook.cached_json`) each state and update its shard
+        if the export changed.
+        """
+        if max_workers is None:
+            max_workers = repeaterbook.REPEATERBOOK_FETCH_WORKERS
+        json_files = fetch.map_concurrent(
+            lambda state: repeaterbook.cached_json(
+                repeaterbook._state_url(state, api=api),
+                max_age=max_age,
+                cache_dir=cache_dir,
+                offline=offline,
+            ),
+            states,
+            max_workers=max_workers,
+        )
+        for state, json_file in zip(states, json_files):
+            stat = json_file.stat()
+
+            def records(json_file=json_file):
+                with open(json_file, "r") as f:
+                    yield from repeaterbook.iter_json_results(f)
+
+            self.update_shard(
+                state, "{}:{}".format(stat.st_mtime_ns, stat.st_size), records
+            )
+
+    def candidates(self, zone, shards, ranges=None):
+        """
+        Query the repeaters that may match a proximity zone.
+
+        The spatial bounds, band, indexed criteria, and frequency ranges are
+        matched in the database; everything else is left to
+        `repeaterbook.filter_repeaters`.
+
+        :param zone: proximity zone dict from `repeaterbook.proximity_zones`
+        :param shards: sequence of shards to search
+        :param ranges: sequence of tuple of (low, high) frequency to retain
+        :return: list of repeaterbook API dicts in shard and export order
+        """
+        shard_order = {}
+        for shard in shards:
+            shard_order.setdefault(_shard_key(shard), len(shard_order))
+        shards = list(shard_order)
+        if not shards:
+            return []
+        where = ["shard IN ({})".format(", ".join("?" * len(shards)))]
+        params = list(shards)
+        bands = [
+            AmateurBands.get_normalized(b).name
+            for b in zone.get(repeaterbook.CSV_BAND, "").strip().split(";")
+            if b
+        ]
+        if bands:
+            # non-amateur frequencies are reported by filter_repeaters
+            where.append(
+                "(band IN ({}) OR band IS NULL)".format(", ".join("?" * len(bands)))
+            )
+            params.extend(bands)
+        for field, column in INDEXED_CRITERIA.items():
+            if field in zone:
+                where.append("{} = ?".format(column))
+                params.append(str(zone[field]).lower())
+        if ranges is not None:
+            where.append(
+                "(frequency IS NULL OR {})".format(
+                    " OR ".join("(frequency > ? AND frequency < ?)" for _ in ranges)
+                )
+            )
+            params.extend(f for low_high in ranges for f in low_high)
+        boxes = repeaterbook.zone_bounding_boxes(zone)
+        if boxes is not None:
+            rects = []
+            for lat_low, lat_high, long_low, long_high in boxes:
+                for long_range in _long_ranges(long_low, long_high):
+                    rects.append((lat_low, lat_high) + long_range)
+            where.append(
+                "id IN ({})".format(
+                    " UNION ".join(
+                        "SELECT id FROM repeaters_rtree WHERE max_lat >= ? "
+                        "AND min_lat <= ? AND max_long >= ? AND min_long <= ?"
+                        for _ in rects
+                    )
+                )
+            )
+            params.extend(c for rect in rects for c in rect)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT shard, position, record FROM repeaters WHERE "
+                + " AND ".join(where),
+                params,
+            ).fetchall()
+        rows.sort(key=lambda row: (shard_order[row[0]], row[1]))
+        return [json.loads(record) for _, _, record in rows]
+
+    def filter_repeaters(self, zone, shards, ranges=None):
+        """
+        :return: list of repeaters matching the zone, as returned by
+            `repeaterbook.filter_repeaters`
+        """
+        return repeaterbook.filter_repeaters(
+            self.candidates(zone, shards, ranges=ranges), zone, ranges=ranges
+        )
@@ -2,9 +2,9 @@ import argparse
 import logging
 from pathlib import Path
 import os
-import re
 
-import requests
+from dzcb import fetch
+from dzcb.munge import RewriteRules
 
 logger = logging.getLogger(__name__)
 
@@ -19,44 +19,55 @@ SEATTLE_DMR_TALKGROUPS = (
 )
 REPEATER_FILENAME = "Digital-Repeaters__SeattleDMR.csv"
 TALKGROUPS_FILENAME = "Talkgroups__SeattleDMR.csv"
+# always revalidate, unchanged files are not downloaded again
+SEATTLE_DMR_CACHE_MAX_AGE = 0
+# XXX: Hacks: need to fix upstream
+SEATTLE_DMR_REPEATER_FIXUPS = RewriteRules(
+    [
+        ("BayNet", "Baynet"),
+        ("PNWR", "PNW Rgnl 2"),
+        ("Wash 1", "Washington 1"),
+        ("Wash 2", "Washington 2"),
+    ]
+)
+SEATTLE_DMR_TALKGROUP_FIXUPS = RewriteRules([(r"Link([0-9]+)", r"Link \1")])
 
 
-def cache_repeaters(output_dir):
-    for dr_url in SEATTLE_DMR_REPEATERS:
-        try:
-            repeaters = requests.get(dr_url)
-            if repeaters.status_code < 300:
-                break
-        except requests.ConnectionError:
-            pass
-    repeaters.raise_for_status()
-    for tg_url in SEATTLE_DMR_TALKGROUPS:
-        try:
-            talkgroups = requests.get(tg_url)
-            if talkgroups.status_code < 300:
-                break
-        except requests.ConnectionError:
-            pass
-    talkgroups.raise_for_status()
+def cache_repeaters(
+    output_dir, offline=False, repeater_fixups=None, talkgroup_fixups=None
+):
+    """
+    :param repeater_fixups: additional RewriteRules for the repeaters, with
+        lower priority than SEATTLE_DMR_REPEATER_FIXUPS
+    :param talkgroup_fixups: additional RewriteRules for the talkgroups, with
+        lower priority than SEATTLE_DMR_TALKGROUP_FIXUPS
+    """
+    if repeater_fixups is not None:
+        repeater_fixups = SEATTLE_DMR_REPEATER_FIXUPS + repeater_fixups
+    else:
+        repeater_fixups = SEATTLE_DMR_REPEATER_FIXUPS
+    if talkgroup_fixups is not None:
+        talkgroup_fixups = SEATTLE_DMR_TALKGROUP_FIXUPS + talkgroup_fixups
+    else:
+        talkgroup_fixups = SEATTLE_DMR_TALKGROUP_FIXUPS
+    http_cache = fetch.HTTPCache(
+        cache_dir=fetch.HTTP_CACHE_DIR,
+        max_age=SEATTLE_DMR_CACHE_MAX_AGE,
+        offline=offline,
+        suffix=".csv",
+    )
+    repeaters = http_cache.get_fastest(SEATTLE_DMR_REPEATERS)
+    talkgroups = http_cache.get_fastest(SEATTLE_DMR_TALKGROUPS)
     outpath = Path(output_dir)
     rp_out = outpath / REPEATER_FILENAME
-    with rp_out.open("w", newline="") as f:
-        # XXX: Hacks: need to fix upstream
-        for line in repeaters.text.splitlines(True):
-            line = line.replace("BayNet", "Baynet").replace("PNWR", "PNW Rgnl 2")
-            line = line.replace("Wash 1", "Washington 1").replace(
-                "Wash 2", "Washington 2"
-            )
-            f.write(line)
+    with repeaters.open_text() as src, fetch.atomic_text_writer(rp_out) as dst:
+        dst.writelines(repeater_fixups.sub_lines(src))
     logger.info("Cache SeattleDMR k7abd zones to '%s'", rp_out)
 
     tg_out = outpath / TALKGROUPS_FILENAME
-    with tg_out.open("w", newline="") as f:
-        # XXX: Hacks: need to fix upstream
-        for line in talkgroups.text.splitlines(True):
-            line = re.sub(r"Link([0-9]+)", r"Link \1", line)
-            f.write(line)
-        f.write("TAC 8-2,8958\n")
+    with talkgroups.open_text() as src, fetch.atomic_text_writer(tg_out) as dst:
+        dst.writelines(talkgroup_fixups.sub_lines(src))
+        dst.write("TAC 8-2,8958\n")
     logger.info("Cache SeattleDMR k7abd talkgroups to '%s'", tg_out)
 
 
@@ -1,4 +1,6 @@
 """All valid PL / DCS tones"""
+import re
+import sys
 
 from .util import getenv_bool
 
@@ -162,3 +164,78 @@ VALID_TONES = [
     "D743",
     "D754",
 ]
+
+VALID_TONES_SET = frozenset(VALID_TONES)
+
+# values that mean "no tone" in k7abd CSV files (compared lowercase)
+OFF_TONES = frozenset(("off", ""))
+
+_numeric_tone_rex = re.compile("[0-9.]+")
+
+
+def _normalize(value):
+    if not isinstance(value, str):
+        value = str(value)
+    elif _numeric_tone_rex.match(value):
+        # normalize float values
+        value = str(float(value))
+    return sys.intern(value.upper())
+
+
+# raw string -> canonical tone, seeded with common spellings of valid tones,
+# and extended with each new spelling seen by `normalize`
+_NORMALIZED = {}
+for _tone in VALID_TONES:
+    _NORMALIZED[_tone] = _tone
+    _NORMALIZED[_tone.lower()] = _tone
+    if _tone.endswith(".0"):
+        _NORMALIZED[_tone[:-2]] = _tone
+del _tone
+
+
+def normalize(value):
+    """
+    Convert a raw tone value into its canonical form.
+
+    Ex: 67 -> "67.0", "d023" -> "D023"
+
+    Canonical forms are interned and the result for each raw value is
+    remembered, so repeated tones cost a dict lookup.
+    """
+    try:
+        return _NORMALIZED[value]
+    except (KeyError, TypeError):
+        pass
+    tone = _normalize(value)
+    try:
+        _NORMALIZED[value] = tone
+    except TypeError:
+        pass  # unhashable value
+    return tone
+
+
+def is_valid(tone):
+    """:return: True if the canonical `tone` is a valid PL / DCS tone"""
+    return tone in VALID_TONES_SET
+
+
+# canonical tone -> tone with DCS polarity suffix, as used by dmrconfig and editcp
+DCS_NORMAL = {
+    tone: tone + "N" if tone.startswith("D") else tone for tone in VALID_TONES
+}
+
+
+def dcs_normal(tone, off=None):
+    """
+    Render a canonical tone with the "N" (normal polarity) DCS suffix.
+
+    :param tone: canonical tone or None
+    :param off: value to return when tone is None
+    """
+    if not tone:
+        return off
+    try:
+        return DCS_NORMAL[tone]
+    except KeyError:
+        # invalid tone, only seen when REQUIRE_VALID_TONE=0
+        return tone + "N" if tone.startswith("D") else tone
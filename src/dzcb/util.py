@@ -1,6 +1,8 @@
 import logging
 import os
 
+import attr
+
 
 STR_TO_BOOL = {
     "false": False,
@@ -32,26 +34,63 @@ def getenv_bool(var_name, default=False):
     return STR_TO_BOOL[val.lower()]
 
 
-def unique_name(name, existing_names, fmt="{} {}"):
+@attr.s
+class NameAllocator:
     """
-    Create a unique name by appending numbers.
+    Create unique names by appending numbers, remembering the last number used.
+
+    The next free suffix is tracked per base name, so allocating many copies of
+    the same name doesn't re-probe every suffix already handed out. Warnings
+    about deduplicated names are collected and emitted once per base name by
+    `log_deduped`.
 
-    :param name: the base name that numbers are added to
-    :param existing_names: container of names that are taken (prefer set or dict)
+    :param names: iterable of names that are already taken
     :param fmt: how to format the new name, default "{} {}"
         expects 2 positional args in a new-style format string
-    :return: a name based on `name` that doesn't exist in `existing_names`.
     """
-    ix = 0
-    maybe_unique_name = name
-    while maybe_unique_name in existing_names:
-        maybe_unique_name = fmt.format(name, ix)
-        ix += 1
-    if maybe_unique_name != name:
-        logger.warning(
-            "Deduping name {!r} -> {!r}. Consider using unique names for clarity.".format(
-                name,
-                maybe_unique_name,
-            ),
-        )
-    return maybe_unique_name
+
+    names = attr.ib(factory=set, converter=set)
+    fmt = attr.ib(default="{} {}")
+    # base name -> next suffix to try
+    _next_ix = attr.ib(factory=dict, init=False, repr=False)
+    # base name -> list of deduped names, pending log_deduped
+    _deduped = attr.ib(factory=dict, init=False, repr=False)
+
+    def allocate(self, name):
+        """
+        :param name: the base name that numbers are added to
+        :return: a name based on `name` that hasn't been allocated or taken.
+        """
+        if name not in self.names:
+            self.names.add(name)
+            return name
+        ix = self._next_ix.get(name, 0)
+        maybe_unique_name = self.fmt.format(name, ix)
+        while maybe_unique_name in self.names:
+            ix += 1
+            maybe_unique_name = self.fmt.format(name, ix)
+        self._next_ix[name] = ix + 1
+        self.names.add(maybe_unique_name)
+        self._deduped.setdefault(name, []).append(maybe_unique_name)
+        return maybe_unique_name
+
+    def allocate_all(self, names):
+        """
+        :param names: iterable of base names
+        :return: list of unique names in the same order as `names`
+        """
+        return [self.allocate(name) for name in names]
+
+    def log_deduped(self):
+        """Emit a single warning per base name that was deduplicated."""
+        for name, deduped_names in self._deduped.items():
+            logger.warning(
+                "Deduping name {!r} -> {!r}{}. Consider using unique names for clarity.".format(
+                    name,
+                    deduped_names[0],
+                    " (and {} more)".format(len(deduped_names) - 1)
+                    if len(deduped_names) > 1
+                    else "",
+                ),
+            )
+        self._deduped.clear()
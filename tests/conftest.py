@@ -1,8 +1,111 @@
+import http.server
+import threading
+
 import pytest
 
 import dzcb.model
 
 
+class StubHTTPServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for remote sources: serves `routes` and logs requests."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        # path -> (status, headers dict, body bytes) or callable(handler)
+        self.routes = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), StubHTTPRequestHandler)
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+
+class StubHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, dict(self.headers)))
+        route = self.server.routes.get(self.path)
+        if route is None:
+            route = self.server.routes.get(self.path.partition("?")[0])
+        if route is None:
+            route = (404, {}, b"not found")
+        if callable(route):
+            route = route(self)
+        status, headers, body = route
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = StubHTTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# repeaterbook API record, the fields used to filter and convert repeaters
+REPEATERBOOK_RECORD = {
+    "State ID": "41",
+    "Rptr ID": "26",
+    "Frequency": "146.94000",
+    "Input Freq": "146.34000",
+    "PL": "CSQ",
+    "TSQ": "",
+    "Nearest City": "Clackamas",
+    "Landmark": "Mt Scott",
+    "County": "Clackamas",
+    "State": "Oregon",
+    "Lat": "45.45479965",
+    "Long": "-122.55100250",
+    "Callsign": "W7LT",
+    "Use": "OPEN",
+    "Operational Status": "On-air",
+}
+
+
+def _make_repeaters(center=(45.5, -122.6), steps=15, spacing=0.1):
+    """Repeaters on a lat/long grid around `center`, alternating bands."""
+    repeaters = []
+    for lat_ix in range(-steps, steps + 1):
+        for long_ix in range(-steps, steps + 1):
+            rptr_id = len(repeaters)
+            repeaters.append(
+                dict(
+                    REPEATERBOOK_RECORD,
+                    **{
+                        "Rptr ID": str(rptr_id),
+                        "Lat": "{:.5f}".format(center[0] + lat_ix * spacing),
+                        "Long": "{:.5f}".format(center[1] + long_ix * spacing),
+                        "Frequency": "146.94000" if rptr_id % 2 else "442.75000",
+                        "Use": "OPEN" if rptr_id % 3 else "CLOSED",
+                    }
+                )
+            )
+    repeaters.append(
+        dict(REPEATERBOOK_RECORD, **{"Rptr ID": "bogus", "Lat": "", "Long": ""})
+    )
+    return repeaters
+
+
+@pytest.fixture
+def make_repeaters():
+    """:return: function making a grid of repeaterbook API records"""
+    return _make_repeaters
+
+
 @pytest.fixture(scope="session")
 def complex_codeplug():
     contacts = (
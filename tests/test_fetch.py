@@ -0,0 +1,271 @@
+import hashlib
+import multiprocessing
+import threading
+
+import pytest
+import requests
+
+from dzcb import fetch
+from dzcb.exceptions import CacheMiss
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        pass
+
+
+def test_token_bucket_spacing():
+    clock = FakeClock()
+    bucket = fetch.TokenBucket(interval=30, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() == 0
+    # later callers reserve successive slots
+    assert bucket.acquire() == 30
+    assert bucket.acquire() == 60
+    clock.now = 60
+    assert bucket.acquire() == 30
+    clock.now = 1000
+    assert bucket.acquire() == 0
+
+
+def test_token_bucket_capacity():
+    clock = FakeClock()
+    bucket = fetch.TokenBucket(interval=10, capacity=3, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(4)] == [0, 0, 0, 10]
+    clock.now = 1000
+    # refill never exceeds capacity
+    assert [bucket.acquire() for _ in range(4)] == [0, 0, 0, 10]
+
+
+def test_token_bucket_poll_and_refund(tmp_path):
+    clock = FakeClock()
+    bucket = fetch.TokenBucket(
+        interval=30, clock=clock, sleep=clock.sleep, path=tmp_path / "bucket.json"
+    )
+    assert bucket.poll() == 0
+    # polling never reserves a slot
+    assert [bucket.poll() for _ in range(10)] == [30] * 10
+    clock.now = 15
+    assert bucket.poll() == 15
+    clock.now = 30
+    assert bucket.poll() == 0
+
+    # an interrupted wait gives its reserved slot back
+    def interrupt(seconds):
+        raise KeyboardInterrupt
+
+    bucket.sleep = interrupt
+    with pytest.raises(KeyboardInterrupt):
+        bucket.acquire()
+    assert bucket.reserve() == 30
+
+
+def _reserve_shared(path):
+    return fetch.TokenBucket(interval=10, path=path).reserve()
+
+
+def test_token_bucket_shared_between_processes(tmp_path):
+    path = tmp_path / "rate_limit.json"
+    with multiprocessing.get_context("spawn").Pool(3) as pool:
+        waits = pool.map(_reserve_shared, [path] * 3)
+    # each process reserved its own slot
+    assert sorted(waits) == pytest.approx([0, 10, 20], abs=2)
+    assert fetch.TokenBucket(interval=10, path=path).reserve() > 15
+
+
+def test_map_concurrent():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait(item):
+        barrier.wait()
+        return item * 2
+
+    assert fetch.map_concurrent(wait, [1, 2, 3], max_workers=3) == [2, 4, 6]
+    assert fetch.map_concurrent(str, [1, 2], max_workers=1) == ["1", "2"]
+
+
+def test_http_cache_revalidate(http_server, tmp_path):
+    def export(handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            return 304, {}, b""
+        return 200, {"ETag": '"v1"'}, b"body v1"
+
+    http_server.routes["/export"] = export
+    url = http_server.url + "/export"
+    http_cache = fetch.HTTPCache(cache_dir=tmp_path, max_age=3600)
+
+    resp = http_cache.get(url)
+    assert (resp.status, resp.content) == ("fetched", b"body v1")
+    assert http_cache.get(url).status == "fresh"
+    assert len(http_server.requests) == 1
+
+    # expired copies are revalidated with a conditional request
+    http_cache.max_age = 0
+    resp = http_cache.get(url)
+    assert (resp.status, resp.content) == ("revalidated", b"body v1")
+    assert http_server.requests[-1][1]["If-None-Match"] == '"v1"'
+
+    # stale copy is returned immediately, and refreshed in the background
+    http_cache.stale_while_revalidate = 3600
+    assert http_cache.get(url).status == "revalidating"
+    http_cache.wait()
+    assert len(http_server.requests) == 3
+
+
+def test_blob_store_dedup_and_eviction(tmp_path):
+    store = fetch.BlobStore(tmp_path, max_size=12)
+    a = store.store("a", [b"12", b"345"], suffix=".txt")
+    b = store.store("b", [b"12345"], suffix=".txt")
+    assert a["blob"] == b["blob"]
+    assert a["digest"] == hashlib.sha256(b"12345").hexdigest()
+    assert len(list(store.blob_path("").iterdir())) == 1
+
+    # derived files are evicted with their blob
+    derived = store.blob_path(a["blob"] + ".table.gz")
+    derived.write_bytes(b"d")
+    store.store("a", [b"abcde"], suffix=".txt")
+    assert derived.exists()
+    store.store("b", [b"fghij"], suffix=".txt")
+    assert not derived.exists()
+
+    # least recently used entries are evicted beyond max_size
+    store.renew("a")
+    store.store("c", [b"klmno"])
+    assert store.entry("b") is None
+    assert store.entry("a")["size"] == 5
+    assert store.blob_path(store.entry("c")["blob"]).read_bytes() == b"klmno"
+    assert len(list(store.blob_path("").iterdir())) == 2
+
+    # the manifest is shared by other instances
+    assert fetch.BlobStore(tmp_path).entry("c") == store.entry("c")
+
+
+def test_blob_store_suffixes_and_derived_size(tmp_path):
+    # a blob of the same content with another suffix is kept
+    store = fetch.BlobStore(tmp_path / "suffixes")
+    csv = store.store("csv", [b"12345"], suffix=".csv")
+    store.store("txt", [b"12345"], suffix=".txt")
+    store.store("txt", [b"other"], suffix=".txt")
+    assert store.blob_path(csv["blob"]).read_bytes() == b"12345"
+
+    # derived files count toward max_size
+    store = fetch.BlobStore(tmp_path / "derived", max_size=10)
+    first = store.store("first", [b"12345"])
+    store.blob_path(first["blob"] + ".table.gz").write_bytes(b"123456")
+    store.store("second", [b"abcde"])
+    assert store.entry("first") is None
+    assert store.entry("second") is not None
+
+
+def test_purge_legacy_cache(tmp_path):
+    kept = [
+        "repeaterbook.sqlite",
+        "repeaterbook_rate_limit.json",
+        "repeaters_0123456789abcdef0123456789abcdef.json.tmp",
+        "repeaters_other.json",
+    ]
+    for name in kept + ["repeaters_0123456789abcdef0123456789abcdef.json"]:
+        (tmp_path / name).write_bytes(b"")
+    fetch.purge_legacy_cache(tmp_path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == kept
+
+
+def test_http_cache_stale_and_offline(http_server, tmp_path):
+    http_server.routes["/export"] = (200, {}, b"body")
+    url = http_server.url + "/export"
+    http_cache = fetch.HTTPCache(
+        cache_dir=tmp_path, session=fetch.new_session(retries=0)
+    )
+    assert http_cache.get(url).status == "fetched"
+
+    # upstream is down, serve the cached copy
+    http_server.routes["/export"] = (503, {}, b"unavailable")
+    resp = http_cache.get(url)
+    assert (resp.status, resp.content) == ("stale", b"body")
+    # ... unless a mirror can be fetched
+    http_server.routes["/mirror"] = (200, {}, b"mirror")
+    resp = http_cache.get_first([url, http_server.url + "/mirror"])
+    assert (resp.status, resp.content) == ("fetched", b"mirror")
+    resp = http_cache.get_first([url, http_server.url + "/not-found"])
+    assert (resp.status, resp.content) == ("stale", b"body")
+
+    n_requests = len(http_server.requests)
+    offline = fetch.HTTPCache(cache_dir=tmp_path, offline=True)
+    assert offline.get(url).status == "offline"
+    with pytest.raises(CacheMiss):
+        offline.get(http_server.url + "/not-cached")
+    # mirrors are tried in order
+    assert offline.get_first([http_server.url + "/not-cached", url]).url == url
+    assert len(http_server.requests) == n_requests
+
+
+def test_http_cache_retry(http_server, tmp_path):
+    responses = [(503, {}, b"busy"), (503, {}, b"busy"), (200, {}, b"body")]
+    http_server.routes["/export"] = lambda handler: responses.pop(0)
+    http_cache = fetch.HTTPCache(
+        cache_dir=tmp_path, session=fetch.new_session(retries=2, backoff_factor=0)
+    )
+    resp = http_cache.get(http_server.url + "/export")
+    assert (resp.status, resp.content) == ("fetched", b"body")
+    assert len(http_server.requests) == 3
+
+
+def test_http_cache_rate_limited_no_status_retry(http_server, tmp_path):
+    http_server.routes["/export"] = (429, {"Retry-After": "1"}, b"slow down")
+    http_cache = fetch.HTTPCache(
+        cache_dir=tmp_path, rate_limit=fetch.TokenBucket(interval=0)
+    )
+    # the retry would not wait for the rate limit
+    with pytest.raises(requests.HTTPError):
+        http_cache.get(http_server.url + "/export")
+    assert len(http_server.requests) == 1
+
+
+def test_http_cache_get_fastest(http_server, tmp_path):
+    release = threading.Event()
+
+    def slow(handler):
+        release.wait(5)
+        return 200, {}, b"upstream"
+
+    http_server.routes["/upstream"] = slow
+    http_server.routes["/mirror"] = (200, {}, b"mirror")
+    http_server.routes["/down"] = (404, {}, b"not found")
+    urls = [http_server.url + path for path in ("/upstream", "/mirror")]
+    http_cache = fetch.HTTPCache(
+        cache_dir=tmp_path, session=fetch.new_session(retries=0)
+    )
+
+    # a slow upstream gets `patience` seconds once the mirror responded
+    assert http_cache.get_fastest(urls, patience=0.1).content == b"mirror"
+    # the abandoned upstream request doesn't hold up interpreter exit
+    mirror_threads = [t for t in threading.enumerate() if t.name == "dzcb-mirror"]
+    assert mirror_threads and all(t.daemon for t in mirror_threads)
+    release.set()
+    http_cache.wait()
+    # the preferred url wins when it responds in time
+    assert http_cache.get_fastest(urls, patience=5).content == b"upstream"
+    # a cached upstream is used while revalidating, without racing mirrors
+    http_cache.stale_while_revalidate = 3600
+    resp = http_cache.get_fastest(urls)
+    assert (resp.url, resp.status) == (urls[0], "revalidating")
+    http_cache.wait()
+    http_cache.stale_while_revalidate = 0
+    # failed urls are skipped
+    resp = http_cache.get_fastest([http_server.url + "/down"] + urls[1:])
+    assert resp.content == b"mirror"
+    with pytest.raises(requests.HTTPError):
+        http_cache.get_fastest([http_server.url + "/down"] * 2)
+
+    # abandoned downloads are not stored
+    cancelled = threading.Event()
+    cancelled.set()
+    http_server.routes["/new"] = (200, {}, b"new")
+    with pytest.raises(fetch._Cancelled):
+        http_cache.get(http_server.url + "/new", cancelled=cancelled)
+    assert http_cache._store.entry(http_server.url + "/new") is None
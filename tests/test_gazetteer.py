@@ -0,0 +1,74 @@
+import pytest
+
+from dzcb import gazetteer, repeaterbook
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    (
+        ("Longview WA 35mi", ("Longview", "Washington", 2)),
+        ("longview, washington", ("Longview", "Washington", 2)),
+        ("Longview", ("Longview", "Washington", 1)),
+        ("Vancouver BC UHF", ("Vancouver", "British Columbia", 2)),
+        ("Vancouver UHF", ("Vancouver", "Washington", 1)),
+        ("Seattle;SEA", ("Seattle", "Washington", 1)),
+        ("Longview WA;LV", ("Longview", "Washington", 2)),
+        ("Oregon City 10mi", ("Oregon City", "Oregon", 2)),
+        ("Coeur d'Alene ID", ("Coeur d'Alene", "Idaho", 3)),
+        ("St. John's", ("St. John's", "Newfoundland and Labrador", 2)),
+        ("Nowhere WA", None),
+    ),
+)
+def test_match(text, expected):
+    found = gazetteer.default_gazetteer().match(text)
+    if expected is None:
+        assert found is None
+    else:
+        place, n_words = found
+        assert (place.name, place.state, n_words) == expected
+
+
+def test_match_ambiguous(caplog):
+    places = gazetteer.Gazetteer.from_csv(
+        [
+            "Name,State,Lat,Long",
+            "Vancouver,Washington,45.6387,-122.6615",
+            "Vancouver,British Columbia,49.2827,-123.1207",
+        ]
+    )
+    assert places.resolve("Vancouver BC").state == "British Columbia"
+    assert not caplog.records
+    assert places.resolve("Vancouver 2m").state == "Washington"
+    assert "Ambiguous place name 'Vancouver 2m'" in caplog.text
+
+
+def test_proximity_zones_geocode():
+    places = gazetteer.Gazetteer.from_csv(
+        ["Name,State,Lat,Long", "Longview,Washington,46.1382,-122.9382"]
+    )
+    zones = list(
+        repeaterbook.proximity_zones(
+            [
+                "Zone Name,Lat,Long,Distance,Unit,Band(2m;1.25m;70cm)",
+                "Longview WA 35mi,,,35,miles,2m",
+                "Elsewhere,45.5,-122.6,35,miles,2m",
+                "Everywhere,,,,,2m",
+            ],
+            places=places,
+        )
+    )
+    assert [(z["Lat"], z["Long"]) for _, _, z in zones] == [
+        ("46.1382", "-122.9382"),
+        ("45.5", "-122.6"),
+        ("", ""),
+    ]
+    with pytest.raises(ValueError, match="Cannot geocode"):
+        list(
+            repeaterbook.proximity_zones(
+                [
+                    "Zone Name,Lat,Long,Distance,Unit,Band(2m;1.25m;70cm)",
+                    "Nowhere 35mi,,,35,miles,2m",
+                ],
+                places=places,
+            )
+        )
@@ -201,3 +201,34 @@ def test_digital_repeaters_same_tg_different_ts():
     assert len(fw_cp["GroupLists"]) == 3
     for grouplist in fw_cp["GroupLists"]:
         assert grouplist["Contact"] == [tg_name]
+
+
+def test_digital_repeaters_shared_static_talkgroups():
+    """
+    Repeaters carrying the same talkgroups share one pre-sorted tuple.
+    """
+    talkgroups_by_name = k7abd.Talkgroups_map_from_csv(["TG 9,9", "TG 2,2", "TG 3,3"])
+    repeaters = tuple(
+        k7abd.DigitalRepeaters_from_k7abd_csv(
+            [
+                "Zone Name,Comment,Power,RX Freq,TX Freq,Color Code,TG 9,TG 3,TG 2,Bar",
+                "Foo;FOO,,High,430.4375,439.4375,1,1,-,2,1",
+                "Baz;BAZ,,High,430.5375,439.5375,1,1,-,2,-",
+                "Qux;QUX,,High,430.6375,439.6375,1,-,1,-,-",
+            ],
+            talkgroups_by_name,
+        )
+    )
+    assert len(repeaters) == 3
+    assert [
+        (tg.name, tg.timeslot) for tg in repeaters[0].static_talkgroups
+    ] == [("TG 2", Timeslot.TWO), ("TG 9", Timeslot.ONE)]
+    assert repeaters[0].static_talkgroups is repeaters[1].static_talkgroups
+    assert [tg.name for tg in repeaters[2].static_talkgroups] == ["TG 3"]
+
+
+def test_update_zones_channels_dedupe(caplog):
+    zones = {"Zone": ["a"]}
+    k7abd.update_zones_channels(zones, {"Zone": ["b"]})
+    assert zones == {"Zone": ["a"], "Zone 0": ["b"]}
+    assert "Deduping name 'Zone' -> 'Zone 0'" in caplog.text
@@ -244,3 +244,55 @@ def test_lookup_table_regen(complex_codeplug):
     new_cp = complex_codeplug.filter()
     assert new_cp._lookup_table is None
     assert complex_codeplug._lookup_table is not None
+
+
+def test_ChannelNameAllocator():
+    allocator = dzcb.model.ChannelNameAllocator()
+    channels = [
+        dzcb.model.AnalogChannel("Same Name", "146.{:03}".format(ix), "0.6")
+        for ix in range(20)
+    ]
+    allocated = [allocator.allocate(ch) for ch in channels]
+    short_names = [ch.short_name for ch in allocated]
+    assert short_names[0] == "Same Name"
+    assert short_names[1:] == ["Same Name{}".format(ix) for ix in range(1, 20)]
+    assert len(allocator.channels) == 20
+
+    # the same channel always receives the same suffix
+    assert allocator.allocate(channels[0]) == allocated[0]
+    assert allocator.allocate(channels[7]) == allocated[7]
+    assert len(allocator.channels) == 20
+
+
+def test_ChannelNameAllocator_same_settings_different_name():
+    allocator = dzcb.model.ChannelNameAllocator()
+    channels = [
+        dzcb.model.AnalogChannel("Kelso", "146.5", "0.6"),
+        dzcb.model.AnalogChannel("Kelso", "147.0", "0.6"),
+        dzcb.model.AnalogChannel("Longview", "147.0", "0.6"),
+    ]
+    allocated = [allocator.allocate(ch) for ch in channels]
+    assert [ch.short_name for ch in allocated] == ["Kelso", "Kelso1", "Longview"]
+    assert allocator.allocate(channels[1]).short_name == "Kelso1"
+    assert len(allocator.channels) == 3
+
+
+@pytest.mark.parametrize(
+    "range_seqs,exp_ranges",
+    (
+        pytest.param([], None, id="no-outputs"),
+        pytest.param([((136, 174),), None], None, id="unbounded-output"),
+        pytest.param(
+            [((136, 174), (400, 480)), ((400.0, 480.0),), (("222", "225"),)],
+            ((136.0, 174.0), (222.0, 225.0), (400.0, 480.0)),
+            id="overlapping",
+        ),
+        pytest.param(
+            [((136, 174),), ((174, 200),), ((150, 180),)],
+            ((136.0, 200.0),),
+            id="merged",
+        ),
+    ),
+)
+def test_union_frequency_ranges(range_seqs, exp_ranges):
+    assert dzcb.model.union_frequency_ranges(range_seqs) == exp_ranges
@@ -0,0 +1,42 @@
+import io
+import zipfile
+
+import pytest
+
+from dzcb import fetch, pnwdigital
+
+
+def make_zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_cache_repeaters(http_server, tmp_path, monkeypatch):
+    repeaters = b"Zone Name,Comment\n" * 10000
+    http_server.routes["/pnw.zip"] = (
+        200,
+        {},
+        make_zip(
+            {
+                "Digital-Repeaters__PNW-all-2022.csv": repeaters,
+                "Talkgroups__PNW-all-2022.csv": b"PNW All,1",
+                "README.txt": b"ignored",
+            }
+        ),
+    )
+    monkeypatch.setattr(fetch, "HTTP_CACHE_DIR", tmp_path / "http")
+    monkeypatch.setattr(
+        pnwdigital, "PNWDIGITAL_REPEATERS", [http_server.url + "/pnw.zip"]
+    )
+    pnwdigital.cache_repeaters(tmp_path)
+    assert (tmp_path / pnwdigital.REPEATER_FILENAME).read_bytes() == repeaters
+    assert (tmp_path / pnwdigital.TALKGROUPS_FILENAME).read_bytes() == b"PNW All,1"
+    assert not list(tmp_path.glob("*.tmp"))
+
+    # each run gets the latest zip
+    http_server.routes["/pnw.zip"] = (200, {}, make_zip({"README.txt": b""}))
+    with pytest.raises(RuntimeError, match="No Digital-Repeaters"):
+        pnwdigital.cache_repeaters(tmp_path)
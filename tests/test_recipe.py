@@ -0,0 +1,69 @@
+import threading
+
+import dzcb.pnwdigital
+import dzcb.seattledmr
+from dzcb.recipe import CodeplugRecipe
+
+
+def test_source_concurrent(tmp_path, monkeypatch):
+    # both remote sources must be running at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def cache_repeaters(filename):
+        def cache(output_dir, offline=False, **kwargs):
+            barrier.wait()
+            (output_dir / filename).write_text("downloaded")
+
+        return cache
+
+    monkeypatch.setattr(
+        dzcb.pnwdigital,
+        "cache_repeaters",
+        cache_repeaters(dzcb.pnwdigital.REPEATER_FILENAME),
+    )
+    monkeypatch.setattr(
+        dzcb.seattledmr,
+        "cache_repeaters",
+        cache_repeaters(dzcb.seattledmr.REPEATER_FILENAME),
+    )
+    user_k7abd = tmp_path / "k7abd"
+    user_k7abd.mkdir()
+    (user_k7abd / dzcb.seattledmr.REPEATER_FILENAME).write_text("user")
+
+    recipe = CodeplugRecipe(
+        source_pnwdigital=True,
+        source_seattledmr=True,
+        source_k7abd=[user_k7abd],
+    )
+    recipe.initialize(tmp_path / "output")
+    try:
+        recipe.source()
+    finally:
+        recipe.deinitialize()
+    cache_dir = tmp_path / "output" / "cache"
+    assert (cache_dir / dzcb.pnwdigital.REPEATER_FILENAME).read_text() == "downloaded"
+    # user files replace downloaded files of the same name
+    assert (cache_dir / dzcb.seattledmr.REPEATER_FILENAME).read_text() == "user"
+
+
+def test_seattledmr_fixups(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        dzcb.seattledmr,
+        "cache_repeaters",
+        lambda output_dir, **kwargs: calls.append(kwargs),
+    )
+    fixups_csv = tmp_path / "fixups.csv"
+    fixups_csv.write_text("Pattern,Repl\nTAC ([0-9]),Tactical \\1\n")
+
+    recipe = CodeplugRecipe(
+        source_seattledmr=True, seattledmr_talkgroup_fixups=[fixups_csv]
+    )
+    recipe.initialize(tmp_path / "output")
+    try:
+        recipe.seattledmr()
+    finally:
+        recipe.deinitialize()
+    (kwargs,) = calls
+    assert kwargs["talkgroup_fixups"].sub("TAC 1,1") == "Tactical 1,1"
+    assert not kwargs["repeater_fixups"]
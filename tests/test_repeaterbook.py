@@ -1,6 +1,10 @@
+import io
+import json
+
+import geopy.distance
 import pytest
 
-from dzcb import k7abd
+from dzcb import AmateurBands, fetch, k7abd
 from dzcb import repeaterbook
 
 TEST_ZONE = "Test Zone Name"
@@ -249,3 +253,446 @@ R4 = (
 )
 def test_repeater_to_k7abd_row(repeater, k7abd_row):
     assert repeaterbook.repeater_to_k7abd_row(repeater, TEST_ZONE) == k7abd_row
+
+
+def brute_force_filter(repeaters, poi_coords, radius, dunit, band, use):
+    matching = []
+    for r in repeaters:
+        try:
+            distance = getattr(
+                geopy.distance.distance(poi_coords, (r["Lat"], r["Long"])), dunit
+            )
+        except ValueError:
+            continue
+        if distance > radius:
+            continue
+        if AmateurBands.get_normalized(r["Frequency"]) is not band:
+            continue
+        if r["Use"].lower() != use.lower():
+            continue
+        matching.append((distance, r))
+    return [r for _, r in sorted(matching, key=lambda x: x[0])]
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "pure-python"])
+def vectorized(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(repeaterbook, "numpy", None)
+    elif repeaterbook.numpy is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "lat,long,radius,dunit,band",
+    (
+        ("45.5", "-122.6", "35", "miles", "2m"),
+        ("45.9", "-123.5", "20", "km", "70cm"),
+        ("44.8", "-121.9", "50", "miles", "70cm"),
+    ),
+)
+def test_filter_repeaters_index(
+    vectorized, lat, long, radius, dunit, band, make_repeaters
+):
+    repeaters = make_repeaters()
+    index = repeaterbook.RepeaterIndex(repeaters)
+    zone = {
+        repeaterbook.CSV_LAT: lat,
+        repeaterbook.CSV_LONG: long,
+        repeaterbook.CSV_DISTANCE: radius,
+        repeaterbook.CSV_UNIT: dunit,
+        repeaterbook.CSV_BAND: band,
+        "Use": "open",
+    }
+    expected = brute_force_filter(
+        repeaters,
+        (float(lat), float(long)),
+        float(radius),
+        dunit,
+        AmateurBands.get_normalized(band),
+        "open",
+    )
+    assert expected
+    assert repeaterbook.filter_repeaters(index, zone) == expected
+    # candidates are a strict subset of the repeaters
+    assert len(index.candidates((float(lat), float(long)), 80)) < len(repeaters)
+
+
+def test_within_many(vectorized, make_repeaters):
+    index = repeaterbook.RepeaterIndex(make_repeaters())
+    poi_coords = (45.5, -122.6)
+    results = index.within_many(
+        [(poi_coords, 35, "miles"), (poi_coords, 36, "miles"), (poi_coords, 20, "km")]
+    )
+    assert [len(r) for r in results] == [
+        len(index.within(poi_coords, 35, "miles")),
+        len(index.within(poi_coords, 36, "miles")),
+        len(index.within(poi_coords, 20, "km")),
+    ]
+    assert len(results[2]) < len(results[0]) < len(results[1])
+    for distance, ix in results[0]:
+        assert distance.miles <= 35
+        assert geopy.distance.distance(
+            poi_coords, (index.repeaters[ix]["Lat"], index.repeaters[ix]["Long"])
+        ) == distance
+
+
+def test_repeater_table_roundtrip(tmp_path, make_repeaters):
+    repeaters = make_repeaters(steps=2)
+    extra = dict(R1[0], **{"Rptr ID": "extra", "Notes": None})
+    del extra["Landmark"]
+    table = repeaterbook.RepeaterTable.concat(
+        [
+            repeaterbook.RepeaterTable.from_results(repeaters),
+            repeaterbook.RepeaterTable.from_results([extra]),
+        ]
+    )
+    assert len(table) == len(repeaters) + 1
+    assert list(table) == repeaters + [extra]
+    assert table.band[:2] == ["B_70cm", "B_2m"]
+    assert table.coords[len(repeaters) - 1] is None
+
+    table.dump(tmp_path / "table.json.gz")
+    loaded = repeaterbook.RepeaterTable.load(tmp_path / "table.json.gz")
+    assert list(loaded) == list(table)
+    assert loaded.coords == table.coords
+
+    index = repeaterbook.RepeaterIndex.from_table(loaded)
+    # records are built from the columns on access
+    assert index.repeaters is loaded
+    assert index.repeaters[len(repeaters)] == extra
+    assert index.criteria_index("Landmark")[""] == {len(repeaters)}
+    assert index.within((45.5, -122.6), 5, "km") == repeaterbook.RepeaterIndex(
+        list(table)
+    ).within((45.5, -122.6), 5, "km")
+
+
+def test_load_cached_repeaters_concurrent(http_server, tmp_path, monkeypatch):
+    states = ("Washington", "Oregon", "Idaho")
+    for state in states:
+        http_server.routes["/api/export.php?state={}".format(state)] = (
+            200,
+            {"Content-Type": "application/json"},
+            json.dumps(
+                {"results": [dict(R1[0], **{"State": state, "Rptr ID": state})]}
+            ).encode(),
+        )
+    waits = []
+    monkeypatch.setattr(
+        repeaterbook,
+        "REPEATERBOOK_RATE_LIMIT",
+        fetch.TokenBucket(interval=30, sleep=waits.append),
+    )
+    table = repeaterbook.load_cached_repeaters(
+        states=states,
+        api=http_server.url + "/api/export.php",
+        cache_dir=tmp_path,
+        max_workers=3,
+    )
+    assert [r["State"] for r in table] == list(states)
+    assert len(http_server.requests) == 3
+    # every request after the first waited for its own slot
+    assert sorted(round(w) for w in waits) == [30, 60]
+
+    # fresh cache is read without hitting the API
+    waits.clear()
+    table = repeaterbook.load_cached_repeaters(
+        states=states,
+        api=http_server.url + "/api/export.php",
+        cache_dir=tmp_path,
+    )
+    assert len(table) == 3
+    assert len(http_server.requests) == 3
+    assert not waits
+
+
+def test_zones_to_analog(tmp_path, monkeypatch, make_repeaters):
+    monkeypatch.setattr(
+        repeaterbook,
+        "load_cached_repeaters",
+        lambda **kwargs: repeaterbook.RepeaterTable.from_results(make_repeaters()),
+    )
+    proximity_csv = [
+        "Zone Name,Lat,Long,Distance,Unit,Band(2m;1.25m;70cm),Use",
+        "Near 2m,45.5,-122.6,20,miles,2m,OPEN",
+        "Near 70cm,45.5,-122.6,20,miles,70cm,CLOSED",
+        "Far,45.5,-122.6,1,miles,70cm,OPEN",
+    ]
+    (tmp_path / "empty").mkdir()
+    analog_zones = repeaterbook.zones_to_analog(
+        proximity_csv, k7abd_dir=tmp_path, name_format="{Callsign} {Rptr ID}"
+    )
+    assert list(analog_zones) == [
+        "Analog__Near-2m.csv",
+        "Analog__Near-70cm.csv",
+        "Analog__Far.csv",
+    ]
+    assert analog_zones["Analog__Far.csv"] == {}
+    for filename, zones in analog_zones.items():
+        assert zones == k7abd.Analog_from_csv(
+            (tmp_path / filename).read_text().splitlines()
+        )
+    assert len(analog_zones["Analog__Near-2m.csv"]["Near 2m"]) > 1
+
+    # in-memory zones merge into the codeplug in file name order
+    cp = k7abd.Codeplug_from_k7abd(tmp_path / "empty", analog_zones=analog_zones)
+    assert [z.name for z in cp.zones] == ["Near 2m", "Near 70cm"]
+    cp_from_files = k7abd.Codeplug_from_k7abd(tmp_path)
+    assert [(ch.name, ch.frequency, ch.tone_encode) for ch in cp.channels] == [
+        (ch.name, ch.frequency, ch.tone_encode) for ch in cp_from_files.channels
+    ]
+
+
+def test_zones_to_analog_shared_channels(monkeypatch, make_repeaters):
+    monkeypatch.setattr(
+        repeaterbook,
+        "load_cached_repeaters",
+        lambda **kwargs: repeaterbook.RepeaterTable.from_results(make_repeaters()),
+    )
+    proximity_csv = [
+        "Zone Name,Lat,Long,Distance,Unit,Band(2m;1.25m;70cm)",
+        "Near,45.5,-122.6,20,miles,2m;70cm",
+        "Nearer,45.5,-122.6,10,miles,2m;70cm",
+        "Nearer 2m,45.5,-122.6,10,miles,2m",
+    ]
+    analog_zones = repeaterbook.zones_to_analog(
+        proximity_csv, name_format="{Callsign} {Rptr ID}"
+    )
+    near, nearer, nearer_2m = (
+        channels for zones in analog_zones.values() for channels in zones.values()
+    )
+    near_by_name = {ch.name: ch for ch in near}
+    assert nearer and all(near_by_name[ch.name] is ch for ch in nearer)
+    assert nearer_2m and all(ch in nearer for ch in nearer_2m)
+    assert all(near_by_name[ch.name] is ch for ch in nearer_2m)
+
+    # the codeplug has one channel per repeater, referenced by every zone
+    cp = k7abd.Codeplug_from_zone_dicts(
+        {zname: chs for zones in analog_zones.values() for zname, chs in zones.items()}
+    )
+    assert len(cp.channels) == len(near)
+    zones = {z.name: z for z in cp.zones}
+    near_channels = {ch.name: ch for ch in zones["Near"].channels_a}
+    assert all(near_channels[ch.name] is ch for ch in zones["Nearer"].channels_a)
+
+
+def test_iter_zone_rows_memo(tmp_path, monkeypatch, make_repeaters):
+    table = repeaterbook.RepeaterTable.from_results(make_repeaters())
+    table.digest = "v1"
+    monkeypatch.setattr(repeaterbook, "load_cached_repeaters", lambda **kwargs: table)
+    proximity_csv = [
+        "Zone Name,Lat,Long,Distance,Unit,Band(2m;1.25m;70cm),Use",
+        "Near 2m,45.5,-122.6,20,miles,2m,OPEN",
+        "Near 70cm,45.5,-122.6,20,miles,70cm,CLOSED",
+    ]
+    memo_dir = tmp_path / "memo"
+    filtered = []
+    filter_indices = repeaterbook._filter_indices
+
+    def counting_filter_indices(repeaters, zone, ranges=None):
+        filtered.append(zone)
+        return filter_indices(repeaters, zone, ranges=ranges)
+
+    monkeypatch.setattr(repeaterbook, "_filter_indices", counting_filter_indices)
+
+    def zone_rows(csv_lines):
+        return list(repeaterbook.iter_zone_rows(csv_lines, memo_dir=memo_dir))
+
+    expected = zone_rows(proximity_csv)
+    assert len(filtered) == 2
+    assert all(rows for _, _, rows in expected)
+    # unchanged zones and data are not filtered again
+    assert zone_rows(proximity_csv) == expected
+    assert len(filtered) == 2
+    # only the changed zone is filtered
+    changed = zone_rows(
+        proximity_csv[:2] + ["Near 70cm,45.5,-122.6,10,miles,70cm,CLOSED"]
+    )
+    assert changed[0] == expected[0]
+    assert len(changed[1][2]) < len(expected[1][2])
+    assert len(filtered) == 3
+    # everything is filtered again when the data changes
+    table.digest = "v2"
+    assert zone_rows(proximity_csv) == expected
+    assert len(filtered) == 5
+    # results of other datasets (like other states) are kept
+    table.digest = "v1"
+    assert zone_rows(proximity_csv) == expected
+    assert len(filtered) == 5
+    monkeypatch.setattr(repeaterbook, "REPEATERBOOK_PROXIMITY_MEMO_KEEP", 1)
+    table.digest = "v3"
+    zone_rows(proximity_csv)
+    assert [p.name for p in memo_dir.glob("*.json.gz")] == ["v3.json.gz"]
+
+    # results saved by concurrent runs are merged
+    memos = [repeaterbook.ProximityMemo.load(memo_dir, "v2") for _ in range(2)]
+    memos[0].set({"Zone": "a"}, None, [1])
+    memos[1].set({"Zone": "b"}, None, [2])
+    for memo in memos:
+        memo.save()
+    memo = repeaterbook.ProximityMemo.load(memo_dir, "v2")
+    assert (memo.get({"Zone": "a"}), memo.get({"Zone": "b"})) == ([1], [2])
+
+
+def test_repeater_index_matching(caplog, make_repeaters):
+    repeaters = make_repeaters(steps=2)
+    repeaters.append(dict(R1[0], **{"Rptr ID": "gmrs", "Frequency": "462.55000"}))
+    index = repeaterbook.RepeaterIndex(repeaters)
+    assert index.matching() is None
+    bands = [AmateurBands.B_2m, AmateurBands.B_70cm]
+    criteria = {"Use": "open", "Operational Status": "ON-AIR"}
+    matching = index.matching(bands=bands, criteria=criteria)
+    assert matching == {
+        ix
+        for ix, r in enumerate(repeaters)
+        if repeaterbook.matches_criteria(r, criteria)
+        and r["Frequency"] != "462.55000"
+    }
+    assert index.matching(criteria={"Not A Field": ""}) == set(range(len(repeaters)))
+    assert index.matching(ranges=[(144.0, 148.0)]) == {
+        ix for ix, r in enumerate(repeaters) if r["Frequency"] == "146.94000"
+    }
+
+    zone = {
+        repeaterbook.CSV_LAT: "45.5",
+        repeaterbook.CSV_LONG: "-122.6",
+        repeaterbook.CSV_DISTANCE: "",
+        repeaterbook.CSV_UNIT: "",
+        repeaterbook.CSV_BAND: "70cm",
+    }
+    assert repeaters[-1] not in repeaterbook.filter_repeaters(index, zone)
+    assert "('41', 'gmrs') with non-amateur frequency" in caplog.text
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 1 << 16))
+def test_iter_json_results(chunk_size, make_repeaters):
+    repeaters = make_repeaters(steps=1)
+    repeaters[0]["Landmark"] = 'Mt "Scott" [}{], \\ 1'
+    text = json.dumps({"count": len(repeaters), "results": repeaters, "x": 1.25})
+    assert (
+        list(
+            repeaterbook.iter_json_results(io.StringIO(text), chunk_size=chunk_size)
+        )
+        == repeaters
+    )
+    assert list(repeaterbook.iter_json_results(io.StringIO('{"results":[]}'))) == []
+    with pytest.raises(ValueError):
+        list(repeaterbook.iter_json_results(io.StringIO('{"count": 0}')))
+    with pytest.raises(ValueError):
+        list(repeaterbook.iter_json_results(io.StringIO(text[:-40])))
+
+
+def test_cached_table_retained_fields(
+    http_server, tmp_path, monkeypatch, make_repeaters
+):
+    repeaters = make_repeaters(steps=1)
+    http_server.routes["/api?state=Oregon"] = (
+        200,
+        {},
+        json.dumps({"results": repeaters}).encode("utf-8"),
+    )
+    url = http_server.url + "/api?state=Oregon"
+    monkeypatch.setattr(
+        repeaterbook, "REPEATERBOOK_RATE_LIMIT", fetch.TokenBucket(interval=0)
+    )
+
+    fields = repeaterbook.used_fields("{Callsign} {Landmark!s:.5}")
+    assert {"Callsign", "Landmark", "Lat", "Rptr ID"} <= fields
+    assert "County" not in fields
+    table, _ = repeaterbook.cached_table(url, cache_dir=tmp_path, fields=fields)
+    assert set(table.fields) == fields
+    assert [set(r) for r in table] == [fields] * len(repeaters)
+
+    # compact cache is reused if it has the fields, otherwise rebuilt
+    table, _ = repeaterbook.cached_table(
+        url, cache_dir=tmp_path, fields={"Callsign", "Lat"}
+    )
+    assert table.retained == fields
+    table, _ = repeaterbook.cached_table(
+        url, cache_dir=tmp_path, fields={"County"}
+    )
+    assert table.retained == fields | {"County"}
+    table, _ = repeaterbook.cached_table(url, cache_dir=tmp_path)
+    assert table.retained is None
+    assert list(table) == repeaters
+    assert len(http_server.requests) == 1
+
+
+def test_filter_repeaters_route(vectorized, make_repeaters):
+    repeaters = make_repeaters(steps=8)
+    index = repeaterbook.RepeaterIndex(repeaters)
+    route_text = "45.0,-123.2; 45.5 -122.6;46.0,-122.5"
+    route = repeaterbook.parse_route(route_text)
+    assert route == ((45.0, -123.2), (45.5, -122.6), (46.0, -122.5))
+    zone = {
+        repeaterbook.CSV_LAT: "",
+        repeaterbook.CSV_LONG: "",
+        repeaterbook.CSV_DISTANCE: "5",
+        repeaterbook.CSV_UNIT: "miles",
+        repeaterbook.CSV_BAND: "2m",
+        repeaterbook.CSV_ROUTE: route_text,
+        "Use": "open",
+    }
+    matching = repeaterbook.filter_repeaters(index, zone)
+    along = index.along_route(route, 5, "miles")
+    assert [repeaters[ix] for _, _, ix in along if repeaters[ix] in matching] == (
+        matching
+    )
+    # ordered by position along the route, all within the buffer
+    assert [p for p, _, _ in along] == sorted(p for p, _, _ in along)
+    assert all(d.miles <= 5 for _, d, _ in along)
+
+    # compare with distances to points sampled densely along the route
+    samples = [
+        (a[0] + (b[0] - a[0]) * i / 50, a[1] + (b[1] - a[1]) * i / 50)
+        for a, b in zip(route, route[1:])
+        for i in range(51)
+    ]
+    found = {ix for _, _, ix in along}
+    for ix, r in enumerate(repeaters[:-1]):
+        sampled = min(
+            geopy.distance.great_circle(p, (r["Lat"], r["Long"])).miles
+            for p in samples
+        )
+        if sampled < 4.5:
+            assert ix in found
+        elif ix in found:
+            assert sampled < 5.5
+    assert found
+    assert not repeaterbook.used_fields(zones=[zone]) & {repeaterbook.CSV_ROUTE}
+
+
+def test_states_for_zones():
+    states = ("Washington", "Oregon", "idaho", "California", "Atlantis")
+    zones = [
+        {
+            repeaterbook.CSV_LAT: lat,
+            repeaterbook.CSV_LONG: long,
+            repeaterbook.CSV_DISTANCE: radius,
+            repeaterbook.CSV_UNIT: "miles",
+        }
+        for lat, long, radius in (
+            ("47.6", "-122.3", "30"),  # Seattle
+            ("43.5", "-112.0", "30"),  # Idaho Falls
+        )
+    ]
+    assert repeaterbook.states_for_zones(states, zones) == (
+        "Washington",
+        "idaho",
+        "Atlantis",
+    )
+    # Portland reaches into Washington
+    zones[0].update({repeaterbook.CSV_LAT: "45.5", repeaterbook.CSV_LONG: "-122.7"})
+    assert repeaterbook.states_for_zones(states, zones[:1]) == (
+        "Washington",
+        "Oregon",
+        "Atlantis",
+    )
+    route = dict(zones[0], **{repeaterbook.CSV_ROUTE: "40.8,-124.1;38.6,-121.5"})
+    assert repeaterbook.states_for_zones(states, [route]) == (
+        "California",
+        "Atlantis",
+    )
+    # zones without a distance may match repeaters anywhere
+    unbounded = dict(zones[0], **{repeaterbook.CSV_DISTANCE: ""})
+    assert repeaterbook.states_for_zones(states, zones + [unbounded]) == states
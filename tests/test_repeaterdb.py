@@ -0,0 +1,111 @@
+import pytest
+
+from dzcb import repeaterbook, repeaterdb
+
+
+def zone(**fields):
+    z = {
+        repeaterbook.CSV_LAT: "45.5",
+        repeaterbook.CSV_LONG: "-122.6",
+        repeaterbook.CSV_DISTANCE: "20",
+        repeaterbook.CSV_UNIT: "miles",
+        repeaterbook.CSV_BAND: "2m;70cm",
+    }
+    z.update(fields)
+    return z
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = repeaterdb.RepeaterDB(tmp_path / "repeaters.sqlite")
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize(
+    "test_zone",
+    (
+        zone(),
+        zone(**{"Use": "open", repeaterbook.CSV_BAND: "70cm"}),
+        zone(**{"Operational Status": "ON-AIR", "County": "clackamas"}),
+        # without a distance, Lat and Long would be matched as criteria
+        {
+            k: v
+            for k, v in zone(**{repeaterbook.CSV_DISTANCE: "", "Use": "CLOSED"}).items()
+            if k not in (repeaterbook.CSV_LAT, repeaterbook.CSV_LONG)
+        },
+        zone(
+            **{
+                repeaterbook.CSV_ROUTE: "45.0,-123.2;45.5,-122.6;46.0,-122.5",
+                repeaterbook.CSV_DISTANCE: "3",
+            }
+        ),
+    ),
+)
+def test_filter_repeaters(db, test_zone, make_repeaters):
+    repeaters = make_repeaters()
+    assert db.update_shard("Oregon", "v1", lambda: repeaters) == len(repeaters)
+    expected = repeaterbook.filter_repeaters(repeaters, test_zone)
+    assert expected
+    assert db.filter_repeaters(test_zone, ["Oregon"]) == expected
+    ranges = [(144.0, 146.0), (146.5, 148.0), (440.0, 445.0)]
+    assert db.filter_repeaters(
+        test_zone, ["Oregon"], ranges=ranges
+    ) == repeaterbook.filter_repeaters(repeaters, test_zone, ranges=ranges)
+    assert db.filter_repeaters(test_zone, ["Washington"]) == []
+
+
+def test_update_shard(db, tmp_path, make_repeaters):
+    repeaters = make_repeaters(steps=2)
+    assert db.update_shard("Oregon", "v1", lambda: repeaters) == len(repeaters)
+    # unchanged source is skipped
+    assert db.update_shard("Oregon", "v1", lambda: 1 / 0) is None
+
+    updated = [dict(r) for r in repeaters[2:]]
+    updated[0]["Use"] = "CLOSED"
+    assert db.update_shard("Oregon", "v2", lambda: updated) == len(updated)
+    everything = zone(**{repeaterbook.CSV_DISTANCE: "", repeaterbook.CSV_BAND: ""})
+    assert db.candidates(everything, ["Oregon"]) == updated
+
+    # the database is shared with other connections
+    other = repeaterdb.RepeaterDB(tmp_path / "repeaters.sqlite")
+    assert other.shard_source_key("Oregon") == "v2"
+    assert other.candidates(zone(Use="closed"), ["Oregon"])[0] == updated[0]
+    other.close()
+
+
+def test_missing_criteria_field(db, make_repeaters):
+    repeaters = make_repeaters(steps=1)
+    del repeaters[0]["Operational Status"]
+    db.update_shard("Oregon", "v1", lambda: repeaters)
+    # a missing field matches an empty criteria value, as in memory
+    for status in ("", "on-air"):
+        test_zone = zone(**{"Operational Status": status})
+        expected = repeaterbook.filter_repeaters(repeaters, test_zone)
+        assert expected
+        assert db.filter_repeaters(test_zone, ["Oregon"]) == expected
+
+
+def test_shards_share_repeaters(db, make_repeaters):
+    repeaters = make_repeaters(steps=1)
+    test_zone = zone()
+    expected = repeaterbook.filter_repeaters(repeaters, test_zone)
+    db.update_shard("Oregon", "k", lambda: repeaters)
+    # state names are not case sensitive
+    assert db.update_shard("oregon", "k", lambda: 1 / 0) is None
+    # another shard listing the same repeaters doesn't take them over
+    assert db.update_shard("Washington", "k", lambda: repeaters) == len(repeaters)
+    assert db.filter_repeaters(test_zone, ["Oregon"]) == expected
+    assert db.filter_repeaters(test_zone, ["Washington"]) == expected
+
+
+def test_records_without_id(db, make_repeaters, caplog):
+    repeaters = make_repeaters(steps=1)
+    for r in repeaters:
+        del r["Rptr ID"]
+    assert db.update_shard("Oregon", "v1", lambda: repeaters) == len(repeaters)
+    everything = zone(**{repeaterbook.CSV_DISTANCE: "", repeaterbook.CSV_BAND: ""})
+    assert db.candidates(everything, ["Oregon"]) == repeaters
+    # the record without coordinates is only matched by zones without a location
+    assert "bogus coordinates" in caplog.text
+    assert repeaters[-1] not in db.candidates(zone(), ["Oregon"])
@@ -0,0 +1,46 @@
+import pytest
+
+from dzcb import fetch, seattledmr
+from dzcb.munge import RewriteRules
+
+
+def test_rewrite_rules():
+    rules = RewriteRules.from_csv(
+        ["Pattern,Repl", "Wash ([0-9])\\b,Washington \\1", "Wash,WA", "WA,Wash"]
+    )
+    # one pass: replaced text is not rewritten again by later rules
+    assert rules.sub("Wash 1, Wash 22, Wash, WA") == "Washington 1, WA 22, WA, Wash"
+    assert list(rules.sub_lines(["Wash 2\n", "\n"])) == ["Washington 2\n", "\n"]
+    assert RewriteRules().sub("Wash") == "Wash"
+    assert (RewriteRules([("a", "b")]) + RewriteRules([("b", "c")])).sub("ab") == "bc"
+    with pytest.raises(TypeError):
+        RewriteRules() + [("a", "b")]
+
+
+def test_cache_repeaters(http_server, tmp_path, monkeypatch):
+    http_server.routes["/repeaters.csv"] = (
+        200,
+        {},
+        "Zone Name\r\nBayNet PNWR\r\nWash 1 Café\r\n".encode("latin-1"),
+    )
+    http_server.routes["/talkgroups.csv"] = (200, {}, b"Link1,1\nLink22,22\n")
+    monkeypatch.setattr(fetch, "HTTP_CACHE_DIR", tmp_path / "http")
+    monkeypatch.setattr(
+        seattledmr, "SEATTLE_DMR_REPEATERS", [http_server.url + "/repeaters.csv"]
+    )
+    monkeypatch.setattr(
+        seattledmr, "SEATTLE_DMR_TALKGROUPS", [http_server.url + "/talkgroups.csv"]
+    )
+    seattledmr.cache_repeaters(
+        tmp_path, repeater_fixups=RewriteRules([("Café", "Cafe")])
+    )
+    assert (tmp_path / seattledmr.REPEATER_FILENAME).read_bytes() == (
+        b"Zone Name\r\nBaynet PNW Rgnl 2\r\nWashington 1 Cafe\r\n"
+    )
+    assert (tmp_path / seattledmr.TALKGROUPS_FILENAME).read_text() == (
+        "Link 1,1\nLink 22,22\nTAC 8-2,8958\n"
+    )
+    # the encoding was detected while downloading
+    http_cache = fetch.HTTPCache(cache_dir=tmp_path / "http", offline=True)
+    resp = http_cache.get(seattledmr.SEATTLE_DMR_REPEATERS[0])
+    assert resp.stored_encoding == resp.encoding == "latin-1"
@@ -36,3 +36,33 @@ def test_getenv_bool(exp_env_bool, default):
         assert val is default
     else:
         assert val is exp_env_bool
+
+
+def test_NameAllocator():
+    allocator = dzcb.util.NameAllocator(["Foo", "Foo 1"])
+    assert allocator.allocate("Bar") == "Bar"
+    assert allocator.allocate_all(["Foo", "Foo", "Foo", "Bar"]) == [
+        "Foo 0",
+        "Foo 2",
+        "Foo 3",
+        "Bar 0",
+    ]
+    assert allocator.names == {
+        "Foo",
+        "Foo 0",
+        "Foo 1",
+        "Foo 2",
+        "Foo 3",
+        "Bar",
+        "Bar 0",
+    }
+
+
+def test_NameAllocator_log_deduped(caplog):
+    allocator = dzcb.util.NameAllocator()
+    allocator.allocate_all(["Foo"] * 100)
+    allocator.log_deduped()
+    assert len(caplog.records) == 1
+    assert "'Foo' -> 'Foo 0' (and 98 more)" in caplog.records[0].getMessage()
+    allocator.log_deduped()
+    assert len(caplog.records) == 1